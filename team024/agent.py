@@ -0,0 +1,24 @@
+"""Remote agent entry point - watches files and ships events to a central FIM server"""
+import signal
+from config import INGEST_URL, WATCH_DIRECTORY, AGENT_ID
+from watcher import DirectoryWatcher
+
+
+def main():
+    """Run the watcher without a local database, shipping events to FIM_INGEST_URL"""
+    if not INGEST_URL:
+        raise SystemExit("[AGENT] Set FIM_INGEST_URL to the server's /api/ingest URL")
+    
+    print(f"[AGENT] Agent {AGENT_ID} shipping events to {INGEST_URL}")
+    print(f"[AGENT] Watch directory: {WATCH_DIRECTORY}")
+    
+    def handle_sigterm(signum, frame):
+        raise KeyboardInterrupt
+    signal.signal(signal.SIGTERM, handle_sigterm)
+    
+    watcher = DirectoryWatcher(None, ingest_url=INGEST_URL)
+    watcher.start()
+
+
+if __name__ == "__main__":
+    main()
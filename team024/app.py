@@ -33,4 +33,5 @@ register_routes(app)
 with app.app_context():
     import models
     db.create_all()
+    models.upgrade_schema()
     print("[DB] PostgreSQL database tables created successfully")
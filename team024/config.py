@@ -21,3 +21,92 @@ TELEGRAM_BOT_TOKEN = os.environ.get("TELEGRAM_BOT_TOKEN", "")
 TELEGRAM_CHAT_ID = os.environ.get("TELEGRAM_CHAT_ID", "")
 
 CLASSIFICATION_LEVELS = ["Unclassified", "Confidential", "Secret", "Top Secret"]
+
+# Hashing work scheduler: one classification level is worth this many seconds
+# of queue wait, so Unclassified work is never starved by classified bursts.
+PRIORITY_AGING_SECONDS = float(os.environ.get("FIM_PRIORITY_AGING_SECONDS", "30"))
+# Comma-separated "pattern=weight" rules (fnmatch), e.g. "/etc/*=2,*.log=-1"
+PRIORITY_PATH_RULES = [
+    (rule.split("=", 1)[0].strip(), float(rule.split("=", 1)[1]))
+    for rule in os.environ.get("FIM_PRIORITY_PATHS", "").split(",")
+    if "=" in rule
+]
+CLASSIFICATION_REFRESH_SECONDS = 30
+
+# Hashing I/O budget in bytes/second (0 = unlimited). The business-hours rate
+# applies between BUSINESS_HOURS_START and BUSINESS_HOURS_END local time.
+HASH_IO_BUSINESS_RATE = int(os.environ.get("FIM_HASH_IO_BUSINESS_RATE", str(20 * 1024 * 1024)))
+HASH_IO_OFFHOURS_RATE = int(os.environ.get("FIM_HASH_IO_OFFHOURS_RATE", "0"))
+BUSINESS_HOURS_START = int(os.environ.get("FIM_BUSINESS_HOURS_START", "8"))
+BUSINESS_HOURS_END = int(os.environ.get("FIM_BUSINESS_HOURS_END", "18"))
+HASH_CHUNK_SIZE = 1024 * 1024
+
+# Durable event spool: events are appended here before reaching the database
+SPOOL_DIRECTORY = os.environ.get("FIM_SPOOL_DIRECTORY", os.path.join(BASE_DIR, "spool"))
+SPOOL_SEGMENT_BYTES = 16 * 1024 * 1024
+SPOOL_FSYNC_INTERVAL = 0.05
+SPOOL_DRAIN_BATCH = 500
+SPOOL_SHUTDOWN_TIMEOUT = 10
+# Attempts before an event that keeps failing is moved to the spool's dead-letter file
+SPOOL_MAX_ATTEMPTS = 5
+
+# Memory budget (bytes) for queued work and caches; the hashing queue spills
+# to SPILL_DIRECTORY once it is exhausted
+MEMORY_BUDGET_BYTES = int(os.environ.get("FIM_MEMORY_BUDGET_BYTES", str(64 * 1024 * 1024)))
+SPILL_DIRECTORY = os.environ.get("FIM_SPILL_DIRECTORY", os.path.join(BASE_DIR, "spool", "spill"))
+
+API_EVENTS_MAX_PAGE_SIZE = 1000
+# Reverse content-hash lookups: hashes per request, and occurrences returned per hash
+HASH_LOOKUP_MAX_HASHES = 10000
+HASH_LOOKUP_MAX_OCCURRENCES = 1000
+EXPORT_BATCH_SIZE = 5000
+
+# Events are range-partitioned by timestamp, one partition per period
+# ("day" or "month"). Partitions older than EVENT_RETENTION_DAYS (0 = keep
+# forever) are dropped, or detached and kept as plain tables with "detach".
+EVENT_PARTITION_PERIOD = os.environ.get("FIM_EVENT_PARTITION_PERIOD", "month")
+EVENT_PARTITIONS_AHEAD = 2
+EVENT_RETENTION_DAYS = int(os.environ.get("FIM_EVENT_RETENTION_DAYS", "0"))
+EVENT_RETENTION_MODE = os.environ.get("FIM_EVENT_RETENTION_MODE", "drop")
+
+# Remote agents (agent.py) ship spooled events to a central server's
+# /api/ingest as gzip NDJSON batches of up to SHIP_BATCH_EVENTS events or
+# SHIP_BATCH_BYTES of JSON, sending a partial batch once its oldest event has
+# waited SHIP_BATCH_SECONDS. When INGEST_TOKEN is set the server requires it
+# as a bearer token and agents send it.
+INGEST_URL = os.environ.get("FIM_INGEST_URL", "")
+INGEST_TOKEN = os.environ.get("FIM_INGEST_TOKEN", "")
+SHIP_BATCH_EVENTS = int(os.environ.get("FIM_SHIP_BATCH_EVENTS", "1000"))
+SHIP_BATCH_BYTES = int(os.environ.get("FIM_SHIP_BATCH_BYTES", str(1024 * 1024)))
+SHIP_BATCH_SECONDS = float(os.environ.get("FIM_SHIP_BATCH_SECONDS", "2"))
+SHIP_REQUEST_TIMEOUT = 30
+INGEST_MAX_EVENTS = 10000
+# Decompressed body size limit
+INGEST_MAX_BYTES = 32 * 1024 * 1024
+# Ingested events must be timestamped within this window around the server's clock
+INGEST_MAX_AGE_DAYS = int(os.environ.get("FIM_INGEST_MAX_AGE_DAYS", "365"))
+INGEST_MAX_FUTURE_SECONDS = 24 * 3600
+
+# Ingestion gateway (gateway.py): an asyncio front end serving /api/ingest
+# for large agent fleets. Agent connections are kept alive for
+# GATEWAY_KEEPALIVE_SECONDS between requests. Accepted batches wait in memory
+# until one of GATEWAY_WRITERS writers stores them, up to
+# GATEWAY_COALESCE_EVENTS events per transaction. Once the waiting events
+# would take GATEWAY_MAX_QUEUE_SECONDS to write at the recent rate (kept well
+# under the agents' SHIP_REQUEST_TIMEOUT), GATEWAY_MAX_PENDING_EVENTS events
+# are waiting, GATEWAY_MAX_PENDING_BYTES of request bodies are held, or
+# GATEWAY_MAX_CONNECTIONS agents are connected, agents get 503 with a
+# Retry-After estimated from the write rate, before their body is read; an
+# agent sending a second batch before the first is acked gets 429.
+GATEWAY_HOST = os.environ.get("FIM_GATEWAY_HOST", "0.0.0.0")
+GATEWAY_PORT = int(os.environ.get("FIM_GATEWAY_PORT", "5001"))
+GATEWAY_WRITERS = int(os.environ.get("FIM_GATEWAY_WRITERS", "4"))
+GATEWAY_COALESCE_EVENTS = int(os.environ.get("FIM_GATEWAY_COALESCE_EVENTS", "5000"))
+GATEWAY_MAX_PENDING_EVENTS = int(os.environ.get("FIM_GATEWAY_MAX_PENDING_EVENTS", "100000"))
+GATEWAY_MAX_QUEUE_SECONDS = float(os.environ.get("FIM_GATEWAY_MAX_QUEUE_SECONDS", "10"))
+GATEWAY_MAX_PENDING_BYTES = int(os.environ.get("FIM_GATEWAY_MAX_PENDING_BYTES", str(256 * 1024 * 1024)))
+GATEWAY_MAX_CONNECTIONS = int(os.environ.get("FIM_GATEWAY_MAX_CONNECTIONS", "10000"))
+GATEWAY_KEEPALIVE_SECONDS = 75
+GATEWAY_REQUEST_TIMEOUT = 30
+GATEWAY_RETRY_AFTER_MAX_SECONDS = 30
+GATEWAY_SHUTDOWN_TIMEOUT = 10
@@ -0,0 +1,86 @@
+"""In-process id cache for the paths, endpoints and hosts dimension tables"""
+import threading
+from typing import Dict, Iterable, List
+
+from memory import memory_budget
+from models import FilePath, Endpoint, Host, dimension_id, dimension_ids
+
+# Approximate dict entry + key + int cost of a cached value
+CACHE_ENTRY_OVERHEAD = 120
+
+
+class DimensionCache:
+    """Maps the values of one dimension column to their ids.
+
+    Unknown values are looked up (and inserted if new) in the database.
+    Entries are charged to the memory budget; once it is exhausted the cache
+    stops growing and further misses go to the database.
+    """
+
+    def __init__(self, model, column_name: str):
+        self.model = model
+        self.column_name = column_name
+        self._ids: Dict[str, int] = {}
+        self._lock = threading.Lock()
+
+    def id_for(self, value: str) -> int:
+        with self._lock:
+            cached = self._ids.get(value)
+        if cached is not None:
+            return cached
+
+        row_id = dimension_id(self.model, self.column_name, value)
+        with self._lock:
+            if value not in self._ids and memory_budget.reserve('dimension_cache', len(value) + CACHE_ENTRY_OVERHEAD):
+                self._ids[value] = row_id
+        return row_id
+
+    def ids_for(self, values: Iterable[str]) -> Dict[str, int]:
+        """Ids of many values; the misses are resolved together in a few queries"""
+        ids = {}
+        missing = []
+        with self._lock:
+            for value in set(values):
+                cached = self._ids.get(value)
+                if cached is None:
+                    missing.append(value)
+                else:
+                    ids[value] = cached
+        if not missing:
+            return ids
+
+        found = dimension_ids(self.model, self.column_name, missing)
+        ids.update(found)
+        with self._lock:
+            for value, row_id in found.items():
+                if value not in self._ids and memory_budget.reserve('dimension_cache', len(value) + CACHE_ENTRY_OVERHEAD):
+                    self._ids[value] = row_id
+        return ids
+
+
+paths = DimensionCache(FilePath, 'path')
+endpoints = DimensionCache(Endpoint, 'name')
+hosts = DimensionCache(Host, 'hostname')
+
+
+def event_dimensions(file_path: str, endpoint: str, hostname: str) -> Dict:
+    """Event constructor arguments: the dimension ids and the values they stand for"""
+    return {
+        'path_id': paths.id_for(file_path),
+        'endpoint_id': endpoints.id_for(endpoint),
+        'host_id': hosts.id_for(hostname),
+        'file_path': file_path,
+        'endpoint': endpoint,
+        'hostname': hostname,
+    }
+
+
+def add_event_dimensions(events: List[Dict]) -> None:
+    """Set path_id, endpoint_id and host_id on event dicts, resolving each dimension in bulk"""
+    path_ids = paths.ids_for(event['file_path'] for event in events)
+    endpoint_ids = endpoints.ids_for(event['endpoint'] for event in events)
+    host_ids = hosts.ids_for(event['hostname'] for event in events)
+    for event in events:
+        event['path_id'] = path_ids[event['file_path']]
+        event['endpoint_id'] = endpoint_ids[event['endpoint']]
+        event['host_id'] = host_ids[event['hostname']]
@@ -0,0 +1,115 @@
+"""Streaming exports of large tables as NDJSON, CSV or columnar blocks"""
+import csv
+import io
+import json
+import zlib
+from datetime import datetime
+from typing import Any, Dict, Iterable, Iterator, List, Sequence
+
+from app import db
+from config import EXPORT_BATCH_SIZE
+
+# format -> (mimetype, file extension)
+EXPORT_FORMATS = {
+    "ndjson": ("application/x-ndjson", "ndjson"),
+    "csv": ("text/csv", "csv"),
+    "columnar": ("application/x-ndjson", "columns.ndjson"),
+}
+
+
+def stream_partitions(statement, batch_size: int = EXPORT_BATCH_SIZE) -> Iterator[List[Sequence]]:
+    """Batches of rows for a Core select, fetched through a server-side cursor"""
+    result = db.session.execute(statement.execution_options(yield_per=batch_size))
+    try:
+        for partition in result.partitions():
+            yield partition
+    finally:
+        result.close()
+
+
+def _plain(value: Any) -> Any:
+    return value.isoformat() if isinstance(value, datetime) else value
+
+
+def ndjson_chunks(columns: List[str], partitions: Iterable[List[Sequence]]) -> Iterator[bytes]:
+    """One JSON object per row, one chunk per batch"""
+    for rows in partitions:
+        yield "".join(
+            json.dumps(dict(zip(columns, map(_plain, row))), separators=(",", ":")) + "\n"
+            for row in rows
+        ).encode()
+
+
+def csv_chunks(columns: List[str], partitions: Iterable[List[Sequence]]) -> Iterator[bytes]:
+    """CSV with a header row; NULL is written as an empty field"""
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(columns)
+    for rows in partitions:
+        writer.writerows([_plain(value) for value in row] for row in rows)
+        yield buffer.getvalue().encode()
+        buffer.seek(0)
+        buffer.truncate()
+    if buffer.tell():
+        yield buffer.getvalue().encode()
+
+
+def _encode_column(values: List[Any]) -> Any:
+    """Plain value list, or dictionary codes for repetitive string columns"""
+    distinct = {}
+    for value in values:
+        if not isinstance(value, str) and value is not None:
+            return values
+        if value not in distinct:
+            distinct[value] = len(distinct)
+            if len(distinct) * 2 > len(values):
+                return values
+    return {"dict": list(distinct), "codes": [distinct[value] for value in values]}
+
+
+def columnar_chunks(columns: List[str], partitions: Iterable[List[Sequence]]) -> Iterator[bytes]:
+    """One JSON line per batch holding each column as an array.
+
+    String columns with few distinct values in the batch (endpoints, hosts,
+    event types) are dictionary encoded as {"dict": [...], "codes": [...]}.
+    """
+    yield (json.dumps({"columns": columns}, separators=(",", ":")) + "\n").encode()
+    for rows in partitions:
+        data = [_encode_column([_plain(value) for value in column]) for column in zip(*rows)]
+        block = {"rows": len(rows), "data": data}
+        yield (json.dumps(block, separators=(",", ":")) + "\n").encode()
+
+
+def json_array_chunks(items: Iterable[Dict], batch_size: int = EXPORT_BATCH_SIZE) -> Iterator[bytes]:
+    """A JSON array streamed in batches of items"""
+    yield b"["
+    batch = []
+    first = True
+    for item in items:
+        batch.append(json.dumps(item))
+        if len(batch) >= batch_size:
+            yield (("" if first else ",") + ",".join(batch)).encode()
+            first = False
+            batch = []
+    if batch:
+        yield (("" if first else ",") + ",".join(batch)).encode()
+    yield b"]"
+
+
+def gzip_chunks(chunks: Iterable[bytes], level: int = 6) -> Iterator[bytes]:
+    """Gzip-compress a chunk stream without buffering it"""
+    compressor = zlib.compressobj(level, zlib.DEFLATED, 31)
+    for chunk in chunks:
+        compressed = compressor.compress(chunk)
+        if compressed:
+            yield compressed
+    yield compressor.flush()
+
+
+def export_chunks(export_format: str, columns: List[str],
+                  partitions: Iterable[List[Sequence]]) -> Iterator[bytes]:
+    if export_format == "csv":
+        return csv_chunks(columns, partitions)
+    if export_format == "columnar":
+        return columnar_chunks(columns, partitions)
+    return ndjson_chunks(columns, partitions)
@@ -0,0 +1,354 @@
+"""Asyncio ingestion gateway - serves /api/ingest for large agent fleets
+
+The Flask dev server spends a thread on every request, so thousands of agents
+posting at once exhaust it. The gateway keeps every agent connection open on
+one event loop, decodes bodies on worker threads, queues the batches in
+memory and hands them to a few writer tasks. Each writer stores everything
+queued so far in one transaction. When too much is queued, agents are told
+to come back later (503 with Retry-After) before their bodies are read,
+instead of piling up requests.
+"""
+import asyncio
+import json
+import math
+import signal
+import time
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from http import HTTPStatus
+from typing import Dict, List, Optional, Tuple
+
+from app import app
+from config import (
+    GATEWAY_HOST, GATEWAY_PORT, GATEWAY_WRITERS, GATEWAY_COALESCE_EVENTS,
+    GATEWAY_MAX_PENDING_EVENTS, GATEWAY_MAX_PENDING_BYTES, GATEWAY_MAX_QUEUE_SECONDS,
+    GATEWAY_MAX_CONNECTIONS, GATEWAY_KEEPALIVE_SECONDS,
+    GATEWAY_REQUEST_TIMEOUT, GATEWAY_RETRY_AFTER_MAX_SECONDS, GATEWAY_SHUTDOWN_TIMEOUT,
+    INGEST_TOKEN, INGEST_MAX_BYTES, INGEST_MAX_EVENTS,
+)
+from ingest import INGEST_FORMATS, decode_batch, ingest_batch, ingest_batches
+
+# Longest request head (request line and headers) accepted
+MAX_HEAD_BYTES = 64 * 1024
+
+
+class PendingBatch:
+    """A decoded batch waiting for a writer, and the future its request awaits"""
+
+    def __init__(self, agent_id: str, batch_id: str, records: List, future: asyncio.Future):
+        self.agent_id = agent_id
+        self.batch_id = batch_id
+        self.records = records
+        self.future = future
+
+
+class IngestGateway:
+    """HTTP/1.1 keep-alive server for /api/ingest backed by a pool of writer tasks.
+
+    Batches are acknowledged only once stored, exactly as by the Flask route.
+    A batch resent while it is still queued (after a client timeout) waits
+    for the same write. Each agent may have one batch in flight, so its
+    batches are stored in order.
+    """
+
+    def __init__(self, writers: int = GATEWAY_WRITERS):
+        self.writers = writers
+        self.queue: Optional[asyncio.Queue] = None
+        self.pending: Dict[Tuple[str, str], PendingBatch] = {}
+        self.busy_agents = set()
+        self.pending_events = 0
+        # Request bodies being read, decoded or stored
+        self.pending_bytes = 0
+        self.connections = 0
+        self._write_pool = ThreadPoolExecutor(writers, thread_name_prefix="gateway-writer")
+        # Events stored per second by all writers, smoothed
+        self.write_rate = 0.0
+        self.counters = Counter()
+
+    def retry_after(self) -> int:
+        """Seconds until the queued events should be written at the recent rate"""
+        if not self.write_rate:
+            return 1
+        seconds = math.ceil(self.pending_events / self.write_rate)
+        return max(1, min(seconds, GATEWAY_RETRY_AFTER_MAX_SECONDS))
+
+    def saturated(self, events: int) -> bool:
+        """Whether queueing this many more events would exceed the pending limits
+
+        A lone batch is always accepted so the gateway cannot refuse everything.
+        """
+        if not self.pending_events:
+            return False
+        pending = self.pending_events + events
+        if pending > GATEWAY_MAX_PENDING_EVENTS:
+            return True
+        return bool(self.write_rate) and pending / self.write_rate > GATEWAY_MAX_QUEUE_SECONDS
+
+    def admits_body(self, nbytes: int) -> bool:
+        """Whether to read a request body of nbytes, checked before reading it"""
+        if self.pending_bytes and self.pending_bytes + nbytes > GATEWAY_MAX_PENDING_BYTES:
+            return False
+        return not self.saturated(0)
+
+    def status(self) -> Dict:
+        return {
+            "connections": self.connections,
+            "pending_batches": len(self.pending),
+            "pending_events": self.pending_events,
+            "pending_bytes": self.pending_bytes,
+            "write_rate": round(self.write_rate, 1),
+            "writers": self.writers,
+            "counters": dict(self.counters),
+        }
+
+    # Writers
+
+    def _store(self, batches: List[PendingBatch]) -> List:
+        """Store the batches in one transaction; runs in a worker thread.
+
+        If the coalesced write fails, the batches are stored one by one so a
+        single bad batch only fails its own request. Returns an ack or the
+        exception for each batch.
+        """
+        with app.app_context():
+            try:
+                return ingest_batches([(b.agent_id, b.batch_id, b.records) for b in batches])
+            except Exception as e:
+                if len(batches) == 1:
+                    return [e]
+                print(f"[GATEWAY] Write of {len(batches)} coalesced batches failed, storing them one by one: {e}")
+
+            results = []
+            for batch in batches:
+                try:
+                    results.append(ingest_batch(batch.agent_id, batch.batch_id, batch.records))
+                except Exception as e:
+                    results.append(e)
+            return results
+
+    async def _writer(self) -> None:
+        while True:
+            batches = [await self.queue.get()]
+            events = len(batches[0].records)
+            while events < GATEWAY_COALESCE_EVENTS and not self.queue.empty():
+                batch = self.queue.get_nowait()
+                batches.append(batch)
+                events += len(batch.records)
+
+            started = time.monotonic()
+            results = await asyncio.get_running_loop().run_in_executor(self._write_pool, self._store, batches)
+            elapsed = max(time.monotonic() - started, 0.001)
+
+            written = 0
+            for batch, result in zip(batches, results):
+                del self.pending[(batch.agent_id, batch.batch_id)]
+                self.busy_agents.discard(batch.agent_id)
+                self.pending_events -= len(batch.records)
+                if isinstance(result, Exception):
+                    print(f"[GATEWAY] {batch.agent_id}: batch {batch.batch_id} not stored: {result}")
+                    self.counters["failed"] += 1
+                    batch.future.set_exception(result)
+                else:
+                    self.counters[result["status"]] += 1
+                    if result["status"] == "accepted":
+                        self.counters["events_inserted"] += result["inserted"]
+                        written += len(batch.records)
+                    batch.future.set_result(result)
+                self.queue.task_done()
+
+            # Duplicates and failures cost little, so only written batches inform the rate
+            if written:
+                rate = written / elapsed * self.writers
+                self.write_rate = rate if not self.write_rate else 0.8 * self.write_rate + 0.2 * rate
+
+    async def _submit(self, agent_id: str, batch_id: str, records: List) -> Tuple[int, Dict, Optional[int]]:
+        """Queue a batch unless the gateway is saturated, and wait for its ack"""
+        batch = self.pending.get((agent_id, batch_id))
+        if batch is None:
+            if agent_id in self.busy_agents:
+                self.counters["throttled"] += 1
+                return 429, {"success": False, "message": "Another batch from this agent is still being stored"}, self.retry_after()
+            if self.saturated(len(records)):
+                self.counters["busy"] += 1
+                return 503, {"success": False, "message": "Gateway is busy, retry later"}, self.retry_after()
+
+            batch = PendingBatch(agent_id, batch_id, records, asyncio.get_running_loop().create_future())
+            self.pending[(agent_id, batch_id)] = batch
+            self.busy_agents.add(agent_id)
+            self.pending_events += len(records)
+            self.queue.put_nowait(batch)
+
+        try:
+            ack = await asyncio.shield(batch.future)
+        except Exception as e:
+            return 503, {"success": False, "message": f"Could not store batch: {e}"}, self.retry_after()
+        return 200, ack, None
+
+    # HTTP
+
+    def _check(self, method: str, path: str, headers: Dict[str, str]) -> Optional[Tuple[int, Dict, Optional[int]]]:
+        """Response to send without reading the body, or None for a valid ingest request
+
+        The same header checks as the Flask route.
+        """
+        if path == "/health" and method == "GET":
+            return 200, self.status(), None
+        if path != "/api/ingest":
+            return 404, {"success": False, "message": "Not found"}, None
+        if method != "POST":
+            return 405, {"success": False, "message": "Method not allowed"}, None
+
+        if INGEST_TOKEN and headers.get("authorization") != f"Bearer {INGEST_TOKEN}":
+            return 401, {"success": False, "message": "Invalid ingest token"}, None
+        agent_id = headers.get("x-agent-id", "")
+        batch_id = headers.get("idempotency-key", "")
+        if not agent_id or len(agent_id) > 255 or not batch_id or len(batch_id) > 64:
+            return 400, {"success": False, "message": "X-Agent-Id and Idempotency-Key headers are required"}, None
+        mimetype = headers.get("content-type", "").split(";")[0].strip().lower()
+        if mimetype not in INGEST_FORMATS:
+            return 415, {"success": False, "message": f"Content-Type must be one of {', '.join(INGEST_FORMATS)}"}, None
+        return None
+
+    async def _ingest(self, headers: Dict[str, str], body: bytes) -> Tuple[int, Dict, Optional[int]]:
+        """Decode a checked request's body off the event loop and submit it"""
+        mimetype = headers["content-type"].split(";")[0].strip().lower()
+        try:
+            records = await asyncio.to_thread(decode_batch, body, mimetype, headers.get("content-encoding"))
+        except ValueError as e:
+            return 400, {"success": False, "message": str(e)}, None
+        if len(records) > INGEST_MAX_EVENTS:
+            return 413, {"success": False, "message": f"At most {INGEST_MAX_EVENTS} events per batch"}, None
+
+        return await self._submit(headers["x-agent-id"], headers["idempotency-key"], records)
+
+    async def _read_head(self, reader: asyncio.StreamReader):
+        """Method, path, headers and keep-alive flag of the next request; None once the connection is done"""
+        try:
+            data = await asyncio.wait_for(reader.readuntil(b"\r\n\r\n"), GATEWAY_KEEPALIVE_SECONDS)
+        except (asyncio.TimeoutError, asyncio.IncompleteReadError, asyncio.LimitOverrunError, ConnectionError):
+            return None
+
+        lines = data.decode("latin-1").split("\r\n")
+        try:
+            method, target, version = lines[0].split(" ")
+        except ValueError:
+            return None
+        headers = {}
+        for line in lines[1:]:
+            name, _, value = line.partition(":")
+            if name:
+                headers[name.strip().lower()] = value.strip()
+
+        connection = headers.get("connection", "").lower()
+        keep_alive = connection == "keep-alive" or (version == "HTTP/1.1" and connection != "close")
+        return method, target.split("?", 1)[0], headers, keep_alive
+
+    async def _respond(self, writer: asyncio.StreamWriter, status: int, payload: Dict,
+                       keep_alive: bool, retry_after: Optional[int] = None) -> None:
+        body = json.dumps(payload).encode()
+        head = [
+            f"HTTP/1.1 {status} {HTTPStatus(status).phrase}",
+            "Content-Type: application/json",
+            f"Content-Length: {len(body)}",
+        ]
+        if keep_alive:
+            head += ["Connection: keep-alive", f"Keep-Alive: timeout={GATEWAY_KEEPALIVE_SECONDS}"]
+        else:
+            head.append("Connection: close")
+        if retry_after is not None:
+            head.append(f"Retry-After: {retry_after}")
+        writer.write(("\r\n".join(head) + "\r\n\r\n").encode("latin-1") + body)
+        await writer.drain()
+
+    async def _handle(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        """Serve requests on one agent connection until it closes or idles out"""
+        if self.connections >= GATEWAY_MAX_CONNECTIONS:
+            self.counters["busy"] += 1
+            try:
+                await self._respond(writer, 503, {"success": False, "message": "Too many connections"},
+                                    False, self.retry_after())
+            except ConnectionError:
+                pass
+            writer.close()
+            return
+
+        self.connections += 1
+        try:
+            while True:
+                head = await self._read_head(reader)
+                if head is None:
+                    break
+                method, path, headers, keep_alive = head
+
+                length = headers.get("content-length", "0")
+                if "transfer-encoding" in headers or not length.isdigit():
+                    status, payload, retry_after = 411, {"success": False, "message": "Content-Length is required"}, None
+                    keep_alive = False
+                elif int(length) > INGEST_MAX_BYTES:
+                    status, payload, retry_after = 413, {"success": False, "message": f"Batch larger than {INGEST_MAX_BYTES} bytes"}, None
+                    keep_alive = False
+                else:
+                    length = int(length)
+                    response = self._check(method, path, headers)
+                    if response is None and not self.admits_body(length):
+                        self.counters["busy"] += 1
+                        response = 503, {"success": False, "message": "Gateway is busy, retry later"}, self.retry_after()
+                    if response is not None:
+                        status, payload, retry_after = response
+                        # The body is left unread, so the connection cannot be reused
+                        keep_alive = keep_alive and not length
+                    else:
+                        self.pending_bytes += length
+                        try:
+                            body = await asyncio.wait_for(reader.readexactly(length), GATEWAY_REQUEST_TIMEOUT)
+                            status, payload, retry_after = await self._ingest(headers, body)
+                        except (asyncio.TimeoutError, asyncio.IncompleteReadError):
+                            break
+                        finally:
+                            self.pending_bytes -= length
+
+                await self._respond(writer, status, payload, keep_alive, retry_after)
+                if not keep_alive:
+                    break
+        except (ConnectionError, asyncio.CancelledError):
+            # Cancelled at shutdown: agents resend whatever was not acked
+            pass
+        finally:
+            self.connections -= 1
+            writer.close()
+
+    async def serve(self, host: str = GATEWAY_HOST, port: int = GATEWAY_PORT) -> None:
+        """Serve until SIGINT or SIGTERM, then give the writers time to store what is queued"""
+        self.queue = asyncio.Queue()
+        writers = [asyncio.create_task(self._writer()) for _ in range(self.writers)]
+        server = await asyncio.start_server(
+            self._handle, host, port, limit=MAX_HEAD_BYTES, backlog=GATEWAY_MAX_CONNECTIONS
+        )
+
+        stop = asyncio.Event()
+        loop = asyncio.get_running_loop()
+        for sig in (signal.SIGINT, signal.SIGTERM):
+            loop.add_signal_handler(sig, stop.set)
+
+        print(f"[GATEWAY] Accepting agent batches on http://{host}:{port}/api/ingest with {self.writers} writer(s)")
+        await stop.wait()
+
+        print("\n[SHUTDOWN] Shutting down gateway...")
+        server.close()
+        try:
+            await asyncio.wait_for(self.queue.join(), GATEWAY_SHUTDOWN_TIMEOUT)
+        except asyncio.TimeoutError:
+            print(f"[GATEWAY] Shutdown timeout, {len(self.pending)} batch(es) not stored; agents will resend them")
+        for task in writers:
+            task.cancel()
+        self._write_pool.shutdown(wait=False)
+
+
+def main():
+    """Run the gateway in front of the database configured by DATABASE_URL"""
+    print("[INIT] Starting FIM ingestion gateway...")
+    asyncio.run(IngestGateway().serve())
+
+
+if __name__ == "__main__":
+    main()
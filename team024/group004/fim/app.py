@@ -1,17 +1,21 @@
 """Flask web dashboard"""
 import os
+from datetime import datetime
 from flask import Flask, render_template, request, jsonify
 from .models import (
     get_latest_events,
     get_latest_events_filtered,
-    get_distinct_file_paths,
+    get_file_states_page,
     get_file_classification,
     upsert_file_classification,
-    get_all_classifications,
+    clear_file_classification,
+    bulk_save_classifications,
     get_distinct_endpoints,
-    DB_PATH
+    get_rollups,
 )
-from .mongo_client import is_mongo_connected
+from .mongo_client import is_mongo_connected, get_events_from_mongo, get_fleet_summary
+from .search import parse_search, parse_time
+from .pagination import clamp_page_size
 from .config import FLASK_HOST, FLASK_PORT
 
 ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
@@ -43,11 +47,18 @@ def index():
     else:
         search_columns = None
     
-    if search_query or (event_types and len(event_types) > 0):
+    search_error = None
+    try:
+        search = parse_search(search_query, now=datetime.now())
+    except ValueError as e:
+        search_error = str(e)
+        search = None
+    
+    if search or (event_types and len(event_types) > 0):
         events = get_latest_events_filtered(
             limit=100,
             event_types=event_types,
-            search_query=search_query if search_query else None,
+            search=search,
             search_columns=search_columns
         )
     else:
@@ -76,85 +87,58 @@ def index():
         selected_event_types=selected_types,
         selected_search_columns=search_columns if search_columns else ["all"],
         has_active_filters=has_active_filters,
+        search_error=search_error,
         mongo_connected=mongo_status
     )
 
 
 @app.route("/classification/save-all", methods=["POST"])
 def classification_save_all():
-    """AJAX endpoint to save all classifications at once"""
+    """AJAX endpoint to save many classifications in one transaction
+    
+    Accepts a JSON body (a list, or {"files": [...]}) or the legacy "files"
+    form field, and returns an outcome for every entry.
+    """
     import json
     import sqlite3
-    from datetime import datetime
-    
-    files_json = request.form.get("files")
-    if not files_json:
-        return jsonify({"success": False, "message": "Missing files parameter"}), 400
     
-    try:
-        files = json.loads(files_json)
-    except json.JSONDecodeError:
-        return jsonify({"success": False, "message": "Invalid JSON format"}), 400
+    if request.is_json:
+        files = request.get_json(silent=True)
+        if isinstance(files, dict):
+            files = files.get("files")
+    else:
+        files_json = request.form.get("files")
+        if not files_json:
+            return jsonify({"success": False, "message": "Missing files parameter"}), 400
+        try:
+            files = json.loads(files_json)
+        except json.JSONDecodeError:
+            return jsonify({"success": False, "message": "Invalid JSON format"}), 400
     
     if not isinstance(files, list):
         return jsonify({"success": False, "message": "Files must be a list"}), 400
     
-    conn = sqlite3.connect(DB_PATH)
-    cursor = conn.cursor()
-    
-    saved_count = 0
-    for file_data in files:
-        file_path = file_data.get("file_path")
-        classification = file_data.get("classification", "").strip()
-        endpoint = file_data.get("endpoint")
-        hostname = file_data.get("hostname")
-        username = file_data.get("username")
-        
-        if not file_path:
-            continue
-        
-        if not classification:
-            cursor.execute("DELETE FROM file_classification WHERE file_path = ?", (file_path,))
-        else:
-            timestamp = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-            
-            cursor.execute("SELECT id FROM file_classification WHERE file_path = ?", (file_path,))
-            existing = cursor.fetchone()
-            
-            if existing:
-                cursor.execute("""
-                    UPDATE file_classification SET
-                        classification = ?,
-                        last_updated_timestamp = ?,
-                        endpoint = ?,
-                        hostname = ?,
-                        username = ?
-                    WHERE file_path = ?
-                """, (classification, timestamp, endpoint, hostname, username, file_path))
-            else:
-                cursor.execute("""
-                    INSERT INTO file_classification (
-                        file_path, classification, last_updated_timestamp,
-                        endpoint, hostname, username
-                    ) VALUES (?, ?, ?, ?, ?, ?)
-                """, (file_path, classification, timestamp, endpoint, hostname, username))
-        
-        saved_count += 1
-    
-    conn.commit()
-    conn.close()
+    try:
+        results = bulk_save_classifications(files)
+    except sqlite3.Error as e:
+        return jsonify({"success": False, "message": str(e)}), 500
+    
+    counts: dict = {}
+    for result in results:
+        counts[result["status"]] = counts.get(result["status"], 0) + 1
+    saved_count = counts.get("saved", 0) + counts.get("cleared", 0)
     
     return jsonify({
         "success": True,
-        "message": f"Successfully saved {saved_count} classification(s)"
+        "message": f"Successfully saved {saved_count} classification(s)",
+        "counts": counts,
+        "results": results
     })
 
 
 @app.route("/classification/update", methods=["POST"])
 def classification_update():
     """AJAX endpoint to update classification without page reload"""
-    import sqlite3
-    
     file_path = request.form.get("file_path")
     classification = request.form.get("classification", "").strip()
     endpoint = request.form.get("endpoint")
@@ -165,11 +149,7 @@ def classification_update():
         return jsonify({"success": False, "message": "Missing file_path parameter"}), 400
     
     if not classification:
-        conn = sqlite3.connect(DB_PATH)
-        cursor = conn.cursor()
-        cursor.execute("DELETE FROM file_classification WHERE file_path = ?", (file_path,))
-        conn.commit()
-        conn.close()
+        clear_file_classification(file_path)
         return jsonify({"success": True, "message": "Classification cleared successfully"})
     
     upsert_file_classification(
@@ -183,52 +163,141 @@ def classification_update():
     return jsonify({"success": True, "message": "Classification updated successfully"})
 
 
-@app.route("/classification", methods=["GET"])
-def classification():
-    """Classification page for assigning security levels to files"""
-    
-    endpoints_param = request.args.get("endpoints", "")
+def _file_states_page_from_args(args) -> dict:
+    """Parse classification paging arguments and fetch the page"""
+    endpoints_param = args.get("endpoints", "")
     if endpoints_param:
         selected_endpoints = [e.strip() for e in endpoints_param.split(",") if e.strip()]
     else:
         selected_endpoints = None
     
-    search_query = request.args.get("search", "").strip()
-    
-    files = get_distinct_file_paths(endpoints=selected_endpoints)
-    
-    if search_query:
-        files = [f for f in files if search_query.lower() in f["file_path"].lower()]
-    
-    classifications_dict = {}
-    if selected_endpoints:
-        classifications = get_all_classifications(endpoints=selected_endpoints)
-    else:
-        classifications = get_all_classifications()
-    
-    for cls in classifications:
-        classifications_dict[cls["file_path"]] = cls
+    sort = args.get("sort", "last_timestamp")
+    order = "asc" if args.get("order") == "asc" else "desc"
+    search_query = args.get("search", "").strip()
     
-    for file_info in files:
-        file_path = file_info["file_path"]
-        if file_path in classifications_dict:
-            file_info["classification"] = classifications_dict[file_path]["classification"]
-            file_info["classification_id"] = classifications_dict[file_path]["id"]
-        else:
-            file_info["classification"] = None
-            file_info["classification_id"] = None
+    page = get_file_states_page(
+        endpoints=selected_endpoints,
+        search_query=search_query if search_query else None,
+        sort=sort,
+        order=order,
+        limit=args.get("limit", type=int),
+        cursor_token=args.get("cursor")
+    )
+    page.update(endpoints=selected_endpoints, search=search_query, sort=sort, order=order)
+    return page
+
+
+@app.route("/classification", methods=["GET"])
+def classification():
+    """Classification page for assigning security levels to files"""
+    try:
+        page = _file_states_page_from_args(request.args)
+    except ValueError as e:
+        return jsonify({"success": False, "message": str(e)}), 400
     
     available_endpoints = get_distinct_endpoints()
     
     return render_template(
         "classification.html",
-        files=files,
+        files=page["files"],
+        next_cursor=page["next_cursor"],
+        sort=page["sort"],
+        order=page["order"],
         available_endpoints=available_endpoints,
-        selected_endpoints=selected_endpoints if selected_endpoints else [],
-        search_query=search_query
+        selected_endpoints=page["endpoints"] if page["endpoints"] else [],
+        search_query=page["search"]
+    )
+
+
+@app.route("/classification/data", methods=["GET"])
+def classification_data():
+    """JSON page of monitored files for the classification table"""
+    try:
+        page = _file_states_page_from_args(request.args)
+    except ValueError as e:
+        return jsonify({"success": False, "message": str(e)}), 400
+    return jsonify({"files": page["files"], "next_cursor": page["next_cursor"]})
+
+
+@app.route("/api/files")
+def api_files():
+    """API endpoint to page through the latest state of each monitored file (keyset cursors)"""
+    args = request.args.copy()
+    if args.get("endpoint"):
+        args.setdefault("endpoints", args["endpoint"])
+    try:
+        page = _file_states_page_from_args(args)
+    except ValueError as e:
+        return jsonify({"success": False, "message": str(e)}), 400
+    return jsonify({"files": page["files"], "next_cursor": page["next_cursor"]})
+
+
+@app.route("/api/rollups")
+def api_rollups():
+    """Hourly or daily event counts per endpoint and type (kept after partitions are dropped)"""
+    now = datetime.now()
+    try:
+        since = parse_time(request.args["since"], now) if request.args.get("since") else None
+        until = parse_time(request.args["until"], now) if request.args.get("until") else None
+    except ValueError as e:
+        return jsonify({"success": False, "message": str(e)}), 400
+    
+    return jsonify(get_rollups(
+        granularity="day" if request.args.get("granularity") == "day" else "hour",
+        since=since,
+        until=until,
+        endpoint=request.args.get("endpoint"),
+        event_type=request.args.get("type"),
+        limit=clamp_page_size(request.args.get("limit", type=int), default=1000, maximum=10000)
+    ))
+
+
+def _fleet_events_from_args(args) -> dict:
+    """Parse fleet event filters and paging arguments and fetch the page from MongoDB"""
+    return get_events_from_mongo(
+        limit=args.get("limit", type=int),
+        event_type=args.get("type"),
+        agent_id=args.get("agent"),
+        path=args.get("path"),
+        cursor_token=args.get("cursor")
     )
 
 
+@app.route("/fleet")
+def fleet():
+    """Fleet view: event counts per agent and type, and recent events of all agents"""
+    try:
+        page = _fleet_events_from_args(request.args)
+    except ValueError as e:
+        return jsonify({"success": False, "message": str(e)}), 400
+    
+    return render_template(
+        "fleet.html",
+        summary=get_fleet_summary(),
+        events=page["events"],
+        next_cursor=page["next_cursor"],
+        selected_agent=request.args.get("agent", ""),
+        selected_type=request.args.get("type", ""),
+        mongo_connected=is_mongo_connected()
+    )
+
+
+@app.route("/api/fleet")
+def api_fleet():
+    """Per-agent and per-type event counts aggregated in MongoDB"""
+    return jsonify(get_fleet_summary())
+
+
+@app.route("/api/fleet/events")
+def api_fleet_events():
+    """Keyset-paginated events of all agents from MongoDB (agent, type, path, cursor, limit)"""
+    try:
+        page = _fleet_events_from_args(request.args)
+    except ValueError as e:
+        return jsonify({"success": False, "message": str(e)}), 400
+    return jsonify(page)
+
+
 @app.route("/api/status")
 def api_status():
     """API endpoint to check system status"""
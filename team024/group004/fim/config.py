@@ -19,3 +19,42 @@ AGENT_ID = os.environ.get("AGENT_ID", socket.gethostname())
 
 FLASK_HOST = "0.0.0.0"
 FLASK_PORT = 5000
+
+CLASSIFICATION_LEVELS = ["Unclassified", "Confidential", "Secret", "Top Secret"]
+
+# Events are stored in one SQLite file per period under PARTITION_DIR ("month" or "day").
+# Partitions entirely older than EVENT_RETENTION_DAYS (0 keeps everything) are
+# deleted, or moved to ARCHIVE_DIR with EVENT_RETENTION_MODE=detach.
+PARTITION_DIR = os.path.join(DATA_DIR, "partitions")
+ARCHIVE_DIR = os.path.join(DATA_DIR, "archive")
+EVENT_PARTITION_PERIOD = os.environ.get("FIM_EVENT_PARTITION_PERIOD", "month")
+EVENT_RETENTION_DAYS = int(os.environ.get("FIM_EVENT_RETENTION_DAYS", "0"))
+EVENT_RETENTION_MODE = os.environ.get("FIM_EVENT_RETENTION_MODE", "drop")
+
+# Paths, endpoints and hosts are stored once in dimension tables; this many
+# of their ids are cached per process for the write path.
+DIMENSION_CACHE_SIZE = int(os.environ.get("FIM_DIMENSION_CACHE_SIZE", "100000"))
+
+# Each thread keeps one SQLite connection open (WAL journal, synchronous=NORMAL).
+# SQLITE_CACHE_KIB is the page cache per connection, SQLITE_MMAP_BYTES the memory
+# mapped size of each database file, SQLITE_BUSY_TIMEOUT_MS how long a writer
+# waits for the lock and SQLITE_STATEMENT_CACHE how many prepared statements
+# each connection keeps for reuse.
+SQLITE_CACHE_KIB = int(os.environ.get("FIM_SQLITE_CACHE_KIB", "16384"))
+SQLITE_MMAP_BYTES = int(os.environ.get("FIM_SQLITE_MMAP_BYTES", str(256 * 1024 * 1024)))
+SQLITE_BUSY_TIMEOUT_MS = int(os.environ.get("FIM_SQLITE_BUSY_TIMEOUT_MS", "5000"))
+SQLITE_STATEMENT_CACHE = int(os.environ.get("FIM_SQLITE_STATEMENT_CACHE", "256"))
+
+# Events are copied to MongoDB by a background worker, MONGO_BATCH_SIZE at a
+# time. It polls every MONGO_SYNC_INTERVAL seconds when idle and backs off
+# exponentially up to MONGO_RETRY_MAX_SECONDS while MongoDB rejects batches.
+MONGO_BATCH_SIZE = int(os.environ.get("FIM_MONGO_BATCH_SIZE", "500"))
+MONGO_SYNC_INTERVAL = float(os.environ.get("FIM_MONGO_SYNC_INTERVAL", "2"))
+MONGO_RETRY_MAX_SECONDS = float(os.environ.get("FIM_MONGO_RETRY_MAX_SECONDS", "300"))
+
+# While MongoDB is unreachable, calls fail at once and a background thread pings
+# it with jittered exponential backoff between MONGO_RECONNECT_MIN_SECONDS and
+# MONGO_RECONNECT_MAX_SECONDS. MONGO_TIMEOUT_MS bounds each ping and operation.
+MONGO_TIMEOUT_MS = int(os.environ.get("FIM_MONGO_TIMEOUT_MS", "5000"))
+MONGO_RECONNECT_MIN_SECONDS = float(os.environ.get("FIM_MONGO_RECONNECT_MIN_SECONDS", "1"))
+MONGO_RECONNECT_MAX_SECONDS = float(os.environ.get("FIM_MONGO_RECONNECT_MAX_SECONDS", "60"))
@@ -0,0 +1,103 @@
+"""SQLite connection manager - one persistent connection per thread
+
+Connecting, setting up and tearing down a connection cost more than the few
+statements the write path runs per event, so each thread opens the main
+database once and keeps it, together with its cache of prepared statements.
+The database runs in WAL mode, so the dashboard reads while the watcher writes.
+The partition a thread writes events to also stays attached (see
+attach_for_writes) instead of being reopened for every event.
+"""
+import os
+import sqlite3
+import threading
+from contextlib import contextmanager
+from typing import Iterator
+
+from .config import (
+    DB_PATH, SQLITE_CACHE_KIB, SQLITE_MMAP_BYTES, SQLITE_BUSY_TIMEOUT_MS, SQLITE_STATEMENT_CACHE,
+)
+
+_local = threading.local()
+
+
+def _tune(cursor: sqlite3.Cursor, schema: str = "main") -> None:
+    """Set the per-database page cache and memory map size"""
+    cursor.execute(f"PRAGMA {schema}.cache_size = -{SQLITE_CACHE_KIB}")
+    cursor.execute(f"PRAGMA {schema}.mmap_size = {SQLITE_MMAP_BYTES}")
+
+
+def get_connection() -> sqlite3.Connection:
+    """Get this thread's connection to the main database, opening it on first use
+
+    Returns:
+        A connection in WAL mode with synchronous=NORMAL. Callers commit or
+        roll back their own transactions and never close it.
+    """
+    conn = getattr(_local, "conn", None)
+    if conn is None:
+        conn = sqlite3.connect(
+            DB_PATH,
+            uri=True,
+            timeout=SQLITE_BUSY_TIMEOUT_MS / 1000,
+            cached_statements=SQLITE_STATEMENT_CACHE,
+        )
+        cursor = conn.cursor()
+        cursor.execute("PRAGMA journal_mode = WAL")
+        # Durable at every checkpoint; a power loss can only lose the last commits
+        cursor.execute("PRAGMA synchronous = NORMAL")
+        cursor.execute(f"PRAGMA busy_timeout = {SQLITE_BUSY_TIMEOUT_MS}")
+        _tune(cursor)
+        _local.conn = conn
+    return conn
+
+
+@contextmanager
+def connection() -> Iterator[sqlite3.Connection]:
+    """Use this thread's connection, rolling back an unfinished transaction on error
+
+    A failed statement must not leave the shared connection inside a
+    transaction that holds the write lock.
+    """
+    conn = get_connection()
+    try:
+        yield conn
+    except BaseException:
+        conn.rollback()
+        raise
+
+
+def attach(cursor: sqlite3.Cursor, uri: str, schema: str = "p") -> None:
+    """Attach a database file to the connection with the same cache settings as main
+
+    Args:
+        cursor: Cursor on a connection from get_connection(), outside a transaction
+        uri: SQLite URI of the file (see partitions.attach_uri)
+        schema: Schema name to attach it as
+    """
+    cursor.execute(f"ATTACH DATABASE ? AS {schema}", (uri,))
+    _tune(cursor, schema)
+
+
+
+def attach_for_writes(cursor: sqlite3.Cursor, path: str, uri: str) -> None:
+    """Keep a partition attached as schema "w" on this thread's connection
+    
+    It is reattached only when the thread moves to another partition, or
+    when the file at path was replaced (dropped by retention and created
+    again), which a comparison of the inode detects.
+    
+    Args:
+        cursor: Cursor on a connection from get_connection(), outside a transaction
+        path: Path of the partition file
+        uri: SQLite URI of the file (see partitions.attach_uri)
+    """
+    st = os.stat(path)
+    key = (path, st.st_dev, st.st_ino)
+    attached = getattr(_local, "write_partition", None)
+    if attached == key:
+        return
+    if attached is not None:
+        cursor.execute("DETACH DATABASE w")
+        _local.write_partition = None
+    attach(cursor, uri, schema="w")
+    _local.write_partition = key
@@ -0,0 +1,97 @@
+"""Dimension tables for repeated event strings - paths, endpoints and hosts
+
+Events store integer ids into these tables instead of the text; the ids
+of values seen by this process are cached so the write path rarely has to
+look them up.
+"""
+import sqlite3
+import threading
+from typing import Dict, Tuple
+
+from .config import DIMENSION_CACHE_SIZE
+
+# Event column -> (dimension table, value column, id column in events)
+DIMENSIONS = {
+    "file_path": ("paths", "path", "path_id"),
+    "endpoint": ("endpoints", "name", "endpoint_id"),
+    "hostname": ("hosts", "hostname", "host_id"),
+}
+
+
+class DimensionCache:
+    """Maps the values of one dimension table to their ids
+    
+    Unknown values are inserted (or looked up if another process got there
+    first). The cache stops growing at DIMENSION_CACHE_SIZE entries; further
+    misses go to the database.
+    """
+    
+    def __init__(self, table: str, column: str):
+        self.table = table
+        self.column = column
+        self._ids: Dict[str, int] = {}
+        self._lock = threading.Lock()
+    
+    def id_for(self, cursor: sqlite3.Cursor, value: str) -> int:
+        """Get the id of a value, adding it to the table if needed
+        
+        Args:
+            cursor: Cursor on the main database
+            value: Dimension value
+        
+        Returns:
+            The id of the value's row
+        """
+        with self._lock:
+            cached = self._ids.get(value)
+        if cached is not None:
+            return cached
+        
+        cursor.execute(f"INSERT OR IGNORE INTO {self.table} ({self.column}) VALUES (?)", (value,))
+        cursor.execute(f"SELECT id FROM {self.table} WHERE {self.column} = ?", (value,))
+        row_id = cursor.fetchone()[0]
+        with self._lock:
+            if len(self._ids) < DIMENSION_CACHE_SIZE:
+                self._ids[value] = row_id
+        return row_id
+    
+    def clear(self) -> None:
+        with self._lock:
+            self._ids.clear()
+
+
+paths = DimensionCache("paths", "path")
+endpoints = DimensionCache("endpoints", "name")
+hosts = DimensionCache("hosts", "hostname")
+
+
+def event_dimension_ids(conn: sqlite3.Connection, file_path: str, endpoint: str,
+                        hostname: str) -> Tuple[int, int, int]:
+    """Get the path, endpoint and host ids of an event
+    
+    New dimension rows are committed before returning, so a cached id never
+    refers to a row that was rolled back with a failed event insert.
+    
+    Args:
+        conn: Connection to the main database, outside a transaction
+        file_path: Absolute file path
+        endpoint: Endpoint name
+        hostname: Host name
+    
+    Returns:
+        (path_id, endpoint_id, host_id)
+    """
+    cursor = conn.cursor()
+    ids = (
+        paths.id_for(cursor, file_path),
+        endpoints.id_for(cursor, endpoint),
+        hosts.id_for(cursor, hostname),
+    )
+    conn.commit()
+    return ids
+
+
+def clear_caches() -> None:
+    """Forget all cached ids, e.g. after the database was replaced"""
+    for cache in (paths, endpoints, hosts):
+        cache.clear()
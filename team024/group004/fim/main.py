@@ -4,8 +4,9 @@ import time
 from .models import init_db
 from .watcher import DirectoryWatcher
 from .app import run_app
-from .config import FLASK_HOST, FLASK_PORT
+from .config import FLASK_HOST, FLASK_PORT, MONGO_URI
 from .mongo_client import get_mongo_connection
+from .replicator import MongoReplicator
 
 
 def main():
@@ -14,12 +15,15 @@ def main():
     init_db()
     print("[INIT] Database ready")
     
-    print("[INIT] Checking MongoDB connection...")
-    mongo = get_mongo_connection()
-    if mongo is not None:
-        print("[INIT] MongoDB connected successfully")
+    if MONGO_URI:
+        print("[INIT] Connecting to MongoDB in the background - events are stored locally until it is reachable")
+        get_mongo_connection()
     else:
-        print("[INIT] MongoDB not available - events will be stored locally only")
+        print("[INIT] MongoDB not configured - events will be stored locally only")
+    
+    replicator = MongoReplicator()
+    if MONGO_URI:
+        replicator.start()
     
     print("[INIT] Starting directory watcher...")
     watcher = DirectoryWatcher()
@@ -33,6 +37,7 @@ def main():
     except KeyboardInterrupt:
         print("\n[SHUTDOWN] Shutting down...")
         watcher.stop()
+        replicator.stop()
 
 
 if __name__ == "__main__":
@@ -1,46 +1,73 @@
 """Database models and data access layer - SQLite with MongoDB sync"""
 import sqlite3
 import os
-from typing import Optional, List, Dict, Any
+from typing import Optional, List, Dict, Any, Tuple, Callable
 from datetime import datetime
 
-from .config import DB_PATH, DATA_DIR
-from .mongo_client import send_event_to_mongo, is_mongo_connected
+from .config import DATA_DIR, CLASSIFICATION_LEVELS
+from .pagination import encode_cursor, decode_cursor, clamp_page_size
+from .search import SearchQuery, split_glob
+from .partitions import (
+    partition_for, partitions_between, list_partitions, attach_uri, apply_retention, retention_cutoff,
+    create_partition, create_fts_index, drop_fts_index,
+)
+from .timestamps import (
+    NS_PER_SECOND, TIMESTAMP_FORMAT, TEXT_TO_NS_SQL, utc_to_ns, format_ns, local_datetime, time_range,
+)
+from .dimensions import DIMENSIONS, event_dimension_ids, clear_caches
+from .db import get_connection, connection, attach, attach_for_writes
+
+EVENT_COLUMNS = [
+    "id", "event_type", "file_path", "timestamp", "endpoint", "hostname", "username",
+    "hash_before", "hash_after", "state_hash", "content_hash", "synced_to_mongo",
+]
+# Paths per DELETE/UPDATE ... IN statement, well under SQLite's bound-parameter limit
+BULK_CHUNK_SIZE = 500
+# Columns of the events table in a partition, with dimension ids in place of the text
+PARTITION_EVENT_COLUMNS = [
+    "id", "event_type", "path_id", "timestamp", "endpoint_id", "host_id", "username",
+    "hash_before", "hash_after", "state_hash", "content_hash", "synced_to_mongo",
+]
+# Events of the attached partition "p" in the API shape (EVENT_COLUMNS), plus the ids
+# so filters can use the partition indexes. Temporary, so it can span the attached file.
+EVENTS_VIEW_SQL = """
+    CREATE TEMP VIEW IF NOT EXISTS events_view AS
+    SELECT e.id, e.event_type, paths.path AS file_path, e.timestamp,
+           endpoints.name AS endpoint, hosts.hostname AS hostname, e.username,
+           e.hash_before, e.hash_after, e.state_hash, e.content_hash, e.synced_to_mongo,
+           e.path_id, e.endpoint_id, e.host_id
+    FROM p.events e
+    JOIN main.paths ON paths.id = e.path_id
+    JOIN main.endpoints ON endpoints.id = e.endpoint_id
+    JOIN main.hosts ON hosts.id = e.host_id
+"""
+# Main database columns that held local-time text timestamps in older versions
+TEXT_TIMESTAMP_COLUMNS = {"file_state": "last_timestamp", "hash_baseline": "last_updated"}
+DAY_NS = 86400 * NS_PER_SECOND
+ROLLUP_TABLES = {"hour": "event_rollup_hourly", "day": "event_rollup_daily"}
+ROLLUP_BUCKET_SQL = {
+    "hour": "substr(timestamp, 1, 13) || ':00:00'",
+    "day": "substr(timestamp, 1, 10)",
+}
 
 
 def init_db() -> None:
-    """Create the database and events table if they don't exist"""
+    """Create the database tables if they don't exist
+    
+    Events themselves live in per-period partition files (see partitions.py);
+    an events table left in the main database by older versions is moved
+    into partitions once, partitions storing paths, endpoints and hostnames
+    as text or local-time text timestamps are rebuilt on dimension ids and
+    epoch nanoseconds, and an empty hash_baseline is filled from the event
+    history.
+    """
     os.makedirs(DATA_DIR, exist_ok=True)
     
-    conn = sqlite3.connect(DB_PATH)
+    conn = get_connection()
     cursor = conn.cursor()
     
-    cursor.execute("""
-        CREATE TABLE IF NOT EXISTS events (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            event_type TEXT NOT NULL,
-            file_path TEXT NOT NULL,
-            timestamp TEXT NOT NULL,
-            endpoint TEXT NOT NULL,
-            hostname TEXT NOT NULL,
-            username TEXT NOT NULL,
-            hash_before TEXT,
-            hash_after TEXT,
-            state_hash TEXT,
-            content_hash TEXT,
-            synced_to_mongo INTEGER DEFAULT 0
-        )
-    """)
-    
-    cursor.execute("""
-        CREATE INDEX IF NOT EXISTS idx_event_type 
-        ON events(event_type)
-    """)
-    
-    cursor.execute("""
-        CREATE INDEX IF NOT EXISTS idx_timestamp 
-        ON events(timestamp)
-    """)
+    # Tables with text timestamps are recreated below and their rows copied over
+    text_timestamp_tables = _set_aside_text_timestamp_tables(cursor)
     
     cursor.execute("""
         CREATE TABLE IF NOT EXISTS file_classification (
@@ -59,6 +86,36 @@ def init_db() -> None:
         ON file_classification(file_path)
     """)
     
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS file_state (
+            file_path TEXT PRIMARY KEY,
+            last_event_id INTEGER NOT NULL,
+            last_event_type TEXT NOT NULL,
+            last_timestamp INTEGER NOT NULL,
+            endpoint TEXT NOT NULL,
+            hostname TEXT NOT NULL,
+            username TEXT NOT NULL,
+            content_hash TEXT,
+            classification TEXT
+        )
+    """)
+    
+    # Keyset pagination indexes: every sort key is paired with the unique file_path
+    cursor.execute("""
+        CREATE INDEX IF NOT EXISTS idx_file_state_timestamp
+        ON file_state(last_timestamp, file_path)
+    """)
+    
+    cursor.execute("""
+        CREATE INDEX IF NOT EXISTS idx_file_state_endpoint
+        ON file_state(endpoint, file_path)
+    """)
+    
+    cursor.execute("""
+        CREATE INDEX IF NOT EXISTS idx_file_state_classification
+        ON file_state(COALESCE(classification, ''), file_path)
+    """)
+    
     cursor.execute("""
         CREATE TABLE IF NOT EXISTS hash_baseline (
             id INTEGER PRIMARY KEY AUTOINCREMENT,
@@ -66,114 +123,722 @@ def init_db() -> None:
             content_hash TEXT NOT NULL,
             state_hash TEXT,
             metadata TEXT,
-            last_updated TEXT NOT NULL
+            last_updated INTEGER NOT NULL
+        )
+    """)
+    _convert_text_timestamp_tables(cursor, text_timestamp_tables)
+    
+    # Event ids are allocated here so they stay unique across partition files
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS event_sequence (
+            id INTEGER PRIMARY KEY CHECK (id = 1),
+            last_id INTEGER NOT NULL
         )
     """)
+    cursor.execute("INSERT OR IGNORE INTO event_sequence (id, last_id) VALUES (1, 0)")
+    
+    # Id of the last event replicated to MongoDB; events commit in id order
+    cursor.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'mongo_watermark'")
+    new_watermark = cursor.fetchone() is None
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS mongo_watermark (
+            id INTEGER PRIMARY KEY CHECK (id = 1),
+            last_id INTEGER NOT NULL
+        )
+    """)
+    
+    # Dimension tables for the strings every event would otherwise repeat
+    for table, column, _ in DIMENSIONS.values():
+        cursor.execute(f"""
+            CREATE TABLE IF NOT EXISTS {table} (
+                id INTEGER PRIMARY KEY,
+                {column} TEXT NOT NULL UNIQUE
+            )
+        """)
+    create_fts_index(cursor, "paths", ["path"])
+    clear_caches()
+    
+    # Aggregate history that outlives dropped partitions
+    for table in ROLLUP_TABLES.values():
+        cursor.execute(f"""
+            CREATE TABLE IF NOT EXISTS {table} (
+                bucket TEXT NOT NULL,
+                endpoint TEXT NOT NULL,
+                event_type TEXT NOT NULL,
+                event_count INTEGER NOT NULL,
+                PRIMARY KEY (bucket, endpoint, event_type)
+            )
+        """)
     
+    cursor.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'events'")
+    legacy_events = cursor.fetchone() is not None
     conn.commit()
-    conn.close()
+    if legacy_events:
+        _migrate_legacy_events(conn)
+    _normalize_partitions(conn)
+    _move_misplaced_events(conn)
+    _backfill_hash_baseline(conn)
+    _reconcile_event_state(conn)
+    
+    cursor.execute("""
+        UPDATE event_sequence SET last_id = MAX(
+            last_id, (SELECT COALESCE(MAX(last_event_id), 0) FROM file_state)
+        )
+    """)
+    conn.commit()
+    if new_watermark:
+        _init_mongo_watermark(conn)
+    apply_retention()
     print("[DB] SQLite database initialized")
 
 
-def insert_event(data: Dict[str, Any]) -> int:
-    """Insert a single event into the database and sync to MongoDB
+def _init_mongo_watermark(conn: sqlite3.Connection) -> None:
+    """Start the MongoDB watermark below the oldest event not flagged synced_to_mongo
+    
+    Older versions sent each event as it was inserted and flagged it; from
+    here on the flags are left alone and only the watermark moves.
     
     Args:
-        data: Dictionary with event data
+        conn: Connection to the main database, outside a transaction
+    """
+    cursor = conn.cursor()
+    cursor.execute("SELECT last_id FROM event_sequence")
+    watermark = cursor.fetchone()[0]
+    for path in partitions_between():
+        attach(cursor, attach_uri(path))
+        cursor.execute("SELECT MIN(id) FROM p.events WHERE synced_to_mongo = 0")
+        oldest = cursor.fetchone()[0]
+        cursor.execute("DETACH DATABASE p")
+        if oldest is not None:
+            watermark = min(watermark, oldest - 1)
+    cursor.execute("INSERT OR IGNORE INTO mongo_watermark (id, last_id) VALUES (1, ?)", (watermark,))
+    conn.commit()
+
+
+def _set_aside_text_timestamp_tables(cursor: sqlite3.Cursor) -> List[str]:
+    """Rename main database tables that still store text timestamps
+    
+    Their indexes are dropped so init_db can create the table and indexes
+    with integer timestamps under the old names.
     
     Returns:
-        The ID of the inserted event
+        Names of the tables renamed to <name>_legacy
+    """
+    tables = []
+    for table, column in TEXT_TIMESTAMP_COLUMNS.items():
+        cursor.execute(f"PRAGMA table_info({table})")
+        types = {row[1]: row[2] for row in cursor.fetchall()}
+        if types.get(column, "").upper() != "TEXT":
+            continue
+        cursor.execute(f"""
+            SELECT name FROM sqlite_master
+            WHERE type = 'index' AND tbl_name = '{table}' AND sql IS NOT NULL
+        """)
+        for (index,) in cursor.fetchall():
+            cursor.execute(f"DROP INDEX {index}")
+        cursor.execute(f"ALTER TABLE {table} RENAME TO {table}_legacy")
+        tables.append(table)
+    return tables
+
+
+def _convert_text_timestamp_tables(cursor: sqlite3.Cursor, tables: List[str]) -> None:
+    """Copy the rows of tables set aside by _set_aside_text_timestamp_tables, converting their timestamps"""
+    for table in tables:
+        print(f"[DB] Converting {table} timestamps to epoch nanoseconds")
+        cursor.execute(f"PRAGMA table_info({table})")
+        columns = [row[1] for row in cursor.fetchall()]
+        select = [
+            TEXT_TO_NS_SQL.format(column) if column == TEXT_TIMESTAMP_COLUMNS[table] else column
+            for column in columns
+        ]
+        cursor.execute(f"""
+            INSERT INTO {table} ({", ".join(columns)})
+            SELECT {", ".join(select)} FROM {table}_legacy
+        """)
+        cursor.execute(f"DROP TABLE {table}_legacy")
+
+
+def _migrate_legacy_events(conn: sqlite3.Connection) -> None:
+    """Move the events table of older versions into partition files and drop it
+    
+    Also backfills file_state and the rollup tables from it. Events already
+    past the retention period are only counted in the rollups.
+    
+    Args:
+        conn: Connection to the main database, outside a transaction
+    """
+    print("[DB] Moving events into partition files")
+    cursor = conn.cursor()
+    
+    # One-time backfill of file_state from event history
+    cursor.execute("SELECT 1 FROM file_state LIMIT 1")
+    if cursor.fetchone() is None:
+        cursor.execute(f"""
+            INSERT INTO file_state (
+                file_path, last_event_id, last_event_type, last_timestamp,
+                endpoint, hostname, username, content_hash, classification
+            )
+            SELECT e.file_path, e.id, e.event_type, {TEXT_TO_NS_SQL.format("e.timestamp")},
+                   e.endpoint, e.hostname, e.username, e.hash_after, fc.classification
+            FROM events e
+            JOIN (
+                SELECT file_path, MAX(id) AS max_id FROM events GROUP BY file_path
+            ) latest ON latest.max_id = e.id
+            LEFT JOIN file_classification fc ON fc.file_path = e.file_path
+        """)
+    
+    for granularity, table in ROLLUP_TABLES.items():
+        cursor.execute(f"""
+            INSERT OR IGNORE INTO {table} (bucket, endpoint, event_type, event_count)
+            SELECT {ROLLUP_BUCKET_SQL[granularity]}, endpoint, event_type, COUNT(*)
+            FROM events GROUP BY 1, 2, 3
+        """)
+    
+    cursor.execute(
+        "UPDATE event_sequence SET last_id = MAX(last_id, (SELECT COALESCE(MAX(id), 0) FROM events))"
+    )
+    _insert_dimensions(cursor, "main.events")
+    conn.commit()
+    
+    # Partition periods are UTC days and months
+    cutoff = retention_cutoff()
+    cursor.execute(
+        "SELECT DISTINCT date(timestamp, 'utc') FROM events WHERE datetime(timestamp, 'utc') >= ? ORDER BY 1",
+        (cutoff.strftime(TIMESTAMP_FORMAT) if cutoff else "",)
+    )
+    days_by_partition: Dict[str, List[str]] = {}
+    for (day,) in cursor.fetchall():
+        start = utc_to_ns(datetime.strptime(day, "%Y-%m-%d"))
+        days_by_partition.setdefault(partition_for(start), []).append(day)
+    
+    for path, days in days_by_partition.items():
+        # Partitions are contiguous, so their first and last day bound the rows to move
+        attach(cursor, attach_uri(path))
+        cursor.execute(f"""
+            INSERT OR IGNORE INTO p.events ({", ".join(PARTITION_EVENT_COLUMNS)})
+            {_normalized_events_select("main.events", text_dimensions=True)}
+            WHERE date(e.timestamp, 'utc') BETWEEN ? AND ?
+        """, (days[0], days[-1]))
+        conn.commit()
+        cursor.execute("DETACH DATABASE p")
+    
+    drop_fts_index(cursor, "events")
+    cursor.execute("DROP TABLE events")
+    conn.commit()
+    # Give the space of the old table back to the file system
+    cursor.execute("VACUUM")
+
+
+def _insert_dimensions(cursor: sqlite3.Cursor, source: str) -> None:
+    """Add the paths, endpoints and hosts of a text-column events table to the dimension tables"""
+    for column, (table, value_column, _) in DIMENSIONS.items():
+        cursor.execute(f"""
+            INSERT OR IGNORE INTO main.{table} ({value_column})
+            SELECT DISTINCT {column} FROM {source}
+        """)
+
+
+def _normalized_events_select(source: str, text_dimensions: bool) -> str:
+    """SELECT of PARTITION_EVENT_COLUMNS from an events table of an older version aliased e
+    
+    Its local-time text timestamps become epoch nanoseconds, and with
+    text_dimensions its file_path, endpoint and hostname become ids.
+    """
+    timestamp = TEXT_TO_NS_SQL.format("e.timestamp")
+    if not text_dimensions:
+        return f"""
+            SELECT e.id, e.event_type, e.path_id, {timestamp}, e.endpoint_id, e.host_id, e.username,
+                   e.hash_before, e.hash_after, e.state_hash, e.content_hash, e.synced_to_mongo
+            FROM {source} e
+        """
+    return f"""
+        SELECT e.id, e.event_type, paths.id, {timestamp}, endpoints.id, hosts.id, e.username,
+               e.hash_before, e.hash_after, e.state_hash, e.content_hash, e.synced_to_mongo
+        FROM {source} e
+        JOIN main.paths ON paths.path = e.file_path
+        JOIN main.endpoints ON endpoints.name = e.endpoint
+        JOIN main.hosts ON hosts.hostname = e.hostname
+    """
+
+
+def _normalize_partitions(conn: sqlite3.Connection) -> None:
+    """Rebuild partitions written by older versions on dimension ids and epoch nanoseconds
+    
+    Their events kept local-time text timestamps, and the oldest also kept
+    file_path, endpoint and hostname as text. Each such partition is rebuilt
+    once with the current schema and vacuumed. Files created before WAL mode
+    are switched to it.
+    
+    Args:
+        conn: Connection to the main database, outside a transaction
     """
-    conn = sqlite3.connect(DB_PATH)
     cursor = conn.cursor()
+    for _, _, path in list_partitions():
+        attach(cursor, attach_uri(path))
+        cursor.execute("PRAGMA p.journal_mode = WAL")
+        cursor.execute("PRAGMA p.table_info(events)")
+        types = {row[1]: row[2] for row in cursor.fetchall()}
+        legacy = types.get("timestamp", "").upper() == "TEXT"
+        text_dimensions = "file_path" in types
+        if legacy:
+            print(f"[DB] Rebuilding {os.path.basename(path)} on dimension ids and epoch nanoseconds")
+            if text_dimensions:
+                _insert_dimensions(cursor, "p.events")
+            drop_fts_index(cursor, "events", schema="p")
+            cursor.execute("ALTER TABLE p.events RENAME TO events_legacy")
+            # The old indexes keep their names and would stop the new ones being created
+            cursor.execute("""
+                SELECT name FROM p.sqlite_master
+                WHERE type = 'index' AND tbl_name = 'events_legacy' AND sql IS NOT NULL
+            """)
+            for (index,) in cursor.fetchall():
+                cursor.execute(f"DROP INDEX p.{index}")
+            conn.commit()
+        cursor.execute("DETACH DATABASE p")
+        if not legacy:
+            continue
+        
+        create_partition(path)
+        attach(cursor, attach_uri(path))
+        cursor.execute(f"""
+            INSERT INTO p.events ({", ".join(PARTITION_EVENT_COLUMNS)})
+            {_normalized_events_select("p.events_legacy", text_dimensions)}
+        """)
+        cursor.execute("DROP TABLE p.events_legacy")
+        conn.commit()
+        cursor.execute("VACUUM p")
+        cursor.execute("DETACH DATABASE p")
+
+
+def _move_misplaced_events(conn: sqlite3.Connection) -> None:
+    """Move events outside their partition's period into the partition covering them
+    
+    Partitions were named after local-time periods before timestamps were
+    stored in UTC, so events within the UTC offset of a period boundary can
+    sit in the neighbouring file.
+    
+    Args:
+        conn: Connection to the main database, outside a transaction
+    """
+    cursor = conn.cursor()
+    for start, end, path in list_partitions():
+        start_ns, end_ns = utc_to_ns(start), utc_to_ns(end)
+        attach(cursor, attach_uri(path))
+        cursor.execute(f"""
+            SELECT DISTINCT timestamp / {DAY_NS} * {DAY_NS} FROM p.events
+            WHERE timestamp < ? OR timestamp >= ?
+        """, (start_ns, end_ns))
+        targets = sorted({partition_for(day) for (day,) in cursor.fetchall()})
+        for target in targets:
+            target_start, target_end, _ = next(part for part in list_partitions() if part[2] == target)
+            bounds = (utc_to_ns(target_start), utc_to_ns(target_end))
+            attach(cursor, attach_uri(target), schema="q")
+            cursor.execute(f"""
+                INSERT INTO q.events ({", ".join(PARTITION_EVENT_COLUMNS)})
+                SELECT {", ".join(PARTITION_EVENT_COLUMNS)} FROM p.events
+                WHERE timestamp >= ? AND timestamp < ?
+            """, bounds)
+            cursor.execute("DELETE FROM p.events WHERE timestamp >= ? AND timestamp < ?", bounds)
+            conn.commit()
+            cursor.execute("DETACH DATABASE q")
+        cursor.execute("DETACH DATABASE p")
+
+
+def _backfill_hash_baseline(conn: sqlite3.Connection) -> None:
+    """Fill an empty hash_baseline with the last known hash of every file
+    
+    Versions before hash_baseline was maintained left it empty. Partitions
+    are read newest first and INSERT OR IGNORE keeps the first hash found,
+    so each file gets the hash_after of its newest event that has one.
+    
+    Args:
+        conn: Connection to the main database, outside a transaction
+    """
+    cursor = conn.cursor()
+    cursor.execute("""
+        SELECT NOT EXISTS (SELECT 1 FROM hash_baseline) AND EXISTS (SELECT 1 FROM file_state)
+    """)
+    if not cursor.fetchone()[0]:
+        return
+    
+    print("[DB] Building hash baseline from event history")
+    for path in partitions_between():
+        attach(cursor, attach_uri(path))
+        # A bare column next to MAX() comes from the row holding the maximum
+        cursor.execute("""
+            INSERT OR IGNORE INTO hash_baseline (file_path, content_hash, state_hash, last_updated)
+            SELECT paths.path, e.hash_after, e.state_hash, MAX(e.timestamp)
+            FROM p.events e
+            JOIN main.paths ON paths.id = e.path_id
+            WHERE e.hash_after IS NOT NULL
+            GROUP BY e.path_id
+        """)
+        conn.commit()
+        cursor.execute("DETACH DATABASE p")
+
+
+def _record_event_state(cursor: sqlite3.Cursor, data: Dict[str, Any], event_id: int) -> None:
+    """Apply an event to file_state and hash_baseline in the main database
     
+    Args:
+        cursor: Cursor inside the caller's transaction
+        data: Event fields as in insert_event
+        event_id: Id of the event
+    """
     cursor.execute("""
-        INSERT INTO events (
-            event_type, file_path, timestamp, endpoint,
-            hostname, username, hash_before, hash_after,
-            state_hash, content_hash, synced_to_mongo
-        ) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+        INSERT INTO file_state (
+            file_path, last_event_id, last_event_type, last_timestamp,
+            endpoint, hostname, username, content_hash, classification
+        ) VALUES (?, ?, ?, ?, ?, ?, ?, ?,
+            (SELECT classification FROM file_classification WHERE file_path = ?))
+        ON CONFLICT(file_path) DO UPDATE SET
+            last_event_id = excluded.last_event_id,
+            last_event_type = excluded.last_event_type,
+            last_timestamp = excluded.last_timestamp,
+            endpoint = excluded.endpoint,
+            hostname = excluded.hostname,
+            username = excluded.username,
+            content_hash = excluded.content_hash
     """, (
-        data.get("event_type"),
         data.get("file_path"),
+        event_id,
+        data.get("event_type"),
         data.get("timestamp"),
         data.get("endpoint"),
         data.get("hostname"),
         data.get("username"),
-        data.get("hash_before"),
         data.get("hash_after"),
-        data.get("state_hash"),
-        data.get("content_hash"),
-        0
+        data.get("file_path"),
     ))
     
-    event_id = cursor.lastrowid
-    conn.commit()
-    conn.close()
-    
-    mongo_event = {
-        "timestamp": data.get("timestamp"),
-        "event_type": data.get("event_type"),
-        "path": data.get("file_path"),
-        "state_hash": data.get("state_hash"),
-        "content_hash": data.get("content_hash") or data.get("hash_after"),
-        "hash_before": data.get("hash_before"),
-        "hash_after": data.get("hash_after"),
-        "endpoint": data.get("endpoint"),
-        "hostname": data.get("hostname"),
-        "username": data.get("username"),
-    }
-    
-    if send_event_to_mongo(mongo_event):
-        conn = sqlite3.connect(DB_PATH)
-        cursor = conn.cursor()
-        cursor.execute("UPDATE events SET synced_to_mongo = 1 WHERE id = ?", (event_id,))
+    # Deletions keep the row: the last known content is the hash_before of a later event
+    if data.get("hash_after"):
+        cursor.execute("""
+            INSERT INTO hash_baseline (file_path, content_hash, state_hash, last_updated)
+            VALUES (?, ?, ?, ?)
+            ON CONFLICT(file_path) DO UPDATE SET
+                content_hash = excluded.content_hash,
+                state_hash = excluded.state_hash,
+                last_updated = excluded.last_updated
+        """, (
+            data.get("file_path"),
+            data.get("hash_after"),
+            data.get("state_hash"),
+            data.get("timestamp"),
+        ))
+
+
+def _count_rollups(cursor: sqlite3.Cursor, timestamp: int, endpoint: str, event_type: str, delta: int) -> None:
+    """Add delta to the hourly and daily rollup buckets of an event"""
+    # Rollup buckets stay in local time
+    local = local_datetime(timestamp)
+    buckets = {"hour": local.strftime("%Y-%m-%d %H:00:00"), "day": local.strftime("%Y-%m-%d")}
+    for granularity, table in ROLLUP_TABLES.items():
+        cursor.execute(f"""
+            INSERT INTO {table} (bucket, endpoint, event_type, event_count)
+            VALUES (?, ?, ?, ?)
+            ON CONFLICT(bucket, endpoint, event_type) DO UPDATE SET
+                event_count = event_count + excluded.event_count
+        """, (buckets[granularity], endpoint, event_type, delta))
+        if delta < 0:
+            cursor.execute(
+                f"DELETE FROM {table} WHERE bucket = ? AND endpoint = ? AND event_type = ? AND event_count <= 0",
+                (buckets[granularity], endpoint, event_type)
+            )
+
+
+def insert_event(data: Dict[str, Any]) -> int:
+    """Insert a single event into the database
+    
+    The event reaches MongoDB through the replicator (see replicator.py),
+    so this never waits on the network. The event row goes to the partition,
+    which stays attached to this thread's connection, and file_state,
+    hash_baseline and the rollups are updated in the main database under the
+    same commit. In WAL mode that commit is atomic per file only; init_db
+    repairs the main database after a crash between the two (see
+    _reconcile_event_state).
+    
+    Args:
+        data: Dictionary with event data; timestamp in epoch nanoseconds
+    
+    Returns:
+        The ID of the inserted event
+    """
+    partition = partition_for(data.get("timestamp"))
+    
+    conn = get_connection()
+    cursor = conn.cursor()
+    attach_for_writes(cursor, partition, attach_uri(partition))
+    try:
+        path_id, endpoint_id, host_id = event_dimension_ids(
+            conn, data.get("file_path"), data.get("endpoint"), data.get("hostname")
+        )
+        
+        cursor.execute("UPDATE event_sequence SET last_id = last_id + 1")
+        cursor.execute("SELECT last_id FROM event_sequence")
+        event_id = cursor.fetchone()[0]
+        
+        cursor.execute("""
+            INSERT INTO w.events (
+                id, event_type, path_id, timestamp, endpoint_id,
+                host_id, username, hash_before, hash_after,
+                state_hash, content_hash, synced_to_mongo
+            ) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+        """, (
+            event_id,
+            data.get("event_type"),
+            path_id,
+            data.get("timestamp"),
+            endpoint_id,
+            host_id,
+            data.get("username"),
+            data.get("hash_before"),
+            data.get("hash_after"),
+            data.get("state_hash"),
+            data.get("content_hash"),
+            0
+        ))
+        
+        _record_event_state(cursor, data, event_id)
+        _count_rollups(cursor, data.get("timestamp"), data.get("endpoint"), data.get("event_type"), 1)
         conn.commit()
-        conn.close()
+    except BaseException:
+        conn.rollback()
+        raise
     
     return event_id
 
 
-def get_latest_hash(file_path: str) -> Optional[str]:
-    """Get the most recent hash_after for a given file path"""
-    conn = sqlite3.connect(DB_PATH)
+def _latest_path_event(path_id: int, condition: str = "1=1") -> Optional[Dict[str, Any]]:
+    """Newest event of a path in the partitions matching condition, or None"""
+    rows = _query_partitions(
+        lambda cursor: (
+            f"SELECT * FROM events_view WHERE path_id = ? AND {condition} "
+            "ORDER BY timestamp DESC, id DESC LIMIT ?",
+            [path_id],
+        ),
+        1
+    )
+    return dict(rows[0]) if rows else None
+
+
+def _reconcile_event_state(conn: sqlite3.Connection) -> None:
+    """Bring the main database back in step with the partitions after a crash
+    
+    insert_event commits the event row (in the partition) and its file_state,
+    hash_baseline, rollup and event_sequence updates (in the main database)
+    together, but WAL mode only makes that atomic per file, so a crash can
+    keep either half of the last commit. Events found in the partitions
+    beyond event_sequence are applied to the main database. If the newest
+    event id is recorded in file_state but missing from the partition that
+    should hold it, that file's state and baseline are rebuilt from its
+    newest remaining event and the lost event is taken off the rollups.
+    
+    Args:
+        conn: Connection to the main database, outside a transaction
+    """
     cursor = conn.cursor()
+    max_id = 0
+    for path in partitions_between():
+        attach(cursor, attach_uri(path))
+        cursor.execute("SELECT COALESCE(MAX(id), 0) FROM p.events")
+        max_id = max(max_id, cursor.fetchone()[0])
+        cursor.execute("DETACH DATABASE p")
+    cursor.execute("SELECT last_id FROM event_sequence")
+    last_id = cursor.fetchone()[0]
+    
+    if max_id > last_id:
+        events = get_events_after(last_id, max_id - last_id)
+        print(f"[DB] Applying {len(events)} event(s) the main database missed")
+        for event in events:
+            _record_event_state(cursor, event, event["id"])
+            _count_rollups(cursor, event["timestamp"], event["endpoint"], event["event_type"], 1)
+        cursor.execute("UPDATE event_sequence SET last_id = ?", (max_id,))
+        conn.commit()
+        return
     
     cursor.execute("""
-        SELECT hash_after FROM events
-        WHERE file_path = ? AND hash_after IS NOT NULL
-        ORDER BY timestamp DESC
-        LIMIT 1
-    """, (file_path,))
+        SELECT s.file_path, s.last_timestamp, s.endpoint, s.last_event_type, paths.id
+        FROM file_state s LEFT JOIN paths ON paths.path = s.file_path
+        WHERE s.last_event_id = ?
+    """, (last_id,))
+    row = cursor.fetchone()
+    if row is None:
+        return
+    file_path, timestamp, endpoint, event_type, path_id = row
+    covering = partitions_between(timestamp, timestamp + 1)
+    if not covering:
+        # Dropped by the retention policy, not lost
+        return
+    attach(cursor, attach_uri(covering[0]))
+    cursor.execute("SELECT 1 FROM p.events WHERE id = ?", (last_id,))
+    stored = cursor.fetchone() is not None
+    cursor.execute("DETACH DATABASE p")
+    if stored:
+        return
+    
+    print(f"[DB] Rebuilding the state of {file_path}, whose last event was not stored")
+    # Partitions cannot be attached inside the transaction, so look them up first
+    latest = _latest_path_event(path_id) if path_id is not None else None
+    baseline = _latest_path_event(path_id, "hash_after IS NOT NULL") if latest else None
+    _count_rollups(cursor, timestamp, endpoint, event_type, -1)
+    cursor.execute("DELETE FROM file_state WHERE file_path = ?", (file_path,))
+    cursor.execute("DELETE FROM hash_baseline WHERE file_path = ?", (file_path,))
+    # The baseline event's file_state row is overwritten by the newest event next
+    if baseline:
+        _record_event_state(cursor, baseline, baseline["id"])
+    if latest:
+        _record_event_state(cursor, latest, latest["id"])
+    conn.commit()
+
+
+def get_events_after(event_id: int, limit: int) -> List[Dict[str, Any]]:
+    """Get the events with ids above event_id in id order, e.g. to replicate them
+    
+    Every partition is read with a range scan on its primary key; events
+    with old timestamps can land in any of them.
+    
+    Args:
+        event_id: Exclusive lower id bound
+        limit: Maximum number of events to return
     
-    result = cursor.fetchone()
-    conn.close()
+    Returns:
+        Event rows as dictionaries (timestamp in epoch nanoseconds)
+    """
+    cursor = get_connection().cursor()
+    cursor.row_factory = sqlite3.Row
+    cursor.execute(EVENTS_VIEW_SQL)
     
-    return result[0] if result else None
+    rows: List[sqlite3.Row] = []
+    for path in partitions_between():
+        try:
+            attach(cursor, attach_uri(path))
+        except sqlite3.OperationalError:
+            continue
+        try:
+            cursor.execute("SELECT * FROM events_view WHERE id > ? ORDER BY id LIMIT ?", (event_id, limit))
+            rows.extend(cursor.fetchall())
+        finally:
+            cursor.execute("DETACH DATABASE p")
+    
+    rows.sort(key=lambda row: row["id"])
+    return [dict(row) for row in rows[:limit]]
 
 
-def get_latest_events(limit: int = 100, event_type: Optional[str] = None) -> List[Dict[str, Any]]:
-    """Get the latest events from the database"""
-    conn = sqlite3.connect(DB_PATH)
-    conn.row_factory = sqlite3.Row
-    cursor = conn.cursor()
+def get_mongo_watermark() -> int:
+    """Id of the last event replicated to MongoDB"""
+    cursor = get_connection().cursor()
+    cursor.execute("SELECT last_id FROM mongo_watermark")
+    return cursor.fetchone()[0]
+
+
+def set_mongo_watermark(event_id: int) -> None:
+    """Record that every event up to event_id is stored in MongoDB"""
+    with connection() as conn:
+        conn.execute("UPDATE mongo_watermark SET last_id = MAX(last_id, ?)", (event_id,))
+        conn.commit()
+
+
+def _query_partitions(
+    build_query: Callable[[sqlite3.Cursor], Tuple[str, List[Any]]],
+    limit: int,
+    since: Optional[int] = None,
+    until: Optional[int] = None
+) -> List[sqlite3.Row]:
+    """Run a newest-first events query over the partitions until limit rows are found
+    
+    Partitions are visited newest first and attached one at a time as schema
+    "p", so results concatenate in timestamp order and older files are never
+    opened once the page is full.
+    
+    Args:
+        build_query: Returns the SQL (reading events_view or p.events, ending
+            in LIMIT ?) and its parameters without the limit
+        limit: Maximum number of rows to return
+        since: Optional lower bound in epoch nanoseconds used to skip partitions
+        until: Optional upper bound in epoch nanoseconds used to skip partitions
+    
+    Returns:
+        Matching rows, newest first
+    """
+    cursor = get_connection().cursor()
+    cursor.row_factory = sqlite3.Row
+    cursor.execute(EVENTS_VIEW_SQL)
+    
+    rows: List[sqlite3.Row] = []
+    for path in partitions_between(since, until):
+        try:
+            attach(cursor, attach_uri(path))
+        except sqlite3.OperationalError:
+            # Dropped by the retention policy since it was listed
+            continue
+        try:
+            query, params = build_query(cursor)
+            cursor.execute(query, params + [limit - len(rows)])
+            rows.extend(cursor.fetchall())
+        finally:
+            cursor.execute("DETACH DATABASE p")
+        if len(rows) >= limit:
+            break
+    
+    return rows
+
+
+def get_latest_hash(file_path: str) -> Optional[str]:
+    """Get the most recent hash_after for a given file path
+    
+    Answered by the file_path index of hash_baseline, which insert_event
+    updates in the same commit as each event (see _reconcile_event_state).
+    """
+    cursor = get_connection().cursor()
+    cursor.execute("SELECT content_hash FROM hash_baseline WHERE file_path = ?", (file_path,))
+    row = cursor.fetchone()
+    
+    return row[0] if row else None
+
+
+def _time_range_conditions(since: Optional[int], until: Optional[int]) -> Tuple[List[str], List[Any]]:
+    """Conditions selecting [since, until) in epoch nanoseconds, a range scan on (timestamp, id)"""
+    conditions: List[str] = []
+    params: List[Any] = []
+    if since is not None:
+        conditions.append("timestamp >= ?")
+        params.append(since)
+    if until is not None:
+        conditions.append("timestamp < ?")
+        params.append(until)
+    return conditions, params
+
+
+def get_latest_events(
+    limit: int = 100,
+    event_type: Optional[str] = None,
+    since: Optional[datetime] = None,
+    until: Optional[datetime] = None
+) -> List[Dict[str, Any]]:
+    """Get the latest events from the database
     
+    Args:
+        limit: Maximum number of events to return
+        event_type: Optional event type to restrict to
+        since: Optional inclusive lower time bound
+        until: Optional exclusive upper time bound
+    
+    Returns:
+        List of event dictionaries, newest first
+    """
+    since_ns, until_ns = time_range(since, until)
+    conditions, params = _time_range_conditions(since_ns, until_ns)
     if event_type and event_type != "all":
-        cursor.execute("""
-            SELECT * FROM events
-            WHERE event_type = ?
-            ORDER BY timestamp DESC
-            LIMIT ?
-        """, (event_type, limit))
-    else:
-        cursor.execute("""
-            SELECT * FROM events
-            ORDER BY timestamp DESC
-            LIMIT ?
-        """, (limit,))
+        conditions.append("event_type = ?")
+        params.append(event_type)
+    where = " WHERE " + " AND ".join(conditions) if conditions else ""
     
-    rows = cursor.fetchall()
-    conn.close()
+    rows = _query_partitions(lambda cursor: (f"""
+        SELECT * FROM events_view{where}
+        ORDER BY timestamp DESC, id DESC
+        LIMIT ?
+    """, list(params)), limit, since=since_ns, until=until_ns)
     
     events = []
     for row in rows:
@@ -181,7 +846,7 @@ def get_latest_events(limit: int = 100, event_type: Optional[str] = None) -> Lis
             "id": row["id"],
             "event_type": row["event_type"],
             "file_path": row["file_path"],
-            "timestamp": row["timestamp"],
+            "timestamp": format_ns(row["timestamp"]),
             "endpoint": row["endpoint"],
             "hostname": row["hostname"],
             "username": row["username"],
@@ -192,52 +857,203 @@ def get_latest_events(limit: int = 100, event_type: Optional[str] = None) -> Lis
     return events
 
 
-def get_latest_events_filtered(
-    limit: int = 100,
-    event_types: Optional[List[str]] = None,
-    search_query: Optional[str] = None,
-    search_columns: Optional[List[str]] = None
+def get_rollups(
+    granularity: str = "hour",
+    since: Optional[datetime] = None,
+    until: Optional[datetime] = None,
+    endpoint: Optional[str] = None,
+    event_type: Optional[str] = None,
+    limit: int = 1000
 ) -> List[Dict[str, Any]]:
-    """Get the latest events with advanced filtering"""
-    conn = sqlite3.connect(DB_PATH)
-    conn.row_factory = sqlite3.Row
-    cursor = conn.cursor()
+    """Get hourly or daily event counts, which are kept after partitions are dropped
+    
+    Args:
+        granularity: "hour" or "day"
+        since: Optional inclusive lower bucket bound
+        until: Optional exclusive upper bucket bound
+        endpoint: Optional endpoint to restrict to
+        event_type: Optional event type to restrict to
+        limit: Maximum number of buckets to return
     
-    query = "SELECT * FROM events WHERE 1=1"
+    Returns:
+        List of rollup dictionaries, newest bucket first
+    """
+    granularity = granularity if granularity in ROLLUP_TABLES else "hour"
+    bucket_format = "%Y-%m-%d" if granularity == "day" else TIMESTAMP_FORMAT
+    query = f"SELECT * FROM {ROLLUP_TABLES[granularity]} WHERE 1=1"
     params: List[Any] = []
     
-    if event_types and len(event_types) > 0:
-        placeholders = ",".join("?" * len(event_types))
-        query += f" AND event_type IN ({placeholders})"
-        params.extend(event_types)
+    since = since.strftime(bucket_format) if since else None
+    until = until.strftime(bucket_format) if until else None
+    for condition, value in (("bucket >= ?", since), ("bucket < ?", until),
+                             ("endpoint = ?", endpoint), ("event_type = ?", event_type)):
+        if value:
+            query += f" AND {condition}"
+            params.append(value)
     
-    if search_query and search_query.strip():
-        search_term = f"%{search_query.strip()}%"
-        if search_columns and len(search_columns) > 0:
-            column_conditions = []
-            for col in search_columns:
-                if col in ["timestamp", "event_type", "file_path", "endpoint", "hostname", "username"]:
-                    column_conditions.append(f"{col} LIKE ?")
-                    params.append(search_term)
-            if column_conditions:
-                query += " AND (" + " OR ".join(column_conditions) + ")"
-        else:
-            query += """ AND (
-                timestamp LIKE ? OR
-                event_type LIKE ? OR
-                file_path LIKE ? OR
-                endpoint LIKE ? OR
-                hostname LIKE ? OR
-                username LIKE ?
-            )"""
-            params.extend([search_term] * 6)
-    
-    query += " ORDER BY timestamp DESC LIMIT ?"
+    query += " ORDER BY bucket DESC LIMIT ?"
     params.append(limit)
     
+    cursor = get_connection().cursor()
+    cursor.row_factory = sqlite3.Row
     cursor.execute(query, params)
     rows = cursor.fetchall()
-    conn.close()
+    
+    return [dict(row) for row in rows]
+
+
+FTS_COLUMNS = ["file_path", "endpoint", "hostname", "username"]
+# Trigrams need at least three characters; shorter terms fall back to LIKE
+FTS_MIN_TERM = 3
+
+
+def _glob_literal(text: str) -> str:
+    """Escape GLOB metacharacters so text only matches itself"""
+    return "".join(f"[{c}]" if c in "*?[" else c for c in text)
+
+
+def _dimension_ids(column: str, condition: str) -> str:
+    """Condition on an events_view id column selecting dimension rows by value
+    
+    Args:
+        column: Event column backed by a dimension table (see DIMENSIONS)
+        condition: SQL condition with {} standing for the dimension's value column
+    """
+    table, value_column, id_column = DIMENSIONS[column]
+    return f"{id_column} IN (SELECT id FROM main.{table} WHERE {condition.format(value_column)})"
+
+
+def _search_conditions(
+    cursor: sqlite3.Cursor,
+    search: SearchQuery,
+    search_columns: Optional[List[str]] = None,
+    schema: str = "p"
+) -> Tuple[List[str], List[Any]]:
+    """Translate a parsed search into index-backed SQL conditions on events_view
+    
+    Hosts, endpoints and paths are matched in their dimension tables and
+    applied to the partition through the id indexes.
+    
+    Args:
+        cursor: Open cursor, used to check whether the FTS indexes exist
+        search: Parsed search box contents
+        search_columns: Optional columns free-text terms are restricted to
+        schema: Schema of the attached events partition
+    
+    Returns:
+        SQL conditions to AND together and their parameters
+    """
+    conditions: List[str] = []
+    params: List[Any] = []
+    
+    if search.types:
+        conditions.append(f"event_type IN ({','.join('?' * len(search.types))})")
+        params.extend(search.types)
+    for column, values in (("hostname", search.hosts), ("endpoint", search.endpoints)):
+        if values:
+            conditions.append(_dimension_ids(column, "{} IN (" + ",".join("?" * len(values)) + ")"))
+            params.extend(values)
+    
+    if search.paths:
+        # GLOB is case-sensitive, so a literal prefix becomes a range scan on the unique path index
+        path_conditions = []
+        for pattern in search.paths:
+            prefix, glob = split_glob(pattern)
+            if glob is None:
+                path_conditions.append("{} = ?")
+                params.append(prefix)
+            else:
+                path_conditions.append("{} GLOB ?")
+                params.append(_glob_literal(prefix) + glob[len(prefix):])
+        conditions.append(_dimension_ids("file_path", " OR ".join(path_conditions)))
+    
+    if search.hash_prefixes:
+        hash_conditions = []
+        for prefix in search.hash_prefixes:
+            hash_conditions.append("hash_after GLOB ? OR hash_before GLOB ?")
+            params.extend([prefix + "*"] * 2)
+        conditions.append("(" + " OR ".join(hash_conditions) + ")")
+    
+    time_conditions, time_params = _time_range_conditions(*time_range(search.since, search.until))
+    conditions.extend(time_conditions)
+    params.extend(time_params)
+    
+    if search.terms:
+        columns = [c for c in search_columns or [] if c in FTS_COLUMNS + ["event_type"]]
+        fts_columns = [c for c in columns if c in FTS_COLUMNS] if columns else FTS_COLUMNS
+        cursor.execute(f"""
+            SELECT (SELECT 1 FROM main.sqlite_master WHERE name = 'paths_fts'),
+                   (SELECT 1 FROM {schema}.sqlite_master WHERE name = 'events_fts')
+        """)
+        has_paths_fts, has_events_fts = cursor.fetchone()
+        for term in search.terms:
+            escaped = term.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_")
+            phrase = '"' + term.replace('"', '""') + '"'
+            use_fts = len(term) >= FTS_MIN_TERM
+            term_conditions = []
+            for column in fts_columns:
+                if column == "file_path" and has_paths_fts and use_fts:
+                    term_conditions.append(
+                        "path_id IN (SELECT rowid FROM main.paths_fts WHERE paths_fts MATCH ?)"
+                    )
+                    params.append(phrase)
+                elif column == "username" and has_events_fts and use_fts:
+                    term_conditions.append(
+                        f"id IN (SELECT rowid FROM {schema}.events_fts WHERE events_fts MATCH ?)"
+                    )
+                    params.append(phrase)
+                elif column in DIMENSIONS:
+                    # Endpoints and hosts are few, scanning their tables is cheap
+                    term_conditions.append(_dimension_ids(column, "{} LIKE ? ESCAPE '\\'"))
+                    params.append(f"%{escaped}%")
+                else:
+                    term_conditions.append(f"{column} LIKE ? ESCAPE '\\'")
+                    params.append(f"%{escaped}%")
+            if "event_type" in columns:
+                term_conditions.append("event_type LIKE ? ESCAPE '\\'")
+                params.append(f"%{escaped}%")
+            conditions.append("(" + " OR ".join(term_conditions) + ")")
+    
+    return conditions, params
+
+
+def get_latest_events_filtered(
+    limit: int = 100,
+    event_types: Optional[List[str]] = None,
+    search: Optional[SearchQuery] = None,
+    search_columns: Optional[List[str]] = None
+) -> List[Dict[str, Any]]:
+    """Get the latest events with advanced filtering
+    
+    Args:
+        limit: Maximum number of events to return
+        event_types: Optional event types selected in the filter panel
+        search: Optional parsed search box contents
+        search_columns: Optional columns free-text terms are restricted to
+    
+    Returns:
+        List of event dictionaries, newest first
+    """
+    def build_query(cursor: sqlite3.Cursor) -> Tuple[str, List[Any]]:
+        query = "SELECT * FROM events_view WHERE 1=1"
+        params: List[Any] = []
+        
+        if event_types and len(event_types) > 0:
+            placeholders = ",".join("?" * len(event_types))
+            query += f" AND event_type IN ({placeholders})"
+            params.extend(event_types)
+        
+        if search:
+            conditions, search_params = _search_conditions(cursor, search, search_columns, schema="p")
+            for condition in conditions:
+                query += f" AND {condition}"
+            params.extend(search_params)
+        
+        query += " ORDER BY timestamp DESC, id DESC LIMIT ?"
+        return query, params
+    
+    since_ns, until_ns = time_range(search.since, search.until) if search else (None, None)
+    rows = _query_partitions(build_query, limit, since=since_ns, until=until_ns)
     
     events = []
     for row in rows:
@@ -245,7 +1061,7 @@ def get_latest_events_filtered(
             "id": row["id"],
             "event_type": row["event_type"],
             "file_path": row["file_path"],
-            "timestamp": row["timestamp"],
+            "timestamp": format_ns(row["timestamp"]),
             "endpoint": row["endpoint"],
             "hostname": row["hostname"],
             "username": row["username"],
@@ -256,57 +1072,106 @@ def get_latest_events_filtered(
     return events
 
 
-def get_distinct_file_paths(endpoints: Optional[List[str]] = None) -> List[Dict[str, Any]]:
-    """Get distinct file paths with their latest event information"""
-    conn = sqlite3.connect(DB_PATH)
-    conn.row_factory = sqlite3.Row
-    cursor = conn.cursor()
+FILE_STATE_SORTS = {
+    "last_timestamp": "last_timestamp",
+    "file_path": "file_path",
+    "endpoint": "endpoint",
+    "classification": "COALESCE(classification, '')",
+}
+
+
+def get_file_states_page(
+    endpoints: Optional[List[str]] = None,
+    search_query: Optional[str] = None,
+    sort: str = "last_timestamp",
+    order: str = "desc",
+    limit: Optional[int] = None,
+    cursor_token: Optional[str] = None
+) -> Dict[str, Any]:
+    """Get one keyset page of file_state
     
-    query = """
-        SELECT DISTINCT
-            e1.file_path,
-            e1.timestamp as last_timestamp,
-            e1.endpoint,
-            e1.hostname,
-            e1.username
-        FROM events e1
-        INNER JOIN (
-            SELECT file_path, MAX(timestamp) as max_timestamp
-            FROM events
-            GROUP BY file_path
-        ) e2 ON e1.file_path = e2.file_path AND e1.timestamp = e2.max_timestamp
+    Args:
+        endpoints: Optional endpoints to include
+        search_query: Optional case-insensitive substring of the file path
+        sort: One of FILE_STATE_SORTS; file_path breaks ties
+        order: "asc" or "desc"
+        limit: Page size (clamped to the maximum page size)
+        cursor_token: next_cursor from the previous page
+    
+    Returns:
+        Dictionary with "files" and "next_cursor" (None on the last page)
+    
+    Raises:
+        ValueError: If the cursor is malformed
     """
+    sort_expr = FILE_STATE_SORTS.get(sort, FILE_STATE_SORTS["last_timestamp"])
+    direction = "ASC" if order == "asc" else "DESC"
+    limit = clamp_page_size(limit)
+    after = decode_cursor(cursor_token)
     
+    query = f"SELECT *, {sort_expr} AS sort_key FROM file_state WHERE 1=1"
     params: List[Any] = []
+    
     if endpoints and len(endpoints) > 0:
         placeholders = ",".join("?" * len(endpoints))
-        query += f" WHERE e1.endpoint IN ({placeholders})"
+        query += f" AND endpoint IN ({placeholders})"
         params.extend(endpoints)
     
-    query += " ORDER BY e1.timestamp DESC"
+    if search_query and search_query.strip():
+        escaped = search_query.strip().replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_")
+        query += " AND file_path LIKE ? ESCAPE '\\'"
+        params.append(f"%{escaped}%")
+    
+    if after:
+        sort_type = int if sort_expr == "last_timestamp" else str
+        if len(after) != 2 or type(after[0]) is not sort_type or not isinstance(after[1], str):
+            raise ValueError("Invalid cursor")
+        comparison = ">" if direction == "ASC" else "<"
+        query += f" AND ({sort_expr}, file_path) {comparison} (?, ?)"
+        params.extend(after)
     
+    query += f" ORDER BY {sort_expr} {direction}, file_path {direction} LIMIT ?"
+    params.append(limit + 1)
+    
+    cursor = get_connection().cursor()
+    cursor.row_factory = sqlite3.Row
     cursor.execute(query, params)
     rows = cursor.fetchall()
-    conn.close()
+    
+    next_cursor = None
+    if len(rows) > limit:
+        rows = rows[:limit]
+        next_cursor = encode_cursor([rows[-1]["sort_key"], rows[-1]["file_path"]])
     
     files = []
     for row in rows:
         files.append({
             "file_path": row["file_path"],
-            "last_timestamp": row["last_timestamp"],
+            "last_timestamp": format_ns(row["last_timestamp"]),
+            "last_event_type": row["last_event_type"],
             "endpoint": row["endpoint"],
             "hostname": row["hostname"],
             "username": row["username"],
+            "content_hash": row["content_hash"],
+            "classification": row["classification"],
         })
     
-    return files
+    return {"files": files, "next_cursor": next_cursor}
+
+
+def set_file_state_classification(cursor: sqlite3.Cursor, file_path: str,
+                                  classification: Optional[str]) -> None:
+    """Mirror a classification change into file_state on the caller's connection"""
+    cursor.execute(
+        "UPDATE file_state SET classification = ? WHERE file_path = ?",
+        (classification, file_path)
+    )
 
 
 def get_file_classification(file_path: str) -> Optional[Dict[str, Any]]:
     """Get classification for a specific file path"""
-    conn = sqlite3.connect(DB_PATH)
-    conn.row_factory = sqlite3.Row
-    cursor = conn.cursor()
+    cursor = get_connection().cursor()
+    cursor.row_factory = sqlite3.Row
     
     cursor.execute("""
         SELECT * FROM file_classification
@@ -314,7 +1179,6 @@ def get_file_classification(file_path: str) -> Optional[Dict[str, Any]]:
     """, (file_path,))
     
     row = cursor.fetchone()
-    conn.close()
     
     if row:
         return {
@@ -337,45 +1201,137 @@ def upsert_file_classification(
     username: Optional[str] = None
 ) -> int:
     """Insert or update file classification"""
-    conn = sqlite3.connect(DB_PATH)
-    cursor = conn.cursor()
+    with connection() as conn:
+        cursor = conn.cursor()
+        
+        timestamp = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+        
+        cursor.execute("SELECT id FROM file_classification WHERE file_path = ?", (file_path,))
+        existing = cursor.fetchone()
+        
+        if existing:
+            cursor.execute("""
+                UPDATE file_classification SET
+                    classification = ?,
+                    last_updated_timestamp = ?,
+                    endpoint = ?,
+                    hostname = ?,
+                    username = ?
+                WHERE file_path = ?
+            """, (classification, timestamp, endpoint, hostname, username, file_path))
+            record_id = existing[0]
+        else:
+            cursor.execute("""
+                INSERT INTO file_classification (
+                    file_path, classification, last_updated_timestamp,
+                    endpoint, hostname, username
+                ) VALUES (?, ?, ?, ?, ?, ?)
+            """, (file_path, classification, timestamp, endpoint, hostname, username))
+            record_id = cursor.lastrowid
+        
+        set_file_state_classification(cursor, file_path, classification)
+        conn.commit()
     
-    timestamp = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+    return record_id if record_id else 0
+
+
+def clear_file_classification(file_path: str) -> None:
+    """Remove the classification of a file path"""
+    with connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute("DELETE FROM file_classification WHERE file_path = ?", (file_path,))
+        set_file_state_classification(cursor, file_path, None)
+        conn.commit()
+
+
+def bulk_save_classifications(entries: List[Any]) -> List[Dict[str, Any]]:
+    """Upsert and clear many classifications in a single transaction
     
-    cursor.execute("SELECT id FROM file_classification WHERE file_path = ?", (file_path,))
-    existing = cursor.fetchone()
+    Uses one executemany INSERT ... ON CONFLICT(file_path) DO UPDATE,
+    chunked DELETE ... IN statements for cleared paths and one file_state
+    UPDATE per classification level, instead of a SELECT plus UPDATE/INSERT
+    per file.
     
-    if existing:
-        cursor.execute("""
-            UPDATE file_classification SET
-                classification = ?,
-                last_updated_timestamp = ?,
-                endpoint = ?,
-                hostname = ?,
-                username = ?
-            WHERE file_path = ?
-        """, (classification, timestamp, endpoint, hostname, username, file_path))
-        record_id = existing[0]
-    else:
-        cursor.execute("""
+    Args:
+        entries: Dicts with file_path and classification (empty to clear),
+            plus optional endpoint, hostname and username
+    
+    Returns:
+        One outcome dict per entry, in input order
+    """
+    results: List[Optional[Dict[str, Any]]] = [None] * len(entries)
+    latest: Dict[str, int] = {}
+    for position, entry in enumerate(entries):
+        file_path = entry.get("file_path") if isinstance(entry, dict) else None
+        if not file_path or not isinstance(file_path, str):
+            results[position] = {"file_path": file_path, "status": "invalid", "message": "Missing file_path"}
+            continue
+        classification = entry.get("classification") or ""
+        if not isinstance(classification, str):
+            results[position] = {"file_path": file_path, "status": "invalid",
+                                 "message": "Classification must be a string"}
+            continue
+        classification = classification.strip()
+        if classification and classification not in CLASSIFICATION_LEVELS:
+            results[position] = {"file_path": file_path, "status": "invalid",
+                                 "message": f"Unknown classification: {classification}"}
+            continue
+        if file_path in latest:
+            results[latest[file_path]] = {"file_path": file_path, "status": "skipped",
+                                          "message": "Superseded by a later entry"}
+        latest[file_path] = position
+    
+    timestamp = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+    upserts = []
+    clears = []
+    by_level: Dict[Optional[str], List[str]] = {}
+    for file_path, position in latest.items():
+        entry = entries[position]
+        classification = (entry.get("classification") or "").strip()
+        if classification:
+            upserts.append((file_path, classification, timestamp, entry.get("endpoint"),
+                            entry.get("hostname"), entry.get("username")))
+            results[position] = {"file_path": file_path, "status": "saved", "classification": classification}
+        else:
+            clears.append(file_path)
+            results[position] = {"file_path": file_path, "status": "cleared"}
+        by_level.setdefault(classification or None, []).append(file_path)
+    
+    conn = get_connection()
+    with conn:
+        conn.executemany("""
             INSERT INTO file_classification (
                 file_path, classification, last_updated_timestamp,
                 endpoint, hostname, username
             ) VALUES (?, ?, ?, ?, ?, ?)
-        """, (file_path, classification, timestamp, endpoint, hostname, username))
-        record_id = cursor.lastrowid
+            ON CONFLICT(file_path) DO UPDATE SET
+                classification = excluded.classification,
+                last_updated_timestamp = excluded.last_updated_timestamp,
+                endpoint = excluded.endpoint,
+                hostname = excluded.hostname,
+                username = excluded.username
+        """, upserts)
+        for start in range(0, len(clears), BULK_CHUNK_SIZE):
+            chunk = clears[start:start + BULK_CHUNK_SIZE]
+            conn.execute(
+                f"DELETE FROM file_classification WHERE file_path IN ({','.join('?' * len(chunk))})", chunk
+            )
+        # Mirror into file_state with one UPDATE per level rather than per file
+        for level, paths in by_level.items():
+            for start in range(0, len(paths), BULK_CHUNK_SIZE):
+                chunk = paths[start:start + BULK_CHUNK_SIZE]
+                conn.execute(
+                    f"UPDATE file_state SET classification = ? WHERE file_path IN ({','.join('?' * len(chunk))})",
+                    [level] + chunk
+                )
     
-    conn.commit()
-    conn.close()
-    
-    return record_id if record_id else 0
+    return results
 
 
 def get_all_classifications(endpoints: Optional[List[str]] = None) -> List[Dict[str, Any]]:
     """Get all file classifications, optionally filtered by endpoints"""
-    conn = sqlite3.connect(DB_PATH)
-    conn.row_factory = sqlite3.Row
-    cursor = conn.cursor()
+    cursor = get_connection().cursor()
+    cursor.row_factory = sqlite3.Row
     
     query = "SELECT * FROM file_classification WHERE 1=1"
     params: List[Any] = []
@@ -389,7 +1345,6 @@ def get_all_classifications(endpoints: Optional[List[str]] = None) -> List[Dict[
     
     cursor.execute(query, params)
     rows = cursor.fetchall()
-    conn.close()
     
     classifications = []
     for row in rows:
@@ -407,12 +1362,10 @@ def get_all_classifications(endpoints: Optional[List[str]] = None) -> List[Dict[
 
 
 def get_distinct_endpoints() -> List[str]:
-    """Get list of distinct endpoints from events table"""
-    conn = sqlite3.connect(DB_PATH)
-    cursor = conn.cursor()
+    """Get list of endpoints from the endpoints dimension table"""
+    cursor = get_connection().cursor()
     
-    cursor.execute("SELECT DISTINCT endpoint FROM events ORDER BY endpoint")
+    cursor.execute("SELECT name FROM endpoints ORDER BY name")
     rows = cursor.fetchall()
-    conn.close()
     
     return [row[0] for row in rows if row[0]]
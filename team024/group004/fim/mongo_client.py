@@ -1,98 +1,355 @@
-"""MongoDB client for FIM events"""
+"""MongoDB client for FIM events
+
+The connection sits behind a circuit breaker. While MongoDB is reachable the
+circuit is closed and calls use the cached collection. When a ping or an
+operation fails with a connection error the circuit opens: calls return at
+once without touching the network, and a background thread pings MongoDB with
+jittered exponential backoff until it answers and closes the circuit again.
+"""
+import random
+import threading
 import time
 import ssl
 import certifi
 from typing import Optional, Dict, Any, List
-from pymongo import MongoClient
-from pymongo.errors import ConnectionFailure, ServerSelectionTimeoutError
+from bson import ObjectId
+from bson.errors import InvalidId
+from pymongo import MongoClient, IndexModel, ASCENDING, DESCENDING
+from pymongo.errors import BulkWriteError, ConnectionFailure, OperationFailure
+
+from .config import (
+    MONGO_URI, MONGO_DB_NAME, MONGO_COLLECTION_NAME,
+    MONGO_TIMEOUT_MS, MONGO_RECONNECT_MIN_SECONDS, MONGO_RECONNECT_MAX_SECONDS,
+)
+from .pagination import encode_cursor, decode_cursor, clamp_page_size
+
+DUPLICATE_KEY_ERROR = 11000
 
-from .config import MONGO_URI, MONGO_DB_NAME, MONGO_COLLECTION_NAME, AGENT_ID
+# Newest first, ties broken by _id; every read sorts this way so the indexes
+# below serve both the filter and the sort
+EVENT_SORT = [("timestamp", DESCENDING), ("_id", DESCENDING)]
+EVENT_INDEXES = [
+    IndexModel(EVENT_SORT, name="timestamp_id"),
+    IndexModel([("agent_id", ASCENDING)] + EVENT_SORT, name="agent_timestamp_id"),
+    IndexModel([("event_type", ASCENDING)] + EVENT_SORT, name="type_timestamp_id"),
+    IndexModel([("path", ASCENDING)] + EVENT_SORT, name="path_timestamp_id"),
+]
+# Fields the dashboard shows; the hashes before/after a change stay on the server
+EVENT_PROJECTION = {
+    "event_id": 1, "agent_id": 1, "timestamp": 1, "event_type": 1, "path": 1,
+    "content_hash": 1, "endpoint": 1, "hostname": 1, "username": 1,
+}
 
+_lock = threading.Lock()
 _mongo_client: Optional[MongoClient] = None
+# Set only while the circuit is closed
 _mongo_collection = None
+_reconnect_thread: Optional[threading.Thread] = None
 
 
-def get_mongo_connection():
-    """Get MongoDB connection (singleton pattern)"""
-    global _mongo_client, _mongo_collection
-    
-    if not MONGO_URI:
-        return None
+def _get_client() -> MongoClient:
+    """Create the MongoClient on first use; it does not connect until a command runs"""
+    global _mongo_client
     
     if _mongo_client is None:
+        _mongo_client = MongoClient(
+            MONGO_URI,
+            serverSelectionTimeoutMS=MONGO_TIMEOUT_MS,
+            connectTimeoutMS=MONGO_TIMEOUT_MS,
+            socketTimeoutMS=MONGO_TIMEOUT_MS,
+            tlsCAFile=certifi.where()
+        )
+    return _mongo_client
+
+
+def _reconnect_delay(attempt: int) -> float:
+    """Backoff before the next ping: half the exponential step plus random jitter
+    
+    The jitter keeps agents that lost the same server from reconnecting in lockstep.
+    """
+    step = min(MONGO_RECONNECT_MAX_SECONDS, MONGO_RECONNECT_MIN_SECONDS * 2 ** attempt)
+    return step / 2 + random.uniform(0, step / 2)
+
+
+def _reconnect() -> None:
+    """Ping MongoDB until it answers, then close the circuit"""
+    global _mongo_collection, _reconnect_thread
+    
+    attempt = 0
+    while True:
         try:
-            _mongo_client = MongoClient(
-                MONGO_URI,
-                serverSelectionTimeoutMS=10000,
-                connectTimeoutMS=10000,
-                socketTimeoutMS=10000,
-                tlsCAFile=certifi.where()
-            )
-            _mongo_client.admin.command('ping')
-            _mongo_collection = _mongo_client[MONGO_DB_NAME][MONGO_COLLECTION_NAME]
-            print(f"[MONGO] Connected to MongoDB database: {MONGO_DB_NAME}")
-        except (ConnectionFailure, ServerSelectionTimeoutError) as e:
-            print(f"[MONGO] Failed to connect to MongoDB: {e}")
-            _mongo_client = None
-            _mongo_collection = None
+            client = _get_client()
+            client.admin.command('ping')
+            collection = client[MONGO_DB_NAME][MONGO_COLLECTION_NAME]
+            ensure_mongo_indexes(collection)
+            break
         except Exception as e:
-            print(f"[MONGO] Unexpected error: {e}")
-            _mongo_client = None
-            _mongo_collection = None
+            delay = _reconnect_delay(attempt)
+            attempt += 1
+            print(f"[MONGO] MongoDB unreachable, retrying in {delay:.1f}s: {e}")
+            time.sleep(delay)
+    
+    with _lock:
+        _mongo_collection = collection
+        _reconnect_thread = None
+    print(f"[MONGO] Connected to MongoDB database: {MONGO_DB_NAME}")
+
+
+def ensure_mongo_indexes(collection) -> None:
+    """Create the event indexes if missing; runs each time the circuit closes
+    
+    Args:
+        collection: The events collection
+    
+    Raises:
+        ConnectionFailure: If MongoDB is unreachable. Other errors, such as a
+            user without the createIndex privilege, are logged and ignored.
+    """
+    try:
+        collection.create_indexes(EVENT_INDEXES)
+    except OperationFailure as e:
+        print(f"[MONGO] Could not create event indexes: {e}")
+
+
+def _start_reconnect() -> None:
+    """Start the reconnect thread unless it is already running"""
+    global _reconnect_thread
+    
+    with _lock:
+        if _mongo_collection is not None or _reconnect_thread is not None:
+            return
+        _reconnect_thread = threading.Thread(target=_reconnect, name="mongo-reconnect", daemon=True)
+        _reconnect_thread.start()
+
+
+def _open_circuit(error: Exception) -> None:
+    """Stop using the connection after a connection error and start reconnecting"""
+    global _mongo_collection
+    
+    with _lock:
+        was_closed = _mongo_collection is not None
+        _mongo_collection = None
+    if was_closed:
+        print(f"[MONGO] Lost connection to MongoDB: {error}")
+    _start_reconnect()
+
+
+def get_mongo_connection():
+    """Get the MongoDB collection without blocking
+    
+    Returns:
+        The collection while the circuit is closed, None if MongoDB is not
+        configured or not reachable (a background reconnect is then running)
+    """
+    if not MONGO_URI:
+        return None
     
-    return _mongo_collection
+    collection = _mongo_collection
+    if collection is None:
+        _start_reconnect()
+    return collection
 
 
-def send_event_to_mongo(event: Dict[str, Any]) -> bool:
-    """Insert a single FIM event document into MongoDB
+def send_events_to_mongo(events: List[Dict[str, Any]]) -> bool:
+    """Insert a batch of FIM event documents into MongoDB
+    
+    Documents carry their own _id, so a batch that is sent again after a
+    partial failure only adds the missing ones: duplicate key errors count
+    as stored.
     
     Args:
-        event: Event document to insert
+        events: Event documents to insert
     
     Returns:
-        True if successful, False otherwise
+        True if every document is stored, False otherwise
     """
     collection = get_mongo_connection()
     if collection is None:
         return False
     
     try:
-        event["agent_id"] = AGENT_ID
-        collection.insert_one(event)
+        collection.insert_many(events, ordered=False)
         return True
+    except BulkWriteError as e:
+        failed = [
+            error for error in e.details.get("writeErrors", [])
+            if error.get("code") != DUPLICATE_KEY_ERROR
+        ]
+        if not failed and not e.details.get("writeConcernErrors"):
+            return True
+        print(f"[MONGO] Failed to send {len(failed)} of {len(events)} events: {e}")
+        return False
+    except ConnectionFailure as e:
+        _open_circuit(e)
+        return False
     except Exception as e:
-        print(f"[MONGO] Failed to send event: {e}")
+        print(f"[MONGO] Failed to send events: {e}")
         return False
 
 
-def get_events_from_mongo(limit: int = 100, event_type: Optional[str] = None) -> List[Dict[str, Any]]:
-    """Get events from MongoDB
+def _id_cursor(value) -> List[str]:
+    """Cursor form of a document _id: its string and whether it is an ObjectId
+    
+    Events replicated by the outbox have string ids; documents inserted by the
+    REFER agent and by earlier versions of this app have ObjectIds.
+    """
+    if isinstance(value, ObjectId):
+        return [str(value), "oid"]
+    return [value, "str"]
+
+
+def _after_condition(timestamp: str, last_id: str, kind: str) -> Dict[str, Any]:
+    """Filter for the events sorting after (timestamp, _id) in EVENT_SORT
+    
+    MongoDB compares _id values only within one BSON type, and ObjectIds sort
+    above strings, so after an ObjectId the string ids of the same timestamp
+    follow as well.
+    """
+    if kind == "oid":
+        try:
+            last_id = ObjectId(last_id)
+        except (InvalidId, TypeError) as e:
+            raise ValueError("Invalid cursor") from e
+    elif kind != "str" or not isinstance(last_id, str):
+        raise ValueError("Invalid cursor")
+    
+    ties = [{"timestamp": timestamp, "_id": {"$lt": last_id}}]
+    if kind == "oid":
+        ties.append({"timestamp": timestamp, "_id": {"$type": "string"}})
+    return {"$or": [{"timestamp": {"$lt": timestamp}}] + ties}
+
+
+def get_events_from_mongo(
+    limit: int = 100,
+    event_type: Optional[str] = None,
+    agent_id: Optional[str] = None,
+    path: Optional[str] = None,
+    cursor_token: Optional[str] = None
+) -> Dict[str, Any]:
+    """Get a page of events from MongoDB, newest first, across all agents
+    
+    Keyset pagination on (timestamp, _id) through one of EVENT_INDEXES, and
+    only the fields in EVENT_PROJECTION are returned. _id is returned as a
+    string whether it is stored as a string or an ObjectId.
     
     Args:
-        limit: Maximum number of events to return
+        limit: Page size (clamped to the maximum page size)
         event_type: Optional filter by event type
+        agent_id: Optional filter by agent
+        path: Optional filter by exact file path
+        cursor_token: next_cursor from the previous page
     
     Returns:
-        List of event documents
+        Dictionary with "events" and "next_cursor" (None on the last page)
+    
+    Raises:
+        ValueError: If the cursor is malformed
     """
+    limit = clamp_page_size(limit)
+    after = decode_cursor(cursor_token)
+    if after is not None:
+        # Cursors issued before ObjectId ids were handled carry no id kind
+        if len(after) == 2:
+            after = after + ["str"]
+        if len(after) != 3 or not isinstance(after[0], str):
+            raise ValueError("Invalid cursor")
+        after_condition = _after_condition(*after)
+    
     collection = get_mongo_connection()
     if collection is None:
-        return []
+        return {"events": [], "next_cursor": None}
+    
+    query: Dict[str, Any] = {}
+    if event_type and event_type != "all":
+        query["event_type"] = event_type
+    if agent_id:
+        query["agent_id"] = agent_id
+    if path:
+        query["path"] = path
+    if after is not None:
+        query.update(after_condition)
     
     try:
-        query = {}
-        if event_type and event_type != "all":
-            query["event_type"] = event_type
-        
-        cursor = collection.find(query).sort("timestamp", -1).limit(limit)
-        return list(cursor)
+        cursor = (
+            collection.find(query, EVENT_PROJECTION)
+            .sort(EVENT_SORT)
+            .limit(limit + 1)
+            .batch_size(limit + 1)
+        )
+        events = list(cursor)
+    except ConnectionFailure as e:
+        _open_circuit(e)
+        return {"events": [], "next_cursor": None}
     except Exception as e:
         print(f"[MONGO] Failed to get events: {e}")
-        return []
+        return {"events": [], "next_cursor": None}
+    
+    next_cursor = None
+    if len(events) > limit:
+        events = events[:limit]
+        next_cursor = encode_cursor([events[-1]["timestamp"]] + _id_cursor(events[-1]["_id"]))
+    for event in events:
+        event["_id"] = str(event["_id"])
+    return {"events": events, "next_cursor": next_cursor}
+
+
+def get_fleet_summary() -> Dict[str, Any]:
+    """Event counts per agent and per event type, aggregated on the server
+    
+    Returns:
+        Dictionary with "agents" (agent_id, total, last_seen and a counts
+        dict per event type, ordered by agent) and "types" (event_type and
+        count, most frequent first). Both are empty while MongoDB is not
+        connected.
+    """
+    collection = get_mongo_connection()
+    if collection is None:
+        return {"agents": [], "types": []}
+    
+    pipeline = [
+        {"$group": {
+            "_id": {"agent_id": "$agent_id", "event_type": "$event_type"},
+            "count": {"$sum": 1},
+            "last_seen": {"$max": "$timestamp"},
+        }},
+        {"$facet": {
+            "agents": [
+                {"$group": {
+                    "_id": "$_id.agent_id",
+                    "total": {"$sum": "$count"},
+                    "last_seen": {"$max": "$last_seen"},
+                    "counts": {"$push": {"k": "$_id.event_type", "v": "$count"}},
+                }},
+                {"$project": {
+                    "_id": 0,
+                    "agent_id": "$_id",
+                    "total": 1,
+                    "last_seen": 1,
+                    "counts": {"$arrayToObject": "$counts"},
+                }},
+                {"$sort": {"agent_id": 1}},
+            ],
+            "types": [
+                {"$group": {"_id": "$_id.event_type", "count": {"$sum": "$count"}}},
+                {"$project": {"_id": 0, "event_type": "$_id", "count": 1}},
+                {"$sort": {"count": -1, "event_type": 1}},
+            ],
+        }},
+    ]
+    
+    try:
+        result = list(collection.aggregate(pipeline))
+    except ConnectionFailure as e:
+        _open_circuit(e)
+        return {"agents": [], "types": []}
+    except Exception as e:
+        print(f"[MONGO] Failed to aggregate fleet summary: {e}")
+        return {"agents": [], "types": []}
+    return result[0] if result else {"agents": [], "types": []}
 
 
 def is_mongo_connected() -> bool:
-    """Check if MongoDB is connected
+    """Check if MongoDB is connected, from the cached circuit state
     
     Returns:
         True if connected, False otherwise
@@ -0,0 +1,39 @@
+"""Opaque cursors and page-size limits for keyset-paginated endpoints
+
+A separate copy of the cursor and page-size helpers in the root app's
+pagination.py, since this app is deployed on its own.
+"""
+import base64
+import json
+from typing import Any, List, Optional
+
+DEFAULT_PAGE_SIZE = 100
+MAX_PAGE_SIZE = 500
+
+
+def encode_cursor(values: List[Any]) -> str:
+    """Encode the sort key of the last row returned as an opaque cursor"""
+    raw = json.dumps(values, separators=(",", ":"), default=str).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip("=")
+
+
+def decode_cursor(cursor: Optional[str]) -> Optional[List[Any]]:
+    """Decode a cursor from encode_cursor; raises ValueError if it is malformed"""
+    if not cursor:
+        return None
+    try:
+        raw = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4))
+        values = json.loads(raw)
+    except (ValueError, TypeError) as e:
+        raise ValueError("Invalid cursor") from e
+    if not isinstance(values, list):
+        raise ValueError("Invalid cursor")
+    return values
+
+
+def clamp_page_size(limit: Optional[int], default: int = DEFAULT_PAGE_SIZE,
+                    maximum: int = MAX_PAGE_SIZE) -> int:
+    """Page size from a request argument, bounded to 1..maximum"""
+    if not limit or limit < 1:
+        return default
+    return min(limit, maximum)
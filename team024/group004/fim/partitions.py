@@ -0,0 +1,246 @@
+"""Time-partitioned event storage - one SQLite database file per period
+
+Each partition file holds the events of one month (or day) with its own
+indexes and FTS index. Queries attach partitions newest first, and the
+retention policy drops or archives whole files instead of running DELETE.
+"""
+import os
+import re
+import sqlite3
+import threading
+from datetime import datetime, timedelta
+from typing import Dict, List, Optional, Tuple
+from urllib.request import pathname2url
+
+from .config import (
+    PARTITION_DIR, ARCHIVE_DIR, EVENT_PARTITION_PERIOD, EVENT_RETENTION_DAYS, EVENT_RETENTION_MODE,
+)
+from .timestamps import from_ns, utc_to_ns
+
+PARTITION_FILE_RE = re.compile(r"^events_(\d{6}|\d{8})\.db$")
+
+EVENTS_SCHEMA = [
+    # Ids come from the event_sequence counter in the main database so they stay unique across files.
+    # path_id, endpoint_id and host_id point into the paths, endpoints and hosts tables of the
+    # main database; SQLite cannot enforce foreign keys across files, the write path keeps them valid.
+    # timestamp is in UTC epoch nanoseconds (see timestamps.py).
+    """
+    CREATE TABLE IF NOT EXISTS events (
+        id INTEGER PRIMARY KEY,
+        event_type TEXT NOT NULL,
+        path_id INTEGER NOT NULL,
+        timestamp INTEGER NOT NULL,
+        endpoint_id INTEGER NOT NULL,
+        host_id INTEGER NOT NULL,
+        username TEXT NOT NULL,
+        hash_before TEXT,
+        hash_after TEXT,
+        state_hash TEXT,
+        content_hash TEXT,
+        synced_to_mongo INTEGER DEFAULT 0
+    )
+    """,
+    "CREATE INDEX IF NOT EXISTS idx_event_type ON events(event_type)",
+    # Newest-first listing and time ranges; id breaks ties between events in the same nanosecond
+    "CREATE INDEX IF NOT EXISTS idx_events_timestamp_id ON events(timestamp, id)",
+    # Index-backed search predicates (host:, endpoint:, path:, hash:)
+    "CREATE INDEX IF NOT EXISTS idx_events_host_timestamp ON events(host_id, timestamp)",
+    "CREATE INDEX IF NOT EXISTS idx_events_endpoint_timestamp ON events(endpoint_id, timestamp)",
+    "CREATE INDEX IF NOT EXISTS idx_events_path_timestamp ON events(path_id, timestamp)",
+    "CREATE INDEX IF NOT EXISTS idx_events_hash_after ON events(hash_after)",
+    "CREATE INDEX IF NOT EXISTS idx_events_hash_before ON events(hash_before)",
+]
+
+_partition_lock = threading.Lock()
+# Partition path for a period -> the file that actually covers it
+_ready_partitions: Dict[str, str] = {}
+
+
+def period_start(ts: datetime, period: Optional[str] = None) -> datetime:
+    """Start of the partition period containing ts"""
+    period = period or EVENT_PARTITION_PERIOD
+    start = ts.replace(hour=0, minute=0, second=0, microsecond=0)
+    return start if period == "day" else start.replace(day=1)
+
+
+def next_period(start: datetime, period: Optional[str] = None) -> datetime:
+    period = period or EVENT_PARTITION_PERIOD
+    if period == "day":
+        return start + timedelta(days=1)
+    return (start.replace(day=28) + timedelta(days=4)).replace(day=1)
+
+
+def partition_path(start: datetime, period: Optional[str] = None) -> str:
+    period = period or EVENT_PARTITION_PERIOD
+    suffix = f"{start:%Y%m%d}" if period == "day" else f"{start:%Y%m}"
+    return os.path.join(PARTITION_DIR, f"events_{suffix}.db")
+
+
+def list_partitions() -> List[Tuple[datetime, datetime, str]]:
+    """(start, end, path) of every partition file, newest first
+
+    The period of each file comes from its name, so files created before a
+    change of EVENT_PARTITION_PERIOD keep working. Periods are in UTC.
+    """
+    if not os.path.isdir(PARTITION_DIR):
+        return []
+    partitions = []
+    for name in os.listdir(PARTITION_DIR):
+        match = PARTITION_FILE_RE.match(name)
+        if not match:
+            continue
+        suffix = match.group(1)
+        period = "day" if len(suffix) == 8 else "month"
+        start = datetime.strptime(suffix, "%Y%m%d" if period == "day" else "%Y%m")
+        partitions.append((start, next_period(start, period), os.path.join(PARTITION_DIR, name)))
+    return sorted(partitions, reverse=True)
+
+
+def partitions_between(since: Optional[int] = None, until: Optional[int] = None) -> List[str]:
+    """Paths of the partitions overlapping [since, until) in epoch nanoseconds, newest first"""
+    return [
+        path for start, end, path in list_partitions()
+        if (since is None or utc_to_ns(end) > since) and (until is None or utc_to_ns(start) < until)
+    ]
+
+
+def attach_uri(path: str) -> str:
+    """URI for ATTACH that fails instead of creating an empty file if the partition was dropped"""
+    return "file:" + pathname2url(path) + "?mode=rw"
+
+
+def retention_cutoff(now: Optional[datetime] = None) -> Optional[datetime]:
+    """Events older than this (naive UTC) are expired, None when retention is disabled"""
+    if EVENT_RETENTION_DAYS <= 0:
+        return None
+    return (now or datetime.utcnow()) - timedelta(days=EVENT_RETENTION_DAYS)
+
+
+def create_fts_index(cursor: sqlite3.Cursor, table: str, columns: List[str]) -> bool:
+    """Create a FTS5 trigram index over table columns, kept in sync by triggers
+    
+    The index is named {table}_fts and uses the table's rowid.
+    
+    Args:
+        cursor: Cursor on the database holding the table
+        table: Table to index
+        columns: Text columns to index
+    
+    Returns:
+        True if the index exists, False if FTS5 trigrams are unavailable
+    """
+    fts = f"{table}_fts"
+    cursor.execute("SELECT 1 FROM sqlite_master WHERE name = ?", (fts,))
+    if cursor.fetchone() is not None:
+        return True
+    names = ", ".join(columns)
+    new_values = ", ".join(f"new.{c}" for c in columns)
+    old_values = ", ".join(f"old.{c}" for c in columns)
+    try:
+        cursor.execute(f"""
+            CREATE VIRTUAL TABLE {fts} USING fts5(
+                {names}, content='{table}', content_rowid='rowid', tokenize='trigram'
+            )
+        """)
+    except sqlite3.OperationalError as e:
+        print(f"[DB] FTS5 trigram index unavailable, free-text search on {table} will scan it: {e}")
+        return False
+    
+    cursor.execute(f"""
+        CREATE TRIGGER IF NOT EXISTS {fts}_insert AFTER INSERT ON {table} BEGIN
+            INSERT INTO {fts}(rowid, {names}) VALUES (new.rowid, {new_values});
+        END
+    """)
+    cursor.execute(f"""
+        CREATE TRIGGER IF NOT EXISTS {fts}_delete AFTER DELETE ON {table} BEGIN
+            INSERT INTO {fts}({fts}, rowid, {names}) VALUES ('delete', old.rowid, {old_values});
+        END
+    """)
+    cursor.execute(f"""
+        CREATE TRIGGER IF NOT EXISTS {fts}_update AFTER UPDATE OF {names} ON {table} BEGIN
+            INSERT INTO {fts}({fts}, rowid, {names}) VALUES ('delete', old.rowid, {old_values});
+            INSERT INTO {fts}(rowid, {names}) VALUES (new.rowid, {new_values});
+        END
+    """)
+    # Rows written before the index existed
+    cursor.execute(f"INSERT INTO {fts}({fts}) VALUES ('rebuild')")
+    return True
+
+
+def drop_fts_index(cursor: sqlite3.Cursor, table: str, schema: str = "main") -> None:
+    """Drop the FTS index of a table and its triggers"""
+    fts = f"{table}_fts"
+    for trigger in (f"{fts}_insert", f"{fts}_delete", f"{fts}_update"):
+        cursor.execute(f"DROP TRIGGER IF EXISTS {schema}.{trigger}")
+    cursor.execute(f"DROP TABLE IF EXISTS {schema}.{fts}")
+
+
+def create_partition(path: str) -> None:
+    """Create a partition file with the events schema, indexes and FTS index"""
+    conn = sqlite3.connect(path)
+    cursor = conn.cursor()
+    # Persistent in the file, so readers of an attached partition never block its writer
+    cursor.execute("PRAGMA journal_mode = WAL")
+    for statement in EVENTS_SCHEMA:
+        cursor.execute(statement)
+    # Paths, endpoints and hosts are searched in their dimension tables
+    create_fts_index(cursor, "events", ["username"])
+    conn.commit()
+    conn.close()
+
+
+def apply_retention(now: Optional[datetime] = None) -> None:
+    """Drop (or move to ARCHIVE_DIR) partition files entirely older than EVENT_RETENTION_DAYS"""
+    cutoff = retention_cutoff(now)
+    if cutoff is None:
+        return
+    for _, end, path in list_partitions():
+        if end > cutoff:
+            continue
+        name = os.path.basename(path)
+        try:
+            if EVENT_RETENTION_MODE == "detach":
+                os.makedirs(ARCHIVE_DIR, exist_ok=True)
+                os.replace(path, os.path.join(ARCHIVE_DIR, name))
+                print(f"[DB] Archived event partition {name}")
+            else:
+                os.remove(path)
+                print(f"[DB] Dropped event partition {name}")
+        except OSError as e:
+            # Still open elsewhere (e.g. on Windows); retried on the next run
+            print(f"[DB] Retention postponed for {name}: {e}")
+            continue
+        for key in [k for k, v in _ready_partitions.items() if v == path]:
+            del _ready_partitions[key]
+        for leftover in (path + "-journal", path + "-wal", path + "-shm"):
+            if os.path.exists(leftover):
+                os.remove(leftover)
+
+
+def partition_for(timestamp: int) -> str:
+    """Path of the partition holding an event timestamp, created if needed
+
+    Args:
+        timestamp: Event timestamp in epoch nanoseconds
+
+    Returns:
+        Path of the partition database file
+    """
+    ts = from_ns(timestamp)
+    key = partition_path(period_start(ts))
+    if key in _ready_partitions:
+        return _ready_partitions[key]
+
+    with _partition_lock:
+        path = key
+        covering = [p for start, end, p in list_partitions() if start <= ts < end]
+        if covering:
+            path = covering[0]
+        else:
+            # A new period is a good moment to expire old ones
+            apply_retention()
+            os.makedirs(PARTITION_DIR, exist_ok=True)
+            create_partition(path)
+            print(f"[DB] Created event partition {os.path.basename(path)}")
+        _ready_partitions[key] = path
+    return path
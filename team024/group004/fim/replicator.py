@@ -0,0 +1,94 @@
+"""Outbox replication of SQLite events to MongoDB
+
+Events are committed to SQLite first. A background worker copies them to
+MongoDB in batches behind a watermark (the id of the last event stored
+there), so the watcher never waits on the network and batches that fail
+are sent again later. Document ids combine the agent and the local event
+id, which makes resending harmless.
+"""
+import threading
+from typing import Any, Dict, Optional
+
+from .config import AGENT_ID, MONGO_BATCH_SIZE, MONGO_SYNC_INTERVAL, MONGO_RETRY_MAX_SECONDS
+from .models import get_events_after, get_mongo_watermark, set_mongo_watermark
+from .mongo_client import send_events_to_mongo
+from .timestamps import format_ns
+
+
+def mongo_document(event: Dict[str, Any]) -> Dict[str, Any]:
+    """MongoDB document of an event row from get_events_after"""
+    return {
+        "_id": f"{AGENT_ID}:{event['id']}",
+        "event_id": event["id"],
+        "agent_id": AGENT_ID,
+        "timestamp": format_ns(event["timestamp"]),
+        "event_type": event["event_type"],
+        "path": event["file_path"],
+        "state_hash": event["state_hash"],
+        "content_hash": event["content_hash"] or event["hash_after"],
+        "hash_before": event["hash_before"],
+        "hash_after": event["hash_after"],
+        "endpoint": event["endpoint"],
+        "hostname": event["hostname"],
+        "username": event["username"],
+    }
+
+
+class MongoReplicator:
+    """Background worker draining events above the watermark into MongoDB"""
+    
+    def __init__(self, batch_size: int = MONGO_BATCH_SIZE, interval: float = MONGO_SYNC_INTERVAL):
+        self.batch_size = batch_size
+        self.interval = interval
+        self.failures = 0
+        self._stopping = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+    
+    def sync_once(self) -> Optional[int]:
+        """Send the next batch of events and advance the watermark
+        
+        Returns:
+            Number of events replicated, or None if MongoDB did not take the batch
+        """
+        events = get_events_after(get_mongo_watermark(), self.batch_size)
+        if not events:
+            return 0
+        if not send_events_to_mongo([mongo_document(event) for event in events]):
+            return None
+        set_mongo_watermark(events[-1]["id"])
+        return len(events)
+    
+    def _next_delay(self, sent: Optional[int]) -> float:
+        """Seconds to wait: none while a backlog remains, exponential backoff after failures"""
+        if sent is None:
+            self.failures += 1
+            return min(MONGO_RETRY_MAX_SECONDS, self.interval * 2 ** self.failures)
+        self.failures = 0
+        return 0 if sent == self.batch_size else self.interval
+    
+    def _run(self) -> None:
+        while not self._stopping.is_set():
+            try:
+                sent = self.sync_once()
+            except Exception as e:
+                print(f"[MONGO] Replication error: {e}")
+                sent = None
+            self._stopping.wait(self._next_delay(sent))
+    
+    def start(self) -> None:
+        """Start replicating in a background thread"""
+        if self._thread is not None:
+            return
+        self._stopping.clear()
+        self._thread = threading.Thread(target=self._run, name="mongo-replicator", daemon=True)
+        self._thread.start()
+        print("[MONGO] Replicator started")
+    
+    def stop(self) -> None:
+        """Stop the background thread after its current batch"""
+        if self._thread is None:
+            return
+        self._stopping.set()
+        self._thread.join()
+        self._thread = None
+        print("[MONGO] Replicator stopped")
@@ -0,0 +1,105 @@
+"""Structured dashboard search: ``type:modified host:web-1 path:/etc/* since:2h hash:ab12 free text``
+
+Field terms become index-backed predicates; anything else is free text.
+Values can be quoted (``path:"/srv/my files/*"``) and type/host/endpoint
+take comma-separated alternatives.
+
+A separate copy of the root app's search.py, since this app is deployed on
+its own; keep the two in step.
+"""
+import re
+from datetime import datetime, timedelta
+from typing import List, Optional, Tuple
+
+TOKEN_RE = re.compile(r'(?:([a-z]+):)?(?:"([^"]*)"|(\S+))')
+RELATIVE_TIME_RE = re.compile(r"^(\d+)([smhdw])$")
+HEX_RE = re.compile(r"^[0-9a-f]+$")
+TIME_UNITS = {"s": "seconds", "m": "minutes", "h": "hours", "d": "days", "w": "weeks"}
+MIN_HASH_PREFIX = 4
+SEARCH_FIELDS = ("type", "host", "endpoint", "path", "since", "until", "hash")
+
+
+class SearchQuery:
+    """A parsed search. Values within a field are ORed, fields and free-text terms are ANDed."""
+
+    def __init__(self):
+        self.types: List[str] = []
+        self.hosts: List[str] = []
+        self.endpoints: List[str] = []
+        self.paths: List[str] = []
+        self.hash_prefixes: List[str] = []
+        self.since: Optional[datetime] = None
+        self.until: Optional[datetime] = None
+        self.terms: List[str] = []
+
+    def __bool__(self) -> bool:
+        return bool(self.types or self.hosts or self.endpoints or self.paths or self.hash_prefixes
+                    or self.since or self.until or self.terms)
+
+
+def parse_time(value: str, now: datetime) -> datetime:
+    """Relative age (30m, 2h, 7d, 1w) or absolute ISO-8601 date/time"""
+    match = RELATIVE_TIME_RE.match(value)
+    if match:
+        try:
+            return now - timedelta(**{TIME_UNITS[match.group(2)]: int(match.group(1))})
+        except OverflowError as e:
+            raise ValueError(f"Invalid time '{value}' (too far in the past)") from e
+    try:
+        return datetime.fromisoformat(value)
+    except ValueError as e:
+        raise ValueError(f"Invalid time '{value}' (use e.g. 2h, 7d or 2025-01-31)") from e
+
+
+def split_glob(pattern: str) -> Tuple[str, Optional[str]]:
+    """Literal prefix of a path glob, and the glob itself if more than a trailing * is needed.
+
+    ``/etc/passwd`` -> (``/etc/passwd``, None) with no wildcard at all, use equality
+    ``/etc/*`` -> (``/etc/``, ``/etc/*``) a pure prefix
+    ``/etc/*.conf`` -> (``/etc/``, ``/etc/*.conf``) prefix range plus a glob check
+    """
+    positions = [i for i in (pattern.find("*"), pattern.find("?")) if i >= 0]
+    if not positions:
+        return pattern, None
+    return pattern[:min(positions)], pattern
+
+
+def is_prefix_glob(pattern: str) -> bool:
+    prefix, glob = split_glob(pattern)
+    return glob is not None and glob == prefix + "*"
+
+
+def parse_search(text: str, now: datetime = None) -> SearchQuery:
+    """Parse the search box; raises ValueError for malformed field values"""
+    now = now or datetime.utcnow()
+    query = SearchQuery()
+    for match in TOKEN_RE.finditer(text or ""):
+        field, quoted, bare = match.groups()
+        value = quoted if quoted is not None else bare
+        if field not in SEARCH_FIELDS:
+            # Unknown prefixes such as C: in a Windows path are plain text
+            term = f"{field}:{value}" if field else value
+            if term:
+                query.terms.append(term)
+            continue
+        if not value:
+            continue
+
+        if field == "type":
+            query.types.extend(v for v in value.lower().split(",") if v)
+        elif field == "host":
+            query.hosts.extend(v for v in value.split(",") if v)
+        elif field == "endpoint":
+            query.endpoints.extend(v for v in value.split(",") if v)
+        elif field == "path":
+            query.paths.append(value)
+        elif field == "since":
+            query.since = parse_time(value, now)
+        elif field == "until":
+            query.until = parse_time(value, now)
+        elif field == "hash":
+            value = value.lower()
+            if not HEX_RE.match(value) or len(value) < MIN_HASH_PREFIX:
+                raise ValueError(f"hash: needs at least {MIN_HASH_PREFIX} hex digits")
+            query.hash_prefixes.append(value)
+    return query
@@ -0,0 +1,58 @@
+"""Event timestamps - integer nanoseconds since the Unix epoch, UTC
+
+Events, file_state and hash_baseline store their times as these integers, so
+events order exactly (ties broken by id) and time ranges are integer range
+scans. Partition periods are UTC; the dashboard and API show local time.
+"""
+import time
+from datetime import datetime, timedelta, timezone
+from typing import Optional, Tuple
+
+NS_PER_SECOND = 1_000_000_000
+# Text timestamps of older versions (local time) and rollup buckets
+TIMESTAMP_FORMAT = "%Y-%m-%d %H:%M:%S"
+# SQL converting a local-time TIMESTAMP_FORMAT column of an older version to epoch nanoseconds
+TEXT_TO_NS_SQL = "CAST(strftime('%s', {}, 'utc') AS INTEGER) * 1000000000"
+
+EPOCH = datetime(1970, 1, 1)
+
+
+def now_ns() -> int:
+    """Current time in epoch nanoseconds"""
+    return time.time_ns()
+
+
+def to_ns(value: datetime) -> int:
+    """Epoch nanoseconds of a datetime; naive values are local time, as typed in the search box"""
+    seconds = int(value.replace(microsecond=0).timestamp())
+    return seconds * NS_PER_SECOND + value.microsecond * 1000
+
+
+def time_range(since: Optional[datetime] = None,
+               until: Optional[datetime] = None) -> Tuple[Optional[int], Optional[int]]:
+    """[since, until) as epoch nanoseconds, None for an open end"""
+    return (to_ns(since) if since else None, to_ns(until) if until else None)
+
+
+def utc_to_ns(value: datetime) -> int:
+    """Epoch nanoseconds of a naive UTC datetime, such as a partition period start"""
+    return to_ns(value.replace(tzinfo=timezone.utc))
+
+
+def from_ns(value: int) -> datetime:
+    """Naive UTC datetime of epoch nanoseconds"""
+    return EPOCH + timedelta(microseconds=value // 1000)
+
+
+def local_datetime(value: int) -> datetime:
+    """Naive local datetime of epoch nanoseconds"""
+    return datetime.fromtimestamp(value // NS_PER_SECOND) + timedelta(
+        microseconds=value % NS_PER_SECOND // 1000
+    )
+
+
+def format_ns(value: Optional[int]) -> Optional[str]:
+    """Local time with milliseconds for display, e.g. "2025-01-31 14:05:09.120" """
+    if value is None:
+        return None
+    return local_datetime(value).strftime(TIMESTAMP_FORMAT + ".%f")[:-3]
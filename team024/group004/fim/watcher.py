@@ -1,7 +1,6 @@
 """Directory watcher agent using watchdog"""
 import os
 import time
-from datetime import datetime
 import socket
 import getpass
 from watchdog.observers import Observer
@@ -9,6 +8,7 @@ from watchdog.events import FileSystemEventHandler
 
 from .config import WATCH_DIRECTORY, ENDPOINT_NAME
 from .hashing import compute_hash
+from .timestamps import now_ns, format_ns
 from .models import insert_event, get_latest_hash
 from .alerts import print_alert
 
@@ -47,7 +47,7 @@ class FIMEventHandler(FileSystemEventHandler):
             return
         
         file_path = os.path.abspath(src_path)
-        timestamp = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+        timestamp = now_ns()
         
         hash_before = None
         hash_after = None
@@ -88,7 +88,7 @@ class FIMEventHandler(FileSystemEventHandler):
             endpoint=self.endpoint,
             hostname=self.hostname,
             username=self.username,
-            timestamp=timestamp
+            timestamp=format_ns(timestamp)
         )
     
     def on_created(self, event):
@@ -1,332 +1,743 @@
-import hashlib
-import json
-import os
-import socket
-import time
-
-from pymongo import MongoClient
-from watchdog.observers import Observer
-from watchdog.events import FileSystemEventHandler
-
-# ============================
-# Config & Mongo setup
-# ============================
-
-CONFIG_PATH = r"config.json"  # <-- change if needed
-
-
-def load_config(path: str = CONFIG_PATH) -> dict:
-    if not os.path.exists(path):
-        raise FileNotFoundError(f"Config file not found: {path}")
-    with open(path, "r") as f:
-        cfg = json.load(f)
-
-    if "mongo_uri" not in cfg:
-        raise ValueError("Config is missing 'mongo_uri'")
-
-    return cfg
-
-
-config = load_config()
-
-MONGO_URI = config["mongo_uri"]
-DB_NAME = config.get("db_name", "fim")
-COLLECTION_NAME = config.get("collection_name", "events")
-AGENT_ID = config.get("agent_id", socket.gethostname())
-WATCH_DIR = config.get("watch_dir", r"C:\Users\Public")
-
-mongo_client = MongoClient(MONGO_URI)
-mongo_collection = mongo_client[DB_NAME][COLLECTION_NAME]
-
-# ============================
-# Local DB files (JSON)
-# ============================
-
-BASE_DIR = os.path.dirname(os.path.abspath(__file__))
-HASH_DB_FILE = os.path.join(BASE_DIR, "hashes.json")
-HISTORY_DB_FILE = os.path.join(BASE_DIR, "hash_history.json")
-
-
-def load_json(path: str):
-    if not os.path.exists(path):
-        return {}
-    try:
-        with open(path, "r") as f:
-            return json.load(f)
-    except json.JSONDecodeError:
-        return {}
-
-
-def save_json(obj: dict, path: str):
-    with open(path, "w") as f:
-        json.dump(obj, f, indent=4)
-
-
-# ============================
-# Helpers: ignore temp files
-# ============================
-
-def is_temp_file(path: str) -> bool:
-    """Return True if the file should be ignored (e.g., editor temp files)."""
-    filename = os.path.basename(path)
-    # Only rule requested: skip files ending with "~"
-    return filename.endswith("~")
-
-
-# ============================
-# Metadata & hashing (Windows)
-# ============================
-
-def get_file_metadata(path: str) -> dict:
-    s = os.stat(path, follow_symlinks=False)
-    return {
-        "size": s.st_size,
-        "mtime": int(s.st_mtime),   # last modification time
-        "ctime": int(s.st_ctime),   # creation time on Windows
-        "readonly": not os.access(path, os.W_OK),
-    }
-
-
-def hash_content(path: str) -> str:
-    h = hashlib.sha256()
-    with open(path, "rb") as f:
-        for chunk in iter(lambda: f.read(8192), b""):
-            h.update(chunk)
-    return h.hexdigest()
-
-
-def hash_state(path: str) -> dict:
-    meta = get_file_metadata(path)
-    content_hash = hash_content(path)
-
-    state_obj = {
-        "path": os.path.abspath(path),
-        "content_hash": content_hash,
-        "metadata": meta,
-    }
-
-    # Stable encoding for state_hash
-    state_bytes = json.dumps(state_obj, sort_keys=True,
-                             separators=(",", ":")).encode()
-    state_hash = hashlib.sha256(state_bytes).hexdigest()
-
-    return {
-        "path": state_obj["path"],
-        "content_hash": content_hash,
-        "metadata": meta,
-        "state_hash": state_hash,
-    }
-
-
-# ============================
-# History helpers
-# ============================
-
-def append_history_entry(state: dict, history_db: dict, timestamp: int):
-    """
-    Append a state entry to history, but only if the state_hash differs from
-    the last recorded one (no duplicate NO_CHANGE entries).
-    """
-    path = state["path"]
-    new_hash = state["state_hash"]
-
-    entry = {
-        "timestamp": timestamp,
-        "state_hash": new_hash,
-        "content_hash": state["content_hash"],
-        "metadata": state["metadata"],
-    }
-
-    if path not in history_db:
-        history_db[path] = [entry]
-        return
-
-    last_entry = history_db[path][-1]
-    last_hash = last_entry.get("state_hash")
-
-    if last_hash == new_hash:
-        # No change in state since last history entry
-        return
-
-    history_db[path].append(entry)
-
-
-def append_deletion_history(path: str, history_db: dict, timestamp: int):
-    """
-    Append a DELETED event to history, but avoid repeated DELETED entries.
-    """
-    if path not in history_db:
-        history_db[path] = []
-
-    if history_db[path] and history_db[path][-1].get("event") == "DELETED":
-        return
-
-    deletion_entry = {
-        "timestamp": timestamp,
-        "state_hash": None,
-        "content_hash": None,
-        "metadata": None,
-        "event": "DELETED",
-    }
-    history_db[path].append(deletion_entry)
-
-
-# ============================
-# Mongo event sender
-# ============================
-
-def send_event_to_mongo(event: dict):
-    """
-    Insert a single FIM event document into MongoDB.
-    """
-    try:
-        mongo_collection.insert_one(event)
-    except Exception as e:
-        # Don't kill the agent if MongoDB is down
-        print(f"[!] Failed to send event to MongoDB: {e}")
-
-
-# ============================
-# File system event handler
-# ============================
-
-class FIMEventHandler(FileSystemEventHandler):
-    def __init__(self, root_dir: str):
-        super().__init__()
-        self.root_dir = os.path.abspath(root_dir)
-
-    def _handle_file_change(self, path: str, event_type: str):
-        # Ignore directories explicitly
-        if os.path.isdir(path):
-            return
-
-        abs_path = os.path.abspath(path)
-        now_ts = int(time.time())
-
-        # Load DBs
-        db = load_json(HASH_DB_FILE)
-        history_db = load_json(HISTORY_DB_FILE)
-
-        # Handle deletion
-        if event_type == "DELETED":
-            print(f"[DELETED] {abs_path}")
-
-            # 1. Add to history (single DELETED)
-            append_deletion_history(abs_path, history_db, now_ts)
-
-            # 2. Remove from current snapshot DB
-            if abs_path in db:
-                del db[abs_path]
-
-            # 3. Send deletion event to Mongo
-            event_doc = {
-                "timestamp": now_ts,
-                "event_type": "DELETED",
-                "path": abs_path,
-                "state_hash": None,
-                "content_hash": None,
-                "metadata": None,
-                "agent_id": AGENT_ID,
-            }
-            send_event_to_mongo(event_doc)
-
-            # 4. Persist local DBs
-            save_json(db, HASH_DB_FILE)
-            save_json(history_db, HISTORY_DB_FILE)
-            return
-
-        # For CREATED / MODIFIED / MOVED target:
-        if not os.path.exists(abs_path):
-            # race condition: event fired but file already gone
-            return
-
-        # Calculate current state
-        try:
-            current_state = hash_state(abs_path)
-        except (PermissionError, FileNotFoundError):
-            # Can't read file for some reason
-            return
-
-        old_state = db.get(abs_path)
-
-        if old_state is None:
-            # never seen before
-            status = "CREATED"
-        else:
-            # if state_hash is the same, ignore the event (NO_CHANGE)
-            if current_state["state_hash"] == old_state.get("state_hash"):
-                return
-            status = "MODIFIED"
-
-        # Update snapshot & history
-        db[abs_path] = current_state
-        append_history_entry(current_state, history_db, now_ts)
-
-        # Build and send Mongo event
-        event_doc = {
-            "timestamp": now_ts,
-            "event_type": status,  # CREATED or MODIFIED
-            "path": abs_path,
-            "state_hash": current_state["state_hash"],
-            "content_hash": current_state["content_hash"],
-            "metadata": current_state["metadata"],
-            "agent_id": AGENT_ID,
-        }
-        # send_event_to_mongo(event_doc)
-
-        # Save local DBs
-        save_json(db, HASH_DB_FILE)
-        save_json(history_db, HISTORY_DB_FILE)
-
-        print(f"[{status}] {abs_path}")
-
-    # Watchdog callbacks
-
-    def on_created(self, event):
-        if not event.is_directory and not is_temp_file(event.src_path):
-            self._handle_file_change(event.src_path, "CREATED")
-
-    def on_modified(self, event):
-        if not event.is_directory and not is_temp_file(event.src_path):
-            self._handle_file_change(event.src_path, "MODIFIED")
-
-    def on_deleted(self, event):
-        if not event.is_directory and not is_temp_file(event.src_path):
-            self._handle_file_change(event.src_path, "DELETED")
-
-    def on_moved(self, event):
-        if not event.is_directory:
-            # source deletion
-            if not is_temp_file(event.src_path):
-                self._handle_file_change(event.src_path, "DELETED")
-            # destination creation
-            if not is_temp_file(event.dest_path):
-                self._handle_file_change(event.dest_path, "CREATED")
-
-
-# ============================
-# Agent runner
-# ============================
-
-def run_agent(watch_dir: str, recursive: bool = True):
-    watch_dir = os.path.abspath(watch_dir)
-    print(f"[*] Starting FIM agent on: {watch_dir}")
-    print(f"[*] Agent ID: {AGENT_ID}")
-    print("[*] Press Ctrl+C to stop.\n")
-
-    event_handler = FIMEventHandler(watch_dir)
-    observer = Observer()
-    observer.schedule(event_handler, watch_dir, recursive=recursive)
-    observer.start()
-
-    try:
-        while True:
-            time.sleep(1)
-    except KeyboardInterrupt:
-        print("\n[*] Stopping observer...")
-        observer.stop()
-    observer.join()
-
-
-if __name__ == "__main__":
-    run_agent(WATCH_DIR, recursive=True)
+import hashlib
+import itertools
+import json
+import os
+import socket
+import sqlite3
+import time
+
+from pymongo import MongoClient
+from watchdog.observers import Observer
+from watchdog.events import FileSystemEventHandler
+
+try:
+    import zstandard
+except ImportError:  # optional: history chunks are then stored uncompressed
+    zstandard = None
+
+# ============================
+# Config & Mongo setup
+# ============================
+
+CONFIG_PATH = r"config.json"  # <-- change if needed
+
+
+def load_config(path: str = CONFIG_PATH) -> dict:
+    if not os.path.exists(path):
+        raise FileNotFoundError(f"Config file not found: {path}")
+    with open(path, "r") as f:
+        cfg = json.load(f)
+
+    if "mongo_uri" not in cfg:
+        raise ValueError("Config is missing 'mongo_uri'")
+
+    return cfg
+
+
+config = load_config()
+
+MONGO_URI = config["mongo_uri"]
+DB_NAME = config.get("db_name", "fim")
+COLLECTION_NAME = config.get("collection_name", "events")
+AGENT_ID = config.get("agent_id", socket.gethostname())
+WATCH_DIR = config.get("watch_dir", r"C:\Users\Public")
+# History entries per chunk; full chunks are sealed and zstd-compressed
+HISTORY_CHUNK_ENTRIES = config.get("history_chunk_entries", 256)
+HISTORY_COMPRESSION = config.get("history_compression", True)
+
+mongo_client = MongoClient(MONGO_URI)
+mongo_collection = mongo_client[DB_NAME][COLLECTION_NAME]
+
+# ============================
+# Local DB (SQLite)
+# ============================
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+DB_FILE = os.path.join(BASE_DIR, "fim_agent.db")
+# JSON files of older versions, imported into DB_FILE on first start
+HASH_DB_FILE = os.path.join(BASE_DIR, "hashes.json")
+HISTORY_DB_FILE = os.path.join(BASE_DIR, "hash_history.json")
+
+_db = None
+
+
+def get_db() -> sqlite3.Connection:
+    """
+    Open the local DB on first use. Each event reads and writes only the rows
+    of its own path, in one transaction, so the cost of an event does not
+    grow with the number of tracked files and a crash never leaves a
+    half-written file behind.
+    """
+    global _db
+    if _db is None:
+        conn = sqlite3.connect(DB_FILE, check_same_thread=False)
+        conn.execute("PRAGMA journal_mode = WAL")
+        conn.execute("PRAGMA synchronous = NORMAL")
+        conn.executescript("""
+            CREATE TABLE IF NOT EXISTS hashes (
+                path TEXT PRIMARY KEY,
+                state_hash TEXT NOT NULL,
+                content_hash TEXT NOT NULL,
+                metadata TEXT NOT NULL
+            );
+            CREATE TABLE IF NOT EXISTS history_chunks (
+                path TEXT NOT NULL,
+                chunk_no INTEGER NOT NULL,
+                first_ts INTEGER NOT NULL,
+                entries INTEGER NOT NULL,
+                codec INTEGER NOT NULL,
+                data BLOB NOT NULL,
+                PRIMARY KEY (path, chunk_no)
+            ) WITHOUT ROWID;
+        """)
+        convert_history_table(conn)
+        import_json_db(conn)
+        _db = conn
+    return _db
+
+
+def load_json(path: str):
+    if not os.path.exists(path):
+        return {}
+    try:
+        with open(path, "r") as f:
+            return json.load(f)
+    except json.JSONDecodeError:
+        return {}
+
+
+def import_json_db(conn: sqlite3.Connection):
+    """
+    One-time import of hashes.json and hash_history.json from older versions.
+    The files are renamed to *.migrated afterwards.
+    """
+    if not os.path.exists(HASH_DB_FILE) and not os.path.exists(HISTORY_DB_FILE):
+        return
+
+    db = load_json(HASH_DB_FILE)
+    history_db = load_json(HISTORY_DB_FILE)
+    with conn:
+        conn.executemany(
+            "INSERT OR REPLACE INTO hashes (path, state_hash, content_hash, metadata) VALUES (?, ?, ?, ?)",
+            [(path, state["state_hash"], state["content_hash"], json.dumps(state["metadata"]))
+             for path, state in db.items()],
+        )
+        for path, entries in history_db.items():
+            if entries:
+                write_history(conn, path, load_history_tail(conn, path), entries)
+
+    for path in (HASH_DB_FILE, HISTORY_DB_FILE):
+        if os.path.exists(path):
+            os.replace(path, path + ".migrated")
+    print(f"[*] Imported {len(db)} tracked files and their history from JSON")
+
+
+def convert_history_table(conn: sqlite3.Connection):
+    """
+    One-time conversion of the row-per-entry hash_history table of older
+    versions into history chunks.
+    """
+    exists = conn.execute(
+        "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'hash_history'"
+    ).fetchone()
+    if not exists:
+        return
+
+    rows = conn.execute(
+        "SELECT path, timestamp, event, state_hash, content_hash, metadata "
+        "FROM hash_history ORDER BY path, id"
+    )
+    with conn:
+        for path, group in itertools.groupby(rows.fetchall(), key=lambda row: row[0]):
+            entries = []
+            for _, timestamp, event, state_hash, content_hash, metadata in group:
+                entry = {
+                    "timestamp": timestamp,
+                    "state_hash": state_hash,
+                    "content_hash": content_hash,
+                    "metadata": json.loads(metadata) if metadata else None,
+                }
+                if event:
+                    entry["event"] = event
+                entries.append(entry)
+            write_history(conn, path, load_history_tail(conn, path), entries)
+        conn.execute("DROP TABLE hash_history")
+    print("[*] Converted hash history to chunks")
+
+
+def get_state(conn: sqlite3.Connection, path: str):
+    """Return the last known state of a path, or None if it is not tracked."""
+    row = conn.execute(
+        "SELECT state_hash, content_hash, metadata FROM hashes WHERE path = ?", (path,)
+    ).fetchone()
+    if row is None:
+        return None
+    return {
+        "path": path,
+        "state_hash": row[0],
+        "content_hash": row[1],
+        "metadata": json.loads(row[2]),
+    }
+
+
+def save_state(conn: sqlite3.Connection, state: dict):
+    conn.execute(
+        "INSERT OR REPLACE INTO hashes (path, state_hash, content_hash, metadata) VALUES (?, ?, ?, ?)",
+        (state["path"], state["state_hash"], state["content_hash"], json.dumps(state["metadata"])),
+    )
+
+
+def delete_state(conn: sqlite3.Connection, path: str):
+    conn.execute("DELETE FROM hashes WHERE path = ?", (path,))
+
+
+# ============================
+# Helpers: ignore temp files
+# ============================
+
+def is_temp_file(path: str) -> bool:
+    """Return True if the file should be ignored (e.g., editor temp files)."""
+    filename = os.path.basename(path)
+    # Only rule requested: skip files ending with "~"
+    return filename.endswith("~")
+
+
+# ============================
+# Metadata & hashing (Windows)
+# ============================
+
+def get_file_metadata(path: str) -> dict:
+    s = os.stat(path, follow_symlinks=False)
+    return {
+        "size": s.st_size,
+        "mtime": int(s.st_mtime),   # last modification time
+        "ctime": int(s.st_ctime),   # creation time on Windows
+        "readonly": not os.access(path, os.W_OK),
+    }
+
+
+def hash_content(path: str) -> str:
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(8192), b""):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+def hash_state(path: str) -> dict:
+    meta = get_file_metadata(path)
+    content_hash = hash_content(path)
+
+    state_obj = {
+        "path": os.path.abspath(path),
+        "content_hash": content_hash,
+        "metadata": meta,
+    }
+
+    # Stable encoding for state_hash
+    state_bytes = json.dumps(state_obj, sort_keys=True,
+                             separators=(",", ":")).encode()
+    state_hash = hashlib.sha256(state_bytes).hexdigest()
+
+    return {
+        "path": state_obj["path"],
+        "content_hash": content_hash,
+        "metadata": meta,
+        "state_hash": state_hash,
+    }
+
+
+# ============================
+# History helpers
+# ============================
+
+# History of a path is stored as chunks of up to HISTORY_CHUNK_ENTRIES
+# entries. Inside a chunk each entry is encoded against the previous one:
+#
+#   flags        1 byte (FLAG_*)
+#   timestamp    zigzag varint, delta to the previous entry (to first_ts
+#                for the first entry of the chunk)
+#   state_hash   32 bytes
+#   content_hash 32 bytes, left out with FLAG_SAME_CONTENT
+#   size, mtime, ctime
+#                zigzag varint deltas, each only if its FLAG_* bit is set
+#
+# DELETED entries are the flags and the timestamp only. Entries that do not
+# fit this form (hashes that are not SHA-256 hex, other metadata keys, e.g.
+# imported from older versions) are stored as FLAG_RAW: a varint length and
+# the entry as JSON. The first encoded entry of a chunk has no previous
+# entry, so every chunk decodes on its own.
+#
+# The newest chunk of a path stays open (CODEC_OPEN) and entries are
+# appended to it. Full chunks are sealed and compressed with zstd if the
+# zstandard package is installed.
+
+FLAG_DELETED = 0x01
+FLAG_RAW = 0x02
+FLAG_SAME_CONTENT = 0x04
+FLAG_SIZE = 0x08
+FLAG_MTIME = 0x10
+FLAG_CTIME = 0x20
+FLAG_READONLY = 0x40
+
+DELTA_FIELDS = ((FLAG_SIZE, "size"), (FLAG_MTIME, "mtime"), (FLAG_CTIME, "ctime"))
+METADATA_KEYS = {"size", "mtime", "ctime", "readonly"}
+
+CODEC_OPEN = 0
+CODEC_PLAIN = 1
+CODEC_ZSTD = 2
+
+
+def write_varint(buf: bytearray, value: int):
+    """Append a signed integer as a zigzag LEB128 varint."""
+    value = value << 1 if value >= 0 else (-value << 1) - 1
+    while value >= 0x80:
+        buf.append((value & 0x7F) | 0x80)
+        value >>= 7
+    buf.append(value)
+
+
+def read_varint(data: bytes, pos: int):
+    """Read a varint written by write_varint; returns (value, next position)."""
+    value = 0
+    shift = 0
+    while True:
+        byte = data[pos]
+        pos += 1
+        value |= (byte & 0x7F) << shift
+        if byte < 0x80:
+            break
+        shift += 7
+    return (value >> 1) ^ -(value & 1), pos
+
+
+def is_sha256_hex(value) -> bool:
+    if not isinstance(value, str) or len(value) != 64:
+        return False
+    try:
+        bytes.fromhex(value)
+    except ValueError:
+        return False
+    return True
+
+
+def is_compact(entry: dict) -> bool:
+    """Return True if the entry fits the binary encoding (see above)."""
+    metadata = entry.get("metadata")
+    return (
+        is_sha256_hex(entry.get("state_hash"))
+        and is_sha256_hex(entry.get("content_hash"))
+        and isinstance(metadata, dict)
+        and set(metadata) == METADATA_KEYS
+        and all(isinstance(metadata[key], int) for _, key in DELTA_FIELDS)
+        and isinstance(metadata["readonly"], bool)
+    )
+
+
+def encode_entry(buf: bytearray, entry: dict, prev_ts: int, prev):
+    """
+    Append one history entry to a chunk. prev is the last compact entry
+    before it in the same chunk (None at the start of a chunk).
+    Returns the entry if later entries can be encoded against it, else prev.
+    """
+    if entry.get("event") == "DELETED":
+        buf.append(FLAG_DELETED)
+        write_varint(buf, entry["timestamp"] - prev_ts)
+        return prev
+
+    if not is_compact(entry):
+        raw = json.dumps({k: v for k, v in entry.items() if k != "timestamp"},
+                         separators=(",", ":")).encode()
+        buf.append(FLAG_RAW)
+        write_varint(buf, entry["timestamp"] - prev_ts)
+        write_varint(buf, len(raw))
+        buf += raw
+        return prev
+
+    metadata = entry["metadata"]
+    prev_metadata = prev["metadata"] if prev else None
+    flags = FLAG_READONLY if metadata["readonly"] else 0
+    if prev and entry["content_hash"] == prev["content_hash"]:
+        flags |= FLAG_SAME_CONTENT
+    for flag, key in DELTA_FIELDS:
+        if prev_metadata is None or metadata[key] != prev_metadata[key]:
+            flags |= flag
+
+    buf.append(flags)
+    write_varint(buf, entry["timestamp"] - prev_ts)
+    buf += bytes.fromhex(entry["state_hash"])
+    if not flags & FLAG_SAME_CONTENT:
+        buf += bytes.fromhex(entry["content_hash"])
+    for flag, key in DELTA_FIELDS:
+        if flags & flag:
+            write_varint(buf, metadata[key] - (prev_metadata[key] if prev_metadata else 0))
+    return entry
+
+
+def decode_chunk(data: bytes, first_ts: int):
+    """
+    Decode the entries of a chunk, in the order they were recorded.
+    Returns (entries, last compact entry) - the latter is what the next
+    appended entry is encoded against.
+    """
+    entries = []
+    prev = None
+    ts = first_ts
+    pos = 0
+    while pos < len(data):
+        flags = data[pos]
+        delta, pos = read_varint(data, pos + 1)
+        ts += delta
+
+        if flags & FLAG_DELETED:
+            entries.append({
+                "timestamp": ts,
+                "state_hash": None,
+                "content_hash": None,
+                "metadata": None,
+                "event": "DELETED",
+            })
+            continue
+
+        if flags & FLAG_RAW:
+            length, pos = read_varint(data, pos)
+            entry = {"timestamp": ts}
+            entry.update(json.loads(data[pos:pos + length]))
+            pos += length
+            entries.append(entry)
+            continue
+
+        state_hash = data[pos:pos + 32].hex()
+        pos += 32
+        if flags & FLAG_SAME_CONTENT:
+            content_hash = prev["content_hash"]
+        else:
+            content_hash = data[pos:pos + 32].hex()
+            pos += 32
+        metadata = {}
+        for flag, key in DELTA_FIELDS:
+            base = prev["metadata"][key] if prev else 0
+            if flags & flag:
+                delta, pos = read_varint(data, pos)
+                metadata[key] = base + delta
+            else:
+                metadata[key] = base
+        metadata["readonly"] = bool(flags & FLAG_READONLY)
+
+        prev = {
+            "timestamp": ts,
+            "state_hash": state_hash,
+            "content_hash": content_hash,
+            "metadata": metadata,
+        }
+        entries.append(prev)
+    return entries, prev
+
+
+def chunk_bytes(codec: int, data: bytes) -> bytes:
+    if codec == CODEC_ZSTD:
+        if zstandard is None:
+            raise RuntimeError("History chunk is zstd-compressed but zstandard is not installed")
+        return zstandard.ZstdDecompressor().decompress(data)
+    return data
+
+
+def load_history_tail(conn: sqlite3.Connection, path: str) -> dict:
+    """
+    Load the newest chunk of a path: everything needed to append to its
+    history and to compare with its last entry.
+    """
+    row = conn.execute(
+        "SELECT chunk_no, first_ts, codec, data FROM history_chunks "
+        "WHERE path = ? ORDER BY chunk_no DESC LIMIT 1",
+        (path,),
+    ).fetchone()
+    if row is None:
+        return {"chunk_no": -1, "open": False, "last": None}
+
+    chunk_no, first_ts, codec, data = row
+    data = chunk_bytes(codec, data)
+    entries, prev = decode_chunk(data, first_ts)
+    return {
+        "chunk_no": chunk_no,
+        "open": codec == CODEC_OPEN,
+        "first_ts": first_ts,
+        "entries": len(entries),
+        "data": bytearray(data),
+        "prev": prev,
+        "prev_ts": entries[-1]["timestamp"] if entries else first_ts,
+        "last": entries[-1] if entries else None,
+    }
+
+
+def seal_chunk(data: bytearray):
+    """Return (codec, data) of a full chunk."""
+    if HISTORY_COMPRESSION and zstandard is not None:
+        return CODEC_ZSTD, zstandard.ZstdCompressor(level=9).compress(bytes(data))
+    return CODEC_PLAIN, bytes(data)
+
+
+def save_chunk(conn: sqlite3.Connection, path: str, tail: dict, codec: int, data: bytes):
+    conn.execute(
+        "INSERT OR REPLACE INTO history_chunks (path, chunk_no, first_ts, entries, codec, data) "
+        "VALUES (?, ?, ?, ?, ?, ?)",
+        (path, tail["chunk_no"], tail["first_ts"], tail["entries"], codec, data),
+    )
+
+
+def write_history(conn: sqlite3.Connection, path: str, tail: dict, entries: list):
+    """
+    Append entries to the history of a path. Only the open chunk is
+    rewritten, so the cost does not grow with the length of the history.
+    """
+    for entry in entries:
+        if not tail["open"]:
+            tail.update(
+                chunk_no=tail["chunk_no"] + 1,
+                open=True,
+                first_ts=entry["timestamp"],
+                entries=0,
+                data=bytearray(),
+                prev=None,
+                prev_ts=entry["timestamp"],
+            )
+
+        tail["prev"] = encode_entry(tail["data"], entry, tail["prev_ts"], tail["prev"])
+        tail["prev_ts"] = entry["timestamp"]
+        tail["last"] = entry
+        tail["entries"] += 1
+
+        if tail["entries"] >= HISTORY_CHUNK_ENTRIES:
+            save_chunk(conn, path, tail, *seal_chunk(tail["data"]))
+            tail["open"] = False
+
+    if tail["open"]:
+        save_chunk(conn, path, tail, CODEC_OPEN, bytes(tail["data"]))
+
+
+def append_history_entry(state: dict, conn: sqlite3.Connection, timestamp: int):
+    """
+    Append a state entry to history, but only if the state_hash differs from
+    the last recorded one (no duplicate NO_CHANGE entries).
+    """
+    path = state["path"]
+    new_hash = state["state_hash"]
+
+    tail = load_history_tail(conn, path)
+    if tail["last"] is not None and tail["last"].get("state_hash") == new_hash:
+        # No change in state since last history entry
+        return
+
+    entry = {
+        "timestamp": timestamp,
+        "state_hash": new_hash,
+        "content_hash": state["content_hash"],
+        "metadata": state["metadata"],
+    }
+    write_history(conn, path, tail, [entry])
+
+
+def append_deletion_history(path: str, conn: sqlite3.Connection, timestamp: int):
+    """
+    Append a DELETED event to history, but avoid repeated DELETED entries.
+    """
+    tail = load_history_tail(conn, path)
+    if tail["last"] is not None and tail["last"].get("event") == "DELETED":
+        return
+
+    deletion_entry = {
+        "timestamp": timestamp,
+        "state_hash": None,
+        "content_hash": None,
+        "metadata": None,
+        "event": "DELETED",
+    }
+    write_history(conn, path, tail, [deletion_entry])
+
+
+def get_history(path: str) -> list:
+    """Return all history entries of a path, oldest first."""
+    rows = get_db().execute(
+        "SELECT first_ts, codec, data FROM history_chunks WHERE path = ? ORDER BY chunk_no",
+        (os.path.abspath(path),),
+    )
+    history = []
+    for first_ts, codec, data in rows:
+        history.extend(decode_chunk(chunk_bytes(codec, data), first_ts)[0])
+    return history
+
+
+def get_state_at(path: str, timestamp: int):
+    """
+    Return the history entry describing a path at a point in time (epoch
+    seconds), or None if the path did not exist then. Only the one chunk
+    that covers the time is decoded.
+    """
+    row = get_db().execute(
+        "SELECT first_ts, codec, data FROM history_chunks "
+        "WHERE path = ? AND first_ts <= ? ORDER BY chunk_no DESC LIMIT 1",
+        (os.path.abspath(path), timestamp),
+    ).fetchone()
+    if row is None:
+        return None
+
+    first_ts, codec, data = row
+    state = None
+    for entry in decode_chunk(chunk_bytes(codec, data), first_ts)[0]:
+        if entry["timestamp"] > timestamp:
+            break
+        state = entry
+    if state is None or state.get("event") == "DELETED":
+        return None
+    return state
+
+
+# ============================
+# Mongo event sender
+# ============================
+
+def send_event_to_mongo(event: dict):
+    """
+    Insert a single FIM event document into MongoDB.
+    """
+    try:
+        mongo_collection.insert_one(event)
+    except Exception as e:
+        # Don't kill the agent if MongoDB is down
+        print(f"[!] Failed to send event to MongoDB: {e}")
+
+
+# ============================
+# File system event handler
+# ============================
+
+class FIMEventHandler(FileSystemEventHandler):
+    def __init__(self, root_dir: str):
+        super().__init__()
+        self.root_dir = os.path.abspath(root_dir)
+
+    def _handle_file_change(self, path: str, event_type: str):
+        # Ignore directories explicitly
+        if os.path.isdir(path):
+            return
+
+        abs_path = os.path.abspath(path)
+        now_ts = int(time.time())
+
+        conn = get_db()
+
+        # Handle deletion
+        if event_type == "DELETED":
+            print(f"[DELETED] {abs_path}")
+
+            # 1. Add to history (single DELETED) and remove from the
+            #    current snapshot, in one transaction
+            with conn:
+                append_deletion_history(abs_path, conn, now_ts)
+                delete_state(conn, abs_path)
+
+            # 2. Send deletion event to Mongo
+            event_doc = {
+                "timestamp": now_ts,
+                "event_type": "DELETED",
+                "path": abs_path,
+                "state_hash": None,
+                "content_hash": None,
+                "metadata": None,
+                "agent_id": AGENT_ID,
+            }
+            send_event_to_mongo(event_doc)
+            return
+
+        # For CREATED / MODIFIED / MOVED target:
+        if not os.path.exists(abs_path):
+            # race condition: event fired but file already gone
+            return
+
+        # Calculate current state
+        try:
+            current_state = hash_state(abs_path)
+        except (PermissionError, FileNotFoundError):
+            # Can't read file for some reason
+            return
+
+        old_state = get_state(conn, abs_path)
+
+        if old_state is None:
+            # never seen before
+            status = "CREATED"
+        else:
+            # if state_hash is the same, ignore the event (NO_CHANGE)
+            if current_state["state_hash"] == old_state.get("state_hash"):
+                return
+            status = "MODIFIED"
+
+        # Update snapshot & history in one transaction
+        with conn:
+            save_state(conn, current_state)
+            append_history_entry(current_state, conn, now_ts)
+
+        # Build and send Mongo event
+        event_doc = {
+            "timestamp": now_ts,
+            "event_type": status,  # CREATED or MODIFIED
+            "path": abs_path,
+            "state_hash": current_state["state_hash"],
+            "content_hash": current_state["content_hash"],
+            "metadata": current_state["metadata"],
+            "agent_id": AGENT_ID,
+        }
+        # send_event_to_mongo(event_doc)
+
+        print(f"[{status}] {abs_path}")
+
+    # Watchdog callbacks
+
+    def on_created(self, event):
+        if not event.is_directory and not is_temp_file(event.src_path):
+            self._handle_file_change(event.src_path, "CREATED")
+
+    def on_modified(self, event):
+        if not event.is_directory and not is_temp_file(event.src_path):
+            self._handle_file_change(event.src_path, "MODIFIED")
+
+    def on_deleted(self, event):
+        if not event.is_directory and not is_temp_file(event.src_path):
+            self._handle_file_change(event.src_path, "DELETED")
+
+    def on_moved(self, event):
+        if not event.is_directory:
+            # source deletion
+            if not is_temp_file(event.src_path):
+                self._handle_file_change(event.src_path, "DELETED")
+            # destination creation
+            if not is_temp_file(event.dest_path):
+                self._handle_file_change(event.dest_path, "CREATED")
+
+
+# ============================
+# Agent runner
+# ============================
+
+def run_agent(watch_dir: str, recursive: bool = True):
+    watch_dir = os.path.abspath(watch_dir)
+    print(f"[*] Starting FIM agent on: {watch_dir}")
+    print(f"[*] Agent ID: {AGENT_ID}")
+    print("[*] Press Ctrl+C to stop.\n")
+
+    event_handler = FIMEventHandler(watch_dir)
+    observer = Observer()
+    observer.schedule(event_handler, watch_dir, recursive=recursive)
+    observer.start()
+
+    try:
+        while True:
+            time.sleep(1)
+    except KeyboardInterrupt:
+        print("\n[*] Stopping observer...")
+        observer.stop()
+    observer.join()
+
+
+if __name__ == "__main__":
+    run_agent(WATCH_DIR, recursive=True)
@@ -1,17 +1,183 @@
 """File hashing utilities for integrity monitoring"""
+import errno
 import hashlib
 import json
 import os
+import threading
+import time
 from typing import Dict, Optional
 
+from config import (
+    HASH_IO_BUSINESS_RATE, HASH_IO_OFFHOURS_RATE,
+    BUSINESS_HOURS_START, BUSINESS_HOURS_END, HASH_CHUNK_SIZE,
+)
 
-def hash_content(file_path: str) -> Optional[str]:
-    """Calculate SHA-256 hash of file content"""
+O_NOATIME = getattr(os, "O_NOATIME", 0)
+HAS_FADVISE = hasattr(os, "posix_fadvise")
+HAS_SEEK_DATA = hasattr(os, "SEEK_DATA") and hasattr(os, "SEEK_HOLE")
+ZERO_CHUNK = bytes(HASH_CHUNK_SIZE)
+
+
+class IOBudget:
+    """Token bucket limiting hashing reads to a number of bytes per second.
+
+    The rate follows the business/off-hours schedule unless an override is
+    set at runtime with set_rate(). A rate of 0 means unlimited.
+    """
+    
+    def __init__(self, business_rate: int = HASH_IO_BUSINESS_RATE,
+                 offhours_rate: int = HASH_IO_OFFHOURS_RATE,
+                 business_hours: tuple = (BUSINESS_HOURS_START, BUSINESS_HOURS_END)):
+        self.business_rate = business_rate
+        self.offhours_rate = offhours_rate
+        self.business_hours = business_hours
+        self.override = None
+        self._tokens = 0.0
+        self._last = time.monotonic()
+        self._lock = threading.Lock()
+    
+    def set_rate(self, rate: Optional[int]) -> None:
+        """Override the scheduled rate (bytes/second); None restores the schedule"""
+        with self._lock:
+            self.override = rate
+            self._tokens = 0.0
+    
+    def rate(self) -> int:
+        """Bytes/second currently in effect"""
+        if self.override is not None:
+            return self.override
+        start, end = self.business_hours
+        if start <= time.localtime().tm_hour < end:
+            return self.business_rate
+        return self.offhours_rate
+    
+    def consume(self, nbytes: int) -> None:
+        """Take nbytes from the bucket, sleeping until they are paid for"""
+        rate = self.rate()
+        if rate <= 0:
+            return
+        with self._lock:
+            now = time.monotonic()
+            # Allow at most one second of burst
+            self._tokens = min(float(rate), self._tokens + (now - self._last) * rate)
+            self._last = now
+            self._tokens -= nbytes
+            deficit = -self._tokens
+        if deficit > 0:
+            time.sleep(deficit / rate)
+    
+    def to_dict(self) -> Dict:
+        return {
+            "rate": self.rate(),
+            "override": self.override,
+            "business_rate": self.business_rate,
+            "offhours_rate": self.offhours_rate,
+            "business_hours": list(self.business_hours),
+        }
+
+
+io_budget = IOBudget()
+
+
+def _open_for_hashing(file_path: str) -> int:
+    """Open read-only without updating atime where the kernel allows it"""
+    if O_NOATIME:
+        try:
+            return os.open(file_path, os.O_RDONLY | O_NOATIME)
+        except PermissionError:
+            # O_NOATIME requires owning the file (or CAP_FOWNER)
+            pass
+    return os.open(file_path, os.O_RDONLY)
+
+
+def _hash_data(fd: int, h, start: int, end: Optional[int], budget: IOBudget) -> int:
+    """Read and hash bytes from start up to end (or EOF when end is None), returning the stop offset"""
+    offset = start
+    os.lseek(fd, start, os.SEEK_SET)
+    while end is None or offset < end:
+        want = HASH_CHUNK_SIZE if end is None else min(HASH_CHUNK_SIZE, end - offset)
+        chunk = os.read(fd, want)
+        if not chunk:
+            break
+        budget.consume(len(chunk))
+        h.update(chunk)
+        if HAS_FADVISE:
+            os.posix_fadvise(fd, offset, len(chunk), os.POSIX_FADV_DONTNEED)
+        offset += len(chunk)
+    return offset
+
+
+def _hash_zeros(h, length: int) -> None:
+    """Hash a hole as the zero bytes it reads back as, without touching the disk"""
+    zeros = memoryview(ZERO_CHUNK)
+    while length > 0:
+        n = min(length, len(ZERO_CHUNK))
+        h.update(zeros[:n])
+        length -= n
+
+
+def _hash_extents(fd: int, h, size: int, budget: IOBudget) -> bool:
+    """Hash a sparse file by walking its data extents with SEEK_DATA/SEEK_HOLE.
+
+    Returns False if the file shrank below size while being hashed, since
+    the zeros hashed for the missing tail would make up a digest.
+    """
+    offset = 0
+    while offset < size:
+        try:
+            data = os.lseek(fd, offset, os.SEEK_DATA)
+        except OSError as e:
+            if e.errno != errno.ENXIO:
+                raise
+            # No data past offset: the rest of the file is a hole, or it was truncated
+            if os.fstat(fd).st_size < size:
+                return False
+            data = size
+        data = min(data, size)
+        _hash_zeros(h, data - offset)
+        if data >= size:
+            break
+        hole = min(os.lseek(fd, data, os.SEEK_HOLE), size)
+        offset = _hash_data(fd, h, data, hole, budget)
+        if offset < hole:
+            # Truncated while hashing
+            return False
+    return True
+
+
+def hash_content(file_path: str, budget: IOBudget = None) -> Optional[str]:
+    """Calculate SHA-256 hash of file content.
+
+    Reads are throttled by the I/O budget and advised as sequential, and each
+    chunk is dropped from the page cache once hashed so scans do not evict
+    the host's working set. Holes in sparse files are hashed as zeros without
+    being read, so the digest is the same as for a fully allocated copy.
+    Returns None if the file cannot be read or is truncated mid-hash.
+    """
+    budget = budget or io_budget
     try:
         h = hashlib.sha256()
-        with open(file_path, "rb") as f:
-            for chunk in iter(lambda: f.read(8192), b""):
-                h.update(chunk)
+        fd = _open_for_hashing(file_path)
+        try:
+            if HAS_FADVISE:
+                os.posix_fadvise(fd, 0, 0, os.POSIX_FADV_SEQUENTIAL)
+            s = os.fstat(fd)
+            allocated = getattr(s, "st_blocks", None)
+            if HAS_SEEK_DATA and allocated is not None and allocated * 512 < s.st_size:
+                try:
+                    if not _hash_extents(fd, h, s.st_size, budget):
+                        # The modification that truncated it queues another hash
+                        return None
+                except OSError as e:
+                    if e.errno not in (errno.EINVAL, errno.EOPNOTSUPP):
+                        raise
+                    # Filesystem cannot report extents; hash it densely
+                    h = hashlib.sha256()
+                    _hash_data(fd, h, 0, None, budget)
+            else:
+                _hash_data(fd, h, 0, None, budget)
+        finally:
+            os.close(fd)
         return h.hexdigest()
     except (PermissionError, FileNotFoundError, OSError):
         return None
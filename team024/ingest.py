@@ -0,0 +1,406 @@
+"""Batched event ingestion from remote agents (/api/ingest)"""
+import json
+import zlib
+from collections import Counter
+from datetime import datetime, timedelta
+from types import SimpleNamespace
+from typing import Dict, List, Optional, Tuple
+
+from app import db
+from config import INGEST_MAX_BYTES, INGEST_MAX_AGE_DAYS, INGEST_MAX_FUTURE_SECONDS
+from models import (
+    Event, FileClassification, FileState, HashBaseline, IngestBatch, AlertConfig,
+    BULK_CHUNK_SIZE, record_rollups, file_metadata_columns, _dialect_insert,
+)
+from dimensions import add_event_dimensions
+from partitions import ensure_partition_for, period_start
+from pagination import parse_timestamp
+from search import HEX_RE
+
+try:
+    import msgpack
+except ImportError:  # optional: agents then send NDJSON
+    msgpack = None
+
+# Content-Type -> decoder name
+INGEST_FORMATS = {
+    "application/x-ndjson": "ndjson",
+    "application/msgpack": "msgpack",
+    "application/x-msgpack": "msgpack",
+}
+EVENT_TYPES = ("created", "modified", "deleted")
+
+
+def _decompress(body: bytes, content_encoding: Optional[str]) -> bytes:
+    """Undo Content-Encoding, refusing bodies that inflate past INGEST_MAX_BYTES"""
+    encoding = (content_encoding or "identity").lower()
+    if encoding == "identity":
+        data = body
+    elif encoding in ("gzip", "deflate"):
+        # wbits 47 accepts both gzip and zlib headers
+        decompressor = zlib.decompressobj(47)
+        try:
+            data = decompressor.decompress(body, INGEST_MAX_BYTES + 1)
+        except zlib.error as e:
+            raise ValueError(f"Invalid {encoding} body: {e}") from e
+        if decompressor.unconsumed_tail:
+            raise ValueError(f"Batch larger than {INGEST_MAX_BYTES} bytes")
+    else:
+        raise ValueError(f"Unsupported Content-Encoding: {content_encoding}")
+    if len(data) > INGEST_MAX_BYTES:
+        raise ValueError(f"Batch larger than {INGEST_MAX_BYTES} bytes")
+    return data
+
+
+def decode_batch(body: bytes, content_type: str, content_encoding: Optional[str] = None) -> List:
+    """Records of a batch: NDJSON lines, or a msgpack array or stream of maps.
+
+    Raises ValueError for a body that cannot be decoded; records that decode
+    but are not valid events are rejected one by one in ingest_batch.
+    """
+    data = _decompress(body, content_encoding)
+    if INGEST_FORMATS.get(content_type) == "msgpack":
+        if msgpack is None:
+            raise ValueError("msgpack batches need the msgpack package on the server")
+        unpacker = msgpack.Unpacker(raw=False, max_buffer_size=INGEST_MAX_BYTES)
+        try:
+            unpacker.feed(data)
+            records = list(unpacker)
+        except Exception as e:
+            raise ValueError(f"Invalid msgpack body: {e}") from e
+        return records[0] if len(records) == 1 and isinstance(records[0], list) else records
+
+    try:
+        return [json.loads(line) for line in data.splitlines() if line.strip()]
+    except ValueError as e:
+        raise ValueError(f"Invalid NDJSON body: {e}") from e
+
+
+def _digest(record: Dict, field: str) -> Optional[str]:
+    value = record.get(field)
+    if value is None:
+        return None
+    if not isinstance(value, str) or len(value) != 64 or not HEX_RE.match(value.lower()):
+        raise ValueError(f"{field} must be a SHA-256 hex digest")
+    return value.lower()
+
+
+def _text(record: Dict, field: str, max_length: int, default: str = None) -> str:
+    value = record.get(field, default)
+    if not isinstance(value, str) or not value or len(value) > max_length:
+        raise ValueError(f"{field} must be a non-empty string of at most {max_length} characters")
+    return value
+
+
+def validate_event(record, agent_id: str) -> Dict:
+    """Normalize one ingested record to the shape of a spooled event.
+
+    Records use the spool's field names (event_uid, event_type, file_path,
+    timestamp, hash_after, state_hash, file_size, metadata_json) plus
+    endpoint, hostname and username, which default to the agent id.
+    """
+    if not isinstance(record, dict):
+        raise ValueError("event must be an object")
+    if record.get("event_type") not in EVENT_TYPES:
+        raise ValueError(f"event_type must be one of {', '.join(EVENT_TYPES)}")
+    if not isinstance(record.get("timestamp"), (str, int, float)):
+        raise ValueError("timestamp is required")
+    timestamp = parse_timestamp(str(record["timestamp"]))
+    if timestamp is None:
+        raise ValueError("timestamp is required")
+    # Each period gets a partition, so a wild clock must not create one for it
+    now = datetime.utcnow()
+    if not now - timedelta(days=INGEST_MAX_AGE_DAYS) <= timestamp <= now + timedelta(seconds=INGEST_MAX_FUTURE_SECONDS):
+        raise ValueError(f"timestamp {timestamp.isoformat()} is too far in the past or future")
+
+    file_size = record.get("file_size")
+    if file_size is not None and (not isinstance(file_size, int) or file_size < 0):
+        raise ValueError("file_size must be a non-negative integer")
+    metadata_json = record.get("metadata_json")
+    if metadata_json is None and isinstance(record.get("metadata"), dict):
+        metadata_json = json.dumps(record["metadata"])
+    try:
+        metadata = file_metadata_columns(metadata_json)
+    except (ValueError, KeyError, TypeError, OverflowError) as e:
+        raise ValueError(f"Invalid file metadata: {e}") from e
+
+    return {
+        "event_uid": _text(record, "event_uid", 32),
+        "event_type": record["event_type"],
+        "file_path": _text(record, "file_path", 4096),
+        "timestamp": timestamp,
+        "endpoint": _text(record, "endpoint", 255, agent_id),
+        "hostname": _text(record, "hostname", 255, agent_id),
+        "username": _text(record, "username", 255, agent_id),
+        "hash_after": _digest(record, "hash_after"),
+        "state_hash": _digest(record, "state_hash"),
+        "file_size": file_size,
+        **metadata,
+    }
+
+
+def _chunks(values: List, size: int = BULK_CHUNK_SIZE):
+    for start in range(0, len(values), size):
+        yield values[start:start + size]
+
+
+def _existing_event_keys(events: List[Dict]) -> set:
+    """(event_uid, timestamp) of the events already stored, e.g. by an earlier batch"""
+    table = Event.__table__
+    keys = set()
+    for chunk in _chunks(sorted({e["event_uid"] for e in events})):
+        rows = db.session.execute(
+            db.select(table.c.event_uid, table.c.timestamp).where(table.c.event_uid.in_(chunk))
+        )
+        keys.update((uid, ts) for uid, ts in rows)
+    return keys
+
+
+def _rows_by_path(model, paths: List[str]) -> Dict:
+    rows = {}
+    for chunk in _chunks(paths):
+        rows.update((row.file_path, row) for row in model.query.filter(model.file_path.in_(chunk)))
+    return rows
+
+
+def _rows_by_key(model, keys: List[Tuple[str, str]]) -> Dict:
+    """Rows of a table keyed by (endpoint, file_path), for the given keys"""
+    rows = {}
+    for chunk in _chunks(keys):
+        rows.update(
+            ((row.endpoint, row.file_path), row)
+            for row in model.query.filter(db.tuple_(model.endpoint, model.file_path).in_(chunk))
+        )
+    return rows
+
+
+def _apply_baselines(events: List[Dict]) -> List[Dict]:
+    """Fill in hash_before from the baselines and move them forward, in the caller's session.
+
+    Follows FIMEventHandler.apply_event for each event in batch order, with
+    each endpoint's baselines kept apart: an event whose content hash equals
+    its endpoint's baseline for the path is dropped, deletions remove that
+    baseline. Returns the events to insert.
+    """
+    keys = sorted({(e["endpoint"], e["file_path"]) for e in events})
+    current = {key: row.content_hash for key, row in _rows_by_key(HashBaseline, keys).items()}
+    # Last event per (endpoint, path) that sets (or, with None, deletes) the baseline
+    final = {}
+    kept = []
+    for event in events:
+        key, hash_after = (event["endpoint"], event["file_path"]), event["hash_after"]
+        if hash_after and current.get(key) == hash_after:
+            continue
+        event["hash_before"] = current.get(key)
+        if hash_after:
+            current[key] = hash_after
+            final[key] = event
+        if event["event_type"] == "deleted":
+            current.pop(key, None)
+            final[key] = None
+        kept.append(event)
+
+    deleted = sorted(key for key, event in final.items() if event is None)
+    for chunk in _chunks(deleted):
+        HashBaseline.query.filter(
+            db.tuple_(HashBaseline.endpoint, HashBaseline.file_path).in_(chunk)
+        ).delete(synchronize_session=False)
+
+    table = HashBaseline.__table__
+    upserts = [
+        {
+            "endpoint": endpoint,
+            "file_path": path,
+            "content_hash": event["hash_after"],
+            "state_hash": event["state_hash"],
+            "file_size": event["file_size"],
+            "file_mtime": event["file_mtime"],
+            "file_ctime": event["file_ctime"],
+            "file_mode": event["file_mode"],
+            "file_readonly": event["file_readonly"],
+            "last_updated": datetime.utcnow(),
+        }
+        for (endpoint, path), event in sorted(final.items()) if event is not None
+    ]
+    if upserts:
+        insert = _dialect_insert(table)
+        db.session.execute(insert.on_conflict_do_update(
+            index_elements=[table.c.endpoint, table.c.file_path],
+            set_={name: insert.excluded[name] for name in upserts[0] if name not in ("endpoint", "file_path")}
+        ), upserts)
+    return kept
+
+
+EVENT_INSERT_COLUMNS = [
+    "event_uid", "event_type", "path_id", "timestamp", "endpoint_id", "host_id", "username",
+    "hash_before", "hash_after", "state_hash", "file_size",
+    "file_mtime", "file_ctime", "file_mode", "file_readonly", "alert_sent",
+]
+
+
+def _insert_events(events: List[Dict]) -> None:
+    """Multi-row INSERT of the events, setting each one's id; duplicates are skipped"""
+    if not events:
+        return
+    table = Event.__table__
+    insert = _dialect_insert(table).on_conflict_do_nothing().returning(
+        table.c.id, table.c.event_uid, table.c.timestamp
+    )
+    rows = [dict({name: event.get(name) for name in EVENT_INSERT_COLUMNS}, alert_sent=False) for event in events]
+    ids = {(uid, ts): row_id for row_id, uid, ts in db.session.execute(insert, rows)}
+    for event in events:
+        event["id"] = ids.get((event["event_uid"], event["timestamp"]))
+
+
+def _record_file_states(events: List[Dict]) -> Dict[str, Optional[str]]:
+    """Upsert file_state from the last event of each endpoint and path (see record_file_state).
+
+    Returns the classification of each path, for alerts.
+    """
+    latest = {(event["endpoint"], event["file_path"]): event for event in events}
+    paths = sorted({path for _, path in latest})
+    classifications = {
+        path: row.classification for path, row in _rows_by_path(FileClassification, paths).items()
+    }
+
+    table = FileState.__table__
+    rows = [
+        {
+            "file_path": path,
+            "last_event_id": event["id"],
+            "last_event_type": event["event_type"],
+            "last_timestamp": event["timestamp"],
+            "endpoint": event["endpoint"],
+            "hostname": event["hostname"],
+            "username": event["username"],
+            "content_hash": event["hash_after"],
+            "classification": classifications.get(path),
+        }
+        for (_, path), event in sorted(latest.items())
+    ]
+    insert = _dialect_insert(table)
+    db.session.execute(insert.on_conflict_do_update(
+        index_elements=[table.c.endpoint, table.c.file_path],
+        set_={
+            name: insert.excluded[name]
+            for name in rows[0] if name not in ("endpoint", "file_path", "classification")
+        }
+    ), rows)
+    return classifications
+
+
+def _send_alerts(events: List[Dict], classifications: Dict[str, Optional[str]]) -> None:
+    """Alert on ingested events as the local drainer does for its own"""
+    from alerts import process_event_alerts
+
+    configs = [c.to_dict() for c in AlertConfig.query.filter_by(is_active=True).all()]
+    if not configs:
+        return
+    for event in events:
+        try:
+            process_event_alerts({
+                'id': event["id"],
+                'event_type': event["event_type"],
+                'file_path': event["file_path"],
+                'timestamp': event["timestamp"].strftime('%Y-%m-%d %H:%M:%S'),
+                'endpoint': event["endpoint"],
+                'hostname': event["hostname"],
+                'username': event["username"],
+                'hash_before': event["hash_before"],
+                'hash_after': event["hash_after"],
+                'state_hash': event["state_hash"],
+                'content_hash': event["hash_after"],
+                'file_size': event["file_size"],
+                'alert_sent': False,
+                'classification': classifications.get(event["file_path"]) or 'Unclassified',
+            }, configs)
+        except Exception as e:
+            print(f"[INGEST] Error sending alerts: {e}")
+
+
+def ingest_batch(agent_id: str, batch_id: str, records: List) -> Dict:
+    """Store a batch of agent events exactly once and return its ack.
+
+    The batch is claimed in ingest_batches, then its valid events are written
+    with multi-row inserts together with their baselines, file_state rows and
+    rollups, all in one transaction. A batch_id the agent already sent returns
+    the stored ack with status "duplicate". Events already stored under
+    another batch (same event_uid and timestamp) are skipped.
+    """
+    return ingest_batches([(agent_id, batch_id, records)])[0]
+
+
+def ingest_batches(batches: List[Tuple[str, str, List]]) -> List[Dict]:
+    """Store several (agent_id, batch_id, records) batches in one transaction.
+
+    Same rules as ingest_batch, applied to the events of all batches in
+    order; returns one ack per batch. The gateway coalesces batches from many
+    agents this way so each commit covers more events. Keys must be distinct.
+    """
+    claims = []
+    for agent_id, batch_id, records in batches:
+        events, rejected = [], []
+        for index, record in enumerate(records):
+            try:
+                event = validate_event(record, agent_id)
+            except ValueError as e:
+                rejected.append({"index": index, "message": str(e)})
+                continue
+            event["batch"] = len(claims)
+            events.append(event)
+        claims.append((agent_id, batch_id, len(records), events, rejected))
+
+    all_events = [event for claim in claims for event in claim[3]]
+    for timestamp in {period_start(e["timestamp"]): e["timestamp"] for e in all_events}.values():
+        ensure_partition_for(timestamp)
+    add_event_dimensions(all_events)
+
+    table = IngestBatch.__table__
+    duplicates = set()
+    try:
+        for index, (agent_id, batch_id, count, events, rejected) in enumerate(claims):
+            claimed = db.session.execute(
+                _dialect_insert(table).values(
+                    agent_id=agent_id, batch_id=batch_id, received_at=datetime.utcnow(),
+                    event_count=count, inserted_count=0, rejected=json.dumps(rejected),
+                ).on_conflict_do_nothing().returning(table.c.batch_id)
+            ).first()
+            if claimed is None:
+                duplicates.add(index)
+
+        events = [event for event in all_events if event["batch"] not in duplicates]
+        existing = _existing_event_keys(events) if events else set()
+        new_events, seen = [], set()
+        for event in events:
+            key = (event["event_uid"], event["timestamp"])
+            if key not in existing and key not in seen:
+                seen.add(key)
+                new_events.append(event)
+
+        new_events = _apply_baselines(new_events)
+        _insert_events(new_events)
+        inserted = [event for event in new_events if event["id"] is not None]
+        classifications = {}
+        if inserted:
+            classifications = _record_file_states(inserted)
+            record_rollups([SimpleNamespace(**event) for event in inserted])
+
+        inserted_counts = Counter(event["batch"] for event in inserted)
+        acks = []
+        for index, (agent_id, batch_id, *_) in enumerate(claims):
+            batch = db.session.get(IngestBatch, (agent_id, batch_id))
+            if index in duplicates:
+                acks.append(batch.to_ack("duplicate"))
+                continue
+            batch.inserted_count = inserted_counts[index]
+            acks.append(batch.to_ack("accepted"))
+        db.session.commit()
+    except Exception:
+        db.session.rollback()
+        raise
+
+    for index, (agent_id, batch_id, count, *_) in enumerate(claims):
+        if index not in duplicates:
+            print(f"[INGEST] {agent_id}: batch {batch_id}, {inserted_counts[index]} of {count} event(s) stored")
+    _send_alerts(inserted, classifications)
+    return acks
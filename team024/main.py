@@ -1,4 +1,5 @@
 """Main entry point - runs the FIM system with Flask dashboard and file watcher"""
+import signal
 import threading
 from app import app
 from watcher import DirectoryWatcher
@@ -15,16 +16,23 @@ def main():
     
     print("[INIT] Starting directory watcher...")
     watcher = DirectoryWatcher(app.app_context())
+    app.config["FIM_WATCHER"] = watcher
     watcher_thread = threading.Thread(target=watcher.start_background, daemon=True)
     watcher_thread.start()
     
+    def handle_sigterm(signum, frame):
+        raise KeyboardInterrupt
+    signal.signal(signal.SIGTERM, handle_sigterm)
+    
     print(f"[FLASK] Starting dashboard on http://{FLASK_HOST}:{FLASK_PORT}")
     
     try:
         app.run(host=FLASK_HOST, port=FLASK_PORT, debug=False, use_reloader=False)
     except KeyboardInterrupt:
-        print("\n[SHUTDOWN] Shutting down...")
-        watcher.stop()
+        pass
+    # The dev server swallows Ctrl+C itself, so always flush on the way out
+    print("\n[SHUTDOWN] Shutting down...")
+    watcher.stop()
 
 
 if __name__ == "__main__":
@@ -0,0 +1,70 @@
+"""Global memory budget for queued work and caches"""
+import os
+import threading
+from typing import Dict
+
+from config import MEMORY_BUDGET_BYTES
+
+try:
+    import resource
+except ImportError:
+    resource = None
+
+
+def current_rss() -> int:
+    """Resident set size of this process in bytes (peak RSS where current is unavailable)"""
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, IndexError):
+        pass
+    if resource is not None:
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        # Linux reports KiB, macOS reports bytes
+        return peak if peak > 1 << 30 else peak * 1024
+    return 0
+
+
+class MemoryBudget:
+    """Byte accounting shared by every component that buffers work in memory.
+
+    Components reserve() before growing and release() when they shrink; a
+    refused reservation means the caller must spill to disk or degrade.
+    """
+
+    def __init__(self, limit: int = MEMORY_BUDGET_BYTES):
+        self.limit = limit
+        self._used: Dict[str, int] = {}
+        self._total = 0
+        self._lock = threading.Lock()
+
+    def reserve(self, component: str, nbytes: int, force: bool = False) -> bool:
+        """Account nbytes to component if it fits in the budget (or unconditionally with force)"""
+        with self._lock:
+            if not force and self._total + nbytes > self.limit:
+                return False
+            self._total += nbytes
+            self._used[component] = self._used.get(component, 0) + nbytes
+            return True
+
+    def release(self, component: str, nbytes: int) -> None:
+        with self._lock:
+            self._total -= nbytes
+            self._used[component] = self._used.get(component, 0) - nbytes
+
+    def available(self) -> int:
+        with self._lock:
+            return self.limit - self._total
+
+    def usage(self) -> Dict:
+        """Budget, accounted bytes per component and process RSS"""
+        with self._lock:
+            return {
+                "limit_bytes": self.limit,
+                "used_bytes": self._total,
+                "components": dict(self._used),
+                "rss_bytes": current_rss(),
+            }
+
+
+memory_budget = MemoryBudget()
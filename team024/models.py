@@ -1,27 +1,145 @@
 """Database models for File Integrity Monitoring System - PostgreSQL"""
+import json
 from datetime import datetime
+from sqlalchemy import inspect, text
+from sqlalchemy.schema import CreateIndex
+from sqlalchemy.types import TypeDecorator, LargeBinary
 from app import db
+from config import HASH_LOOKUP_MAX_OCCURRENCES, ENDPOINT_NAME
+import partitions
+
+
+class HexDigest(TypeDecorator):
+    """A digest stored as raw bytes (BYTEA, 32 bytes for SHA-256).
+
+    Python code and the API see lowercase hex; conversion happens only when
+    values are bound to or read from SQL.
+    """
+    impl = LargeBinary
+    cache_ok = True
+    
+    def process_bind_param(self, value, dialect):
+        return bytes.fromhex(value) if value is not None else None
+    
+    def process_result_value(self, value, dialect):
+        return bytes(value).hex() if value is not None else None
+
+
+def digest_prefix_match(column, prefix):
+    """Condition for digests whose hex form starts with prefix.
+
+    Expressed as a byte range so it is answered by a plain btree index on
+    the binary column; an odd number of digits covers the 16 possible values
+    of the last half byte.
+    """
+    digits = len(prefix) + len(prefix) % 2
+    step = 1 << (4 * (digits - len(prefix)))
+    low = int(prefix, 16) * step
+    condition = column >= f"{low:0{digits}x}"
+    if low + step < 16 ** digits:
+        condition = db.and_(condition, column < f"{low + step:0{digits}x}")
+    return condition
+
+
+def file_metadata_columns(metadata_json):
+    """Typed file metadata columns from the JSON of hashing.get_file_metadata()"""
+    metadata = json.loads(metadata_json) if metadata_json else None
+    if not metadata:
+        return {'file_mtime': None, 'file_ctime': None, 'file_mode': None, 'file_readonly': None}
+    return {
+        'file_mtime': datetime.utcfromtimestamp(metadata['mtime']),
+        'file_ctime': datetime.utcfromtimestamp(metadata['ctime']),
+        'file_mode': metadata['mode'],
+        'file_readonly': metadata['readonly'],
+    }
+
+
+class FilePath(db.Model):
+    """Distinct file paths referenced by events"""
+    __tablename__ = 'paths'
+    
+    id = db.Column(db.Integer, primary_key=True)
+    path = db.Column(db.Text, nullable=False, unique=True)
+    
+    # path: prefix and glob searches resolve to ids here instead of scanning events
+    __table_args__ = (
+        db.Index('ix_paths_path_pattern', 'path', postgresql_ops={'path': 'text_pattern_ops'}),
+    )
+
+
+class Endpoint(db.Model):
+    """Distinct endpoint names referenced by events"""
+    __tablename__ = 'endpoints'
+    
+    id = db.Column(db.Integer, primary_key=True)
+    name = db.Column(db.String(255), nullable=False, unique=True)
+
+
+class Host(db.Model):
+    """Distinct hostnames referenced by events"""
+    __tablename__ = 'hosts'
+    
+    id = db.Column(db.Integer, primary_key=True)
+    hostname = db.Column(db.String(255), nullable=False, unique=True)
 
 
 class Event(db.Model):
     """File system events table"""
     __tablename__ = 'events'
     
-    id = db.Column(db.Integer, primary_key=True)
-    event_type = db.Column(db.String(50), nullable=False, index=True)
-    file_path = db.Column(db.Text, nullable=False)
-    timestamp = db.Column(db.DateTime, nullable=False, default=datetime.utcnow, index=True)
-    endpoint = db.Column(db.String(255), nullable=False, default='replit_agent')
-    hostname = db.Column(db.String(255), nullable=False)
+    id = db.Column(db.Integer, primary_key=True, autoincrement=True)
+    event_uid = db.Column(db.String(32))
+    event_type = db.Column(db.String(50), nullable=False)
+    path_id = db.Column(db.Integer, db.ForeignKey('paths.id'), nullable=False)
+    # Part of the primary key because the table is partitioned on it
+    timestamp = db.Column(db.DateTime, primary_key=True, default=datetime.utcnow)
+    endpoint_id = db.Column(db.Integer, db.ForeignKey('endpoints.id'), nullable=False)
+    host_id = db.Column(db.Integer, db.ForeignKey('hosts.id'), nullable=False)
     username = db.Column(db.String(255), nullable=False)
-    hash_before = db.Column(db.String(128))
-    hash_after = db.Column(db.String(128))
-    state_hash = db.Column(db.String(128))
-    content_hash = db.Column(db.String(128))
+    hash_before = db.Column(HexDigest)
+    # Content hash of the file after the event
+    hash_after = db.Column(HexDigest)
+    state_hash = db.Column(HexDigest)
     file_size = db.Column(db.BigInteger)
-    metadata_json = db.Column(db.Text)
+    # UTC, from the file's stat at hashing time
+    file_mtime = db.Column(db.DateTime)
+    file_ctime = db.Column(db.DateTime)
+    file_mode = db.Column(db.Integer)
+    file_readonly = db.Column(db.Boolean)
     alert_sent = db.Column(db.Boolean, default=False)
     
+    # The dimension values under their original names. They are read-only in
+    # SQL; pass them with the ids when creating an event (dimensions.event_dimensions)
+    # so they stay available after the flush.
+    file_path = db.column_property(
+        db.select(FilePath.path).where(FilePath.id == path_id).correlate_except(FilePath).scalar_subquery(),
+        expire_on_flush=False
+    )
+    endpoint = db.column_property(
+        db.select(Endpoint.name).where(Endpoint.id == endpoint_id).correlate_except(Endpoint).scalar_subquery(),
+        expire_on_flush=False
+    )
+    hostname = db.column_property(
+        db.select(Host.hostname).where(Host.id == host_id).correlate_except(Host).scalar_subquery(),
+        expire_on_flush=False
+    )
+    
+    # Keyset pagination on (timestamp, id), optionally narrowed by endpoint,
+    # host, path or type; path searches resolve to path ids first and hash
+    # prefixes are byte ranges on the digest indexes
+    __table_args__ = (
+        # Spool replays carry the original timestamp, so this still rejects duplicates
+        db.Index('ix_events_event_uid', 'event_uid', 'timestamp', unique=True),
+        db.Index('ix_events_ts_id', 'timestamp', 'id'),
+        db.Index('ix_events_endpoint_ts_id', 'endpoint_id', 'timestamp', 'id'),
+        db.Index('ix_events_type_ts_id', 'event_type', 'timestamp', 'id'),
+        db.Index('ix_events_host_ts_id', 'host_id', 'timestamp', 'id'),
+        db.Index('ix_events_path_ts_id', 'path_id', 'timestamp', 'id'),
+        db.Index('ix_events_hash_after', 'hash_after'),
+        db.Index('ix_events_hash_before', 'hash_before'),
+        {'postgresql_partition_by': 'RANGE (timestamp)'},
+    )
+    
     def to_dict(self):
         return {
             'id': self.id,
@@ -34,12 +152,86 @@ class Event(db.Model):
             'hash_before': self.hash_before,
             'hash_after': self.hash_after,
             'state_hash': self.state_hash,
-            'content_hash': self.content_hash,
+            'content_hash': self.hash_after,
             'file_size': self.file_size,
             'alert_sent': self.alert_sent
         }
 
 
+# Columns free text is matched against with ILIKE '%term%'; upgrade_schema()
+# gives each a trigram index. The dimension tables are small, so matching
+# there and joining back by id is much cheaper than scanning event rows.
+TRIGRAM_SEARCH_COLUMNS = [('paths', 'path'), ('endpoints', 'name'), ('hosts', 'hostname'), ('events', 'username')]
+
+# Also the columns of events_view, which presents events with the dimension
+# values in place of their ids (and hash_after again as content_hash)
+EVENT_EXPORT_COLUMNS = [
+    'id', 'event_uid', 'event_type', 'file_path', 'timestamp', 'endpoint', 'hostname', 'username',
+    'hash_before', 'hash_after', 'state_hash', 'content_hash', 'file_size',
+    'file_mtime', 'file_ctime', 'file_mode', 'file_readonly', 'alert_sent',
+]
+
+
+def event_view_select():
+    """SELECT of events joined with paths, endpoints and hosts, in the shape of EVENT_EXPORT_COLUMNS"""
+    dimension_columns = {
+        'file_path': FilePath.path.label('file_path'),
+        'endpoint': Endpoint.name.label('endpoint'),
+        'hostname': Host.hostname.label('hostname'),
+        'content_hash': Event.__table__.c.hash_after.label('content_hash'),
+    }
+    columns = [
+        dimension_columns[name] if name in dimension_columns else Event.__table__.c[name]
+        for name in EVENT_EXPORT_COLUMNS
+    ]
+    return db.select(*columns).select_from(
+        Event.__table__.join(FilePath.__table__).join(Endpoint.__table__).join(Host.__table__)
+    )
+
+
+def dimension_id(model, column_name, value):
+    """Id of a dimension value, inserting it if it is new.
+
+    Runs in its own short transaction so the row exists even if the event
+    transaction that needed it rolls back; dimension rows are never deleted,
+    so ids can be cached for the life of the process.
+    """
+    table = model.__table__
+    column = table.c[column_name]
+    lookup = db.select(table.c.id).where(column == value)
+    with db.engine.begin() as conn:
+        row_id = conn.execute(lookup).scalar()
+        if row_id is None:
+            insert = _dialect_insert(table).values({column_name: value})
+            row_id = conn.execute(insert.on_conflict_do_nothing().returning(table.c.id)).scalar()
+        if row_id is None:
+            # Inserted concurrently by another writer
+            row_id = conn.execute(lookup).scalar()
+    return row_id
+
+
+def dimension_ids(model, column_name, values):
+    """Ids of many dimension values, inserting the new ones (see dimension_id).
+
+    Looks values up and inserts the missing ones a chunk at a time, in sorted
+    order so concurrent writers take the unique index locks in the same order.
+    """
+    table = model.__table__
+    column = table.c[column_name]
+    insert = _dialect_insert(table).on_conflict_do_nothing()
+    ids = {}
+    values = sorted(set(values))
+    with db.engine.begin() as conn:
+        for start in range(0, len(values), BULK_CHUNK_SIZE):
+            chunk = values[start:start + BULK_CHUNK_SIZE]
+            ids.update(conn.execute(db.select(column, table.c.id).where(column.in_(chunk))).all())
+            missing = [value for value in chunk if value not in ids]
+            if missing:
+                conn.execute(insert, [{column_name: value} for value in missing])
+                ids.update(conn.execute(db.select(column, table.c.id).where(column.in_(missing))).all())
+    return ids
+
+
 class FileClassification(db.Model):
     """Security classification for monitored files"""
     __tablename__ = 'file_classification'
@@ -64,21 +256,250 @@ class FileClassification(db.Model):
         }
 
 
+class FileState(db.Model):
+    """Latest known state of each monitored file on each endpoint, maintained by the event writer"""
+    __tablename__ = 'file_state'
+    
+    id = db.Column(db.Integer, primary_key=True)
+    file_path = db.Column(db.Text, nullable=False)
+    # Not a foreign key: event partitions are dropped by the retention policy
+    last_event_id = db.Column(db.Integer)
+    last_event_type = db.Column(db.String(50), nullable=False)
+    last_timestamp = db.Column(db.DateTime, nullable=False, index=True)
+    endpoint = db.Column(db.String(255), nullable=False, index=True)
+    hostname = db.Column(db.String(255), nullable=False)
+    username = db.Column(db.String(255), nullable=False)
+    content_hash = db.Column(HexDigest)
+    classification = db.Column(db.String(50))
+    
+    # One row per (endpoint, file_path); keyset pagination indexes pair every
+    # sort key with that unique pair
+    __table_args__ = (
+        db.Index('ix_file_state_endpoint_path', 'endpoint', 'file_path', unique=True),
+        db.Index('ix_file_state_ts_path', 'last_timestamp', 'file_path', 'endpoint'),
+        db.Index('ix_file_state_path_endpoint', 'file_path', 'endpoint'),
+        db.Index('ix_file_state_class_path', db.func.coalesce(classification, ''), 'file_path', 'endpoint'),
+    )
+    
+    def to_dict(self):
+        return {
+            'file_path': self.file_path,
+            'last_event_id': self.last_event_id,
+            'last_event_type': self.last_event_type,
+            'last_timestamp': self.last_timestamp.strftime('%Y-%m-%d %H:%M:%S') if self.last_timestamp else None,
+            'endpoint': self.endpoint,
+            'hostname': self.hostname,
+            'username': self.username,
+            'content_hash': self.content_hash,
+            'classification': self.classification
+        }
+
+
+def record_file_state(event):
+    """Upsert the file_state row for an event's endpoint and path in the caller's session"""
+    state = FileState.query.filter_by(endpoint=event.endpoint, file_path=event.file_path).first()
+    if state is None:
+        classification = FileClassification.query.filter_by(file_path=event.file_path).first()
+        state = FileState(
+            file_path=event.file_path,
+            endpoint=event.endpoint,
+            classification=classification.classification if classification else None
+        )
+        db.session.add(state)
+    state.last_event_id = event.id
+    state.last_event_type = event.event_type
+    state.last_timestamp = event.timestamp
+    state.endpoint = event.endpoint
+    state.hostname = event.hostname
+    state.username = event.username
+    state.content_hash = event.hash_after
+    return state
+
+
+def set_file_state_classification(file_path, classification):
+    """Mirror a classification change into the path's file_state rows (all endpoints) in the caller's session"""
+    FileState.query.filter_by(file_path=file_path).update(
+        {FileState.classification: classification}, synchronize_session=False
+    )
+
+
+class EventRollupHourly(db.Model):
+    """Event counts per hour, endpoint and type; outlives the event partitions"""
+    __tablename__ = 'event_rollup_hourly'
+    
+    bucket = db.Column(db.DateTime, primary_key=True)
+    endpoint = db.Column(db.String(255), primary_key=True)
+    event_type = db.Column(db.String(50), primary_key=True)
+    event_count = db.Column(db.Integer, nullable=False, default=0)
+    
+    def to_dict(self):
+        return {
+            'bucket': self.bucket.strftime('%Y-%m-%d %H:%M:%S'),
+            'endpoint': self.endpoint,
+            'event_type': self.event_type,
+            'event_count': self.event_count
+        }
+
+
+class EventRollupDaily(db.Model):
+    """Event counts per day, endpoint and type; outlives the event partitions"""
+    __tablename__ = 'event_rollup_daily'
+    
+    bucket = db.Column(db.DateTime, primary_key=True)
+    endpoint = db.Column(db.String(255), primary_key=True)
+    event_type = db.Column(db.String(50), primary_key=True)
+    event_count = db.Column(db.Integer, nullable=False, default=0)
+    
+    def to_dict(self):
+        return {
+            'bucket': self.bucket.strftime('%Y-%m-%d %H:%M:%S'),
+            'endpoint': self.endpoint,
+            'event_type': self.event_type,
+            'event_count': self.event_count
+        }
+
+
+def record_rollups(events):
+    """Add events to the hourly and daily rollups in the caller's session"""
+    for model, truncate in (
+        (EventRollupHourly, lambda ts: ts.replace(minute=0, second=0, microsecond=0)),
+        (EventRollupDaily, lambda ts: ts.replace(hour=0, minute=0, second=0, microsecond=0)),
+    ):
+        counts = {}
+        for event in events:
+            key = (truncate(event.timestamp), event.endpoint, event.event_type)
+            counts[key] = counts.get(key, 0) + 1
+        
+        table = model.__table__
+        insert = _dialect_insert(table)
+        statement = insert.on_conflict_do_update(
+            index_elements=[table.c.bucket, table.c.endpoint, table.c.event_type],
+            set_={'event_count': table.c.event_count + insert.excluded.event_count}
+        )
+        db.session.execute(statement, [
+            {'bucket': bucket, 'endpoint': endpoint, 'event_type': event_type, 'event_count': count}
+            for (bucket, endpoint, event_type), count in sorted(counts.items())
+        ])
+
+
+BULK_CHUNK_SIZE = 1000
+
+
+def _dialect_insert(table):
+    """INSERT construct supporting ON CONFLICT for the configured backend"""
+    if db.engine.dialect.name == 'sqlite':
+        from sqlalchemy.dialects.sqlite import insert
+    else:
+        from sqlalchemy.dialects.postgresql import insert
+    return insert(table)
+
+
+def bulk_save_classifications(entries, valid_levels):
+    """Upsert and clear many classifications in the caller's transaction.
+
+    Each entry is a dict with file_path and classification (empty to clear),
+    plus optional endpoint/hostname/username. Work is done with one
+    INSERT ... ON CONFLICT (file_path) DO UPDATE executemany and chunked
+    DELETE ... IN statements instead of per-row round trips. Returns one outcome per entry, in order.
+    """
+    results = [None] * len(entries)
+    latest = {}
+    for position, entry in enumerate(entries):
+        file_path = entry.get("file_path") if isinstance(entry, dict) else None
+        if not file_path or not isinstance(file_path, str):
+            results[position] = {"file_path": file_path, "status": "invalid", "message": "Missing file_path"}
+            continue
+        classification = entry.get("classification") or ""
+        if not isinstance(classification, str):
+            results[position] = {"file_path": file_path, "status": "invalid",
+                                 "message": "Classification must be a string"}
+            continue
+        classification = classification.strip()
+        if classification and classification not in valid_levels:
+            results[position] = {"file_path": file_path, "status": "invalid",
+                                 "message": f"Unknown classification: {classification}"}
+            continue
+        if file_path in latest:
+            results[latest[file_path]] = {"file_path": file_path, "status": "skipped",
+                                          "message": "Superseded by a later entry"}
+        latest[file_path] = position
+    
+    now = datetime.utcnow()
+    upserts, clears, by_level = [], [], {}
+    for file_path, position in latest.items():
+        entry = entries[position]
+        classification = (entry.get("classification") or "").strip()
+        if classification:
+            upserts.append({
+                "file_path": file_path,
+                "classification": classification,
+                "last_updated_timestamp": now,
+                "endpoint": entry.get("endpoint"),
+                "hostname": entry.get("hostname"),
+                "username": entry.get("username"),
+            })
+            results[position] = {"file_path": file_path, "status": "saved", "classification": classification}
+        else:
+            clears.append(file_path)
+            results[position] = {"file_path": file_path, "status": "cleared"}
+        by_level.setdefault(classification or None, []).append(file_path)
+    
+    if upserts:
+        # One compiled statement run as executemany; SQLAlchemy batches the
+        # rows into multi-row VALUES on PostgreSQL
+        stmt = _dialect_insert(FileClassification.__table__)
+        stmt = stmt.on_conflict_do_update(
+            index_elements=[FileClassification.file_path],
+            set_={
+                "classification": stmt.excluded.classification,
+                "last_updated_timestamp": stmt.excluded.last_updated_timestamp,
+                "endpoint": stmt.excluded.endpoint,
+                "hostname": stmt.excluded.hostname,
+                "username": stmt.excluded.username,
+            }
+        )
+        db.session.execute(stmt, upserts)
+    
+    for start in range(0, len(clears), BULK_CHUNK_SIZE):
+        FileClassification.query.filter(
+            FileClassification.file_path.in_(clears[start:start + BULK_CHUNK_SIZE])
+        ).delete(synchronize_session=False)
+    
+    # Mirror into file_state with one UPDATE per level rather than per file
+    for level, paths in by_level.items():
+        for start in range(0, len(paths), BULK_CHUNK_SIZE):
+            FileState.query.filter(FileState.file_path.in_(paths[start:start + BULK_CHUNK_SIZE])).update(
+                {FileState.classification: level}, synchronize_session=False
+            )
+    
+    return results
+
+
 class HashBaseline(db.Model):
-    """Baseline hashes for file integrity comparison"""
+    """Baseline hashes for file integrity comparison, per endpoint and path"""
     __tablename__ = 'hash_baseline'
     
     id = db.Column(db.Integer, primary_key=True)
-    file_path = db.Column(db.Text, nullable=False, unique=True, index=True)
-    content_hash = db.Column(db.String(128), nullable=False)
-    state_hash = db.Column(db.String(128))
+    endpoint = db.Column(db.String(255), nullable=False)
+    file_path = db.Column(db.Text, nullable=False, index=True)
+    # Indexed for reverse lookups of where some content currently lives
+    content_hash = db.Column(HexDigest, nullable=False, index=True)
+    state_hash = db.Column(HexDigest)
     file_size = db.Column(db.BigInteger)
-    metadata_json = db.Column(db.Text)
+    file_mtime = db.Column(db.DateTime)
+    file_ctime = db.Column(db.DateTime)
+    file_mode = db.Column(db.Integer)
+    file_readonly = db.Column(db.Boolean)
     last_updated = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
     
+    __table_args__ = (
+        db.Index('ix_hash_baseline_endpoint_path', 'endpoint', 'file_path', unique=True),
+    )
+    
     def to_dict(self):
         return {
             'id': self.id,
+            'endpoint': self.endpoint,
             'file_path': self.file_path,
             'content_hash': self.content_hash,
             'state_hash': self.state_hash,
@@ -87,6 +508,86 @@ class HashBaseline(db.Model):
         }
 
 
+def lookup_content_hashes(hashes, since=None, until=None, max_occurrences=HASH_LOOKUP_MAX_OCCURRENCES):
+    """Where each content hash has appeared, and which files hold it now.
+
+    Occurrences are the events whose hash_after matched, grouped by path,
+    endpoint and host with first/last seen times and an event count, most
+    recently seen first and capped at max_occurrences per hash. Current
+    holders come from hash_baseline, with endpoint and host from file_state.
+    Both are index lookups on the binary digest, done BULK_CHUNK_SIZE hashes
+    at a time. Returns {hash: {"occurrences", "truncated", "current_holders"}}.
+    """
+    results = {h: {"occurrences": [], "truncated": False, "current_holders": []} for h in hashes}
+    hashes = list(results)
+    for start in range(0, len(hashes), BULK_CHUNK_SIZE):
+        chunk = hashes[start:start + BULK_CHUNK_SIZE]
+        
+        grouped = db.select(
+            Event.hash_after, Event.path_id, Event.endpoint_id, Event.host_id,
+            db.func.min(Event.timestamp).label('first_seen'),
+            db.func.max(Event.timestamp).label('last_seen'),
+            db.func.count().label('event_count'),
+        ).where(Event.hash_after.in_(chunk))
+        if since:
+            grouped = grouped.where(Event.timestamp >= since)
+        if until:
+            grouped = grouped.where(Event.timestamp < until)
+        grouped = grouped.group_by(Event.hash_after, Event.path_id, Event.endpoint_id, Event.host_id).subquery()
+        ranked = db.select(grouped, db.func.row_number().over(
+            partition_by=grouped.c.hash_after, order_by=grouped.c.last_seen.desc()
+        ).label('rank')).subquery()
+        occurrences = db.session.execute(
+            db.select(
+                ranked.c.hash_after, FilePath.path, Endpoint.name, Host.hostname,
+                ranked.c.first_seen, ranked.c.last_seen, ranked.c.event_count,
+            )
+            .join(FilePath, FilePath.id == ranked.c.path_id)
+            .join(Endpoint, Endpoint.id == ranked.c.endpoint_id)
+            .join(Host, Host.id == ranked.c.host_id)
+            .where(ranked.c.rank <= max_occurrences + 1)
+            .order_by(ranked.c.hash_after, ranked.c.rank)
+        )
+        for content_hash, path, endpoint, hostname, first_seen, last_seen, count in occurrences:
+            result = results[content_hash]
+            if len(result["occurrences"]) == max_occurrences:
+                result["truncated"] = True
+                continue
+            result["occurrences"].append({
+                'file_path': path,
+                'endpoint': endpoint,
+                'hostname': hostname,
+                'first_seen': first_seen.strftime('%Y-%m-%d %H:%M:%S'),
+                'last_seen': last_seen.strftime('%Y-%m-%d %H:%M:%S'),
+                'event_count': count,
+            })
+        
+        holders = db.session.execute(
+            db.select(
+                HashBaseline.content_hash, HashBaseline.file_path, HashBaseline.last_updated,
+                HashBaseline.endpoint, FileState.hostname,
+            )
+            .outerjoin(FileState, db.and_(FileState.endpoint == HashBaseline.endpoint,
+                                          FileState.file_path == HashBaseline.file_path))
+            .where(HashBaseline.content_hash.in_(chunk))
+            .order_by(HashBaseline.file_path, HashBaseline.endpoint)
+        )
+        for content_hash, path, last_updated, endpoint, hostname in holders:
+            results[content_hash]["current_holders"].append({
+                'file_path': path,
+                'endpoint': endpoint,
+                'hostname': hostname,
+                'last_updated': last_updated.strftime('%Y-%m-%d %H:%M:%S') if last_updated else None,
+            })
+    return results
+
+
+BASELINE_EXPORT_COLUMNS = [
+    'id', 'endpoint', 'file_path', 'content_hash', 'state_hash', 'file_size',
+    'file_mtime', 'file_ctime', 'file_mode', 'file_readonly', 'last_updated',
+]
+
+
 class AlertConfig(db.Model):
     """Configuration for webhook alerts (n8n, Telegram, etc.)"""
     __tablename__ = 'alert_config'
@@ -119,12 +620,230 @@ class AlertHistory(db.Model):
     __tablename__ = 'alert_history'
     
     id = db.Column(db.Integer, primary_key=True)
-    event_id = db.Column(db.Integer, db.ForeignKey('events.id'), nullable=False)
+    event_id = db.Column(db.Integer, nullable=False)
     alert_config_id = db.Column(db.Integer, db.ForeignKey('alert_config.id'), nullable=False)
     sent_at = db.Column(db.DateTime, default=datetime.utcnow)
     status = db.Column(db.String(50), default='sent')
     response_code = db.Column(db.Integer)
     error_message = db.Column(db.Text)
     
-    event = db.relationship('Event', backref='alerts')
+    event = db.relationship('Event', primaryjoin='foreign(AlertHistory.event_id) == Event.id',
+                            backref='alerts', viewonly=True)
     alert_config = db.relationship('AlertConfig', backref='history')
+
+
+class IngestBatch(db.Model):
+    """Batches received on /api/ingest, keyed by the agent's idempotency key.
+
+    The row is written in the same transaction as the batch's events, so a
+    batch an agent sends again (after a lost response) gets the original ack
+    instead of being applied twice.
+    """
+    __tablename__ = 'ingest_batches'
+
+    agent_id = db.Column(db.String(255), primary_key=True)
+    batch_id = db.Column(db.String(64), primary_key=True)
+    received_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+    event_count = db.Column(db.Integer, nullable=False)
+    inserted_count = db.Column(db.Integer, nullable=False, default=0)
+    # JSON list of {"index", "message"} for events that failed validation
+    rejected = db.Column(db.Text)
+
+    def to_ack(self, status):
+        rejected = json.loads(self.rejected) if self.rejected else []
+        return {
+            'batch_id': self.batch_id,
+            'status': status,
+            'received': self.event_count,
+            'inserted': self.inserted_count,
+            'skipped': self.event_count - self.inserted_count - len(rejected),
+            'rejected': rejected
+        }
+
+
+def _normalize_event_dimensions(conn):
+    """Move the path, endpoint and hostname strings of existing events into the dimension tables"""
+    print("[DB] Moving event paths, endpoints and hostnames into dimension tables")
+    for table, column, source in (('paths', 'path', 'file_path'), ('endpoints', 'name', 'endpoint'),
+                                  ('hosts', 'hostname', 'hostname')):
+        conn.execute(text(
+            f"INSERT INTO {table} ({column}) SELECT DISTINCT {source} FROM events ON CONFLICT DO NOTHING"
+        ))
+    conn.execute(text(
+        "ALTER TABLE events ADD COLUMN path_id INTEGER, ADD COLUMN endpoint_id INTEGER, ADD COLUMN host_id INTEGER"
+    ))
+    conn.execute(text("""
+        UPDATE events e SET path_id = p.id, endpoint_id = en.id, host_id = h.id
+        FROM paths p, endpoints en, hosts h
+        WHERE p.path = e.file_path AND en.name = e.endpoint AND h.hostname = e.hostname
+    """))
+    # Dropping the text columns also drops the indexes built on them
+    conn.execute(text("""
+        ALTER TABLE events
+            ALTER COLUMN path_id SET NOT NULL,
+            ALTER COLUMN endpoint_id SET NOT NULL,
+            ALTER COLUMN host_id SET NOT NULL,
+            ADD FOREIGN KEY (path_id) REFERENCES paths (id),
+            ADD FOREIGN KEY (endpoint_id) REFERENCES endpoints (id),
+            ADD FOREIGN KEY (host_id) REFERENCES hosts (id),
+            DROP COLUMN file_path,
+            DROP COLUMN endpoint,
+            DROP COLUMN hostname
+    """))
+
+
+# Hex that does not decode (never written by the hasher) becomes NULL
+HEX_TO_BYTEA_SQL = "CASE WHEN {column} ~ '^([0-9a-fA-F]{{2}})+$' THEN decode({column}, 'hex') END"
+
+
+def _convert_digests(conn, table, columns):
+    """Change hex digest columns of a table to BYTEA"""
+    conn.execute(text(f"ALTER TABLE {table} " + ", ".join(
+        f"ALTER COLUMN {column} TYPE bytea USING " + HEX_TO_BYTEA_SQL.format(column=column)
+        for column in columns
+    )))
+
+
+def _split_file_metadata(conn, table):
+    """Replace the metadata_json column of a table with typed file metadata columns"""
+    conn.execute(text(f"""
+        ALTER TABLE {table}
+            ADD COLUMN file_mtime TIMESTAMP,
+            ADD COLUMN file_ctime TIMESTAMP,
+            ADD COLUMN file_mode INTEGER,
+            ADD COLUMN file_readonly BOOLEAN
+    """))
+    conn.execute(text(f"""
+        UPDATE {table} SET
+            file_mtime = to_timestamp((metadata_json::json ->> 'mtime')::float8) AT TIME ZONE 'UTC',
+            file_ctime = to_timestamp((metadata_json::json ->> 'ctime')::float8) AT TIME ZONE 'UTC',
+            file_mode = (metadata_json::json ->> 'mode')::integer,
+            file_readonly = (metadata_json::json ->> 'readonly')::boolean
+        WHERE metadata_json IS NOT NULL
+    """))
+    conn.execute(text(f"ALTER TABLE {table} DROP COLUMN metadata_json"))
+
+
+def _migrate_event_digests(conn):
+    """Store event digests as bytes, drop the duplicate content_hash and split metadata_json"""
+    print("[DB] Converting event digests to binary and splitting file metadata")
+    # Recreated below with the new column types
+    conn.execute(text("DROP VIEW IF EXISTS events_view"))
+    # Hex prefix indexes (text_pattern_ops) cannot be carried over to BYTEA
+    conn.execute(text("DROP INDEX IF EXISTS ix_events_hash_after_pattern, ix_events_hash_before_pattern"))
+    for (index_name,) in conn.execute(text(
+        "SELECT indexname FROM pg_indexes WHERE schemaname = current_schema() "
+        "AND indexdef LIKE '%hash_%text_pattern_ops%'"
+    )).all():
+        conn.execute(text(f'DROP INDEX IF EXISTS "{index_name}"'))
+    _split_file_metadata(conn, "events")
+    conn.execute(text("ALTER TABLE events DROP COLUMN content_hash"))
+    _convert_digests(conn, "events", ["hash_before", "hash_after", "state_hash"])
+
+
+def _migrate_baseline_digests(conn):
+    """Store baseline and file_state digests as bytes and split the baseline metadata_json"""
+    print("[DB] Converting baseline digests to binary and splitting file metadata")
+    # content_hash is NOT NULL; a baseline that cannot be decoded is rebuilt on the next change
+    conn.execute(text("DELETE FROM hash_baseline WHERE content_hash !~ '^([0-9a-fA-F]{2})+$'"))
+    _split_file_metadata(conn, "hash_baseline")
+    _convert_digests(conn, "hash_baseline", ["content_hash", "state_hash"])
+    _convert_digests(conn, "file_state", ["content_hash"])
+
+
+def _scope_state_to_endpoints(conn):
+    """Key hash_baseline and file_state by (endpoint, file_path) instead of file_path alone"""
+    print("[DB] Keying baselines and file state by endpoint and path")
+    # Until now each path had one row, so its file_state row names the endpoint
+    conn.execute(text("ALTER TABLE hash_baseline ADD COLUMN endpoint VARCHAR(255)"))
+    conn.execute(text("""
+        UPDATE hash_baseline b SET endpoint = s.endpoint
+        FROM file_state s WHERE s.file_path = b.file_path
+    """))
+    conn.execute(text("UPDATE hash_baseline SET endpoint = :endpoint WHERE endpoint IS NULL"),
+                 {"endpoint": ENDPOINT_NAME})
+    conn.execute(text("ALTER TABLE hash_baseline ALTER COLUMN endpoint SET NOT NULL"))
+    # Recreated by upgrade_schema from the model definitions (no longer unique on the path)
+    conn.execute(text(
+        "DROP INDEX IF EXISTS ix_hash_baseline_file_path, ix_file_state_file_path, "
+        "ix_file_state_endpoint_path, ix_file_state_ts_path, ix_file_state_class_path"
+    ))
+
+
+def upgrade_schema():
+    """Add columns introduced after a table was first created (create_all only creates missing tables)"""
+    inspector = inspect(db.engine)
+    event_columns = {c["name"] for c in inspector.get_columns("events")}
+    event_indexes = {i["name"]: i["column_names"] for i in inspector.get_indexes("events")}
+    baseline_columns = {c["name"] for c in inspector.get_columns("hash_baseline")}
+    with db.engine.begin() as conn:
+        if "event_uid" not in event_columns:
+            conn.execute(text("ALTER TABLE events ADD COLUMN event_uid VARCHAR(32)"))
+            # As in the model: a unique index on a partitioned table must include timestamp
+            conn.execute(text(
+                "CREATE UNIQUE INDEX IF NOT EXISTS ix_events_event_uid ON events (event_uid, timestamp)"
+            ))
+        elif event_indexes.get("ix_events_event_uid") == ["event_uid"]:
+            # Created on event_uid alone by an earlier version; recreated below from the model
+            conn.execute(text("DROP INDEX ix_events_event_uid"))
+        
+        if "path_id" not in event_columns:
+            _normalize_event_dimensions(conn)
+        
+        if "content_hash" in event_columns:
+            _migrate_event_digests(conn)
+        if "metadata_json" in baseline_columns:
+            _migrate_baseline_digests(conn)
+        if "endpoint" not in baseline_columns:
+            _scope_state_to_endpoints(conn)
+        
+        if db.engine.dialect.name == "postgresql" and not partitions.is_partitioned(conn):
+            partitions.convert_to_partitioned(conn, Event.__table__)
+        
+        for model in (Event, FileState, FilePath, HashBaseline):
+            for index in model.__table__.indexes:
+                conn.execute(CreateIndex(index, if_not_exists=True))
+        
+        if db.engine.dialect.name == "postgresql":
+            try:
+                with conn.begin_nested():
+                    conn.execute(text("CREATE EXTENSION IF NOT EXISTS pg_trgm"))
+                    for table, column in TRIGRAM_SEARCH_COLUMNS:
+                        conn.execute(text(
+                            f"CREATE INDEX IF NOT EXISTS ix_{table}_{column}_trgm ON {table} "
+                            f"USING gin ({column} gin_trgm_ops)"
+                        ))
+            except Exception as e:
+                print(f"[DB] pg_trgm unavailable, free-text search will scan events: {e}")
+        
+        # Events in their pre-normalization shape, for SQL consumers and the backfills below
+        view_sql = event_view_select().compile(conn, compile_kwargs={"literal_binds": True})
+        conn.execute(text(f"CREATE OR REPLACE VIEW events_view AS {view_sql}"))
+        
+        # One-time backfill of file_state from event history
+        if conn.execute(text("SELECT 1 FROM file_state LIMIT 1")).first() is None:
+            conn.execute(text("""
+                INSERT INTO file_state (
+                    file_path, last_event_id, last_event_type, last_timestamp,
+                    endpoint, hostname, username, content_hash, classification
+                )
+                SELECT e.file_path, e.id, e.event_type, e.timestamp,
+                       e.endpoint, e.hostname, e.username, e.hash_after, fc.classification
+                FROM events_view e
+                JOIN (
+                    SELECT MAX(id) AS max_id FROM events GROUP BY endpoint_id, path_id
+                ) latest ON latest.max_id = e.id
+                LEFT JOIN file_classification fc ON fc.file_path = e.file_path
+            """))
+        
+        # One-time backfill of the rollups from event history
+        if db.engine.dialect.name == "postgresql" and \
+                conn.execute(text("SELECT 1 FROM event_rollup_daily LIMIT 1")).first() is None:
+            for table, unit in (("event_rollup_hourly", "hour"), ("event_rollup_daily", "day")):
+                conn.execute(text(f"""
+                    INSERT INTO {table} (bucket, endpoint, event_type, event_count)
+                    SELECT date_trunc('{unit}', timestamp), endpoint, event_type, COUNT(*)
+                    FROM events_view GROUP BY 1, 2, 3
+                """))
+        
+        partitions.maintain_partitions(conn)
@@ -0,0 +1,64 @@
+"""Opaque cursors and page-size limits for keyset-paginated endpoints
+
+group004/fim/pagination.py is a separate copy of the cursor and page-size
+helpers for the SQLite app.
+"""
+import base64
+import json
+from datetime import datetime, timezone
+from typing import Any, List, Optional
+
+DEFAULT_PAGE_SIZE = 100
+MAX_PAGE_SIZE = 500
+
+
+def encode_cursor(values: List[Any]) -> str:
+    """Encode the sort key of the last row returned as an opaque cursor"""
+    raw = json.dumps(values, separators=(",", ":"), default=str).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip("=")
+
+
+def decode_cursor(cursor: Optional[str]) -> Optional[List[Any]]:
+    """Decode a cursor from encode_cursor; raises ValueError if it is malformed"""
+    if not cursor:
+        return None
+    try:
+        raw = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4))
+        values = json.loads(raw)
+    except (ValueError, TypeError) as e:
+        raise ValueError("Invalid cursor") from e
+    if not isinstance(values, list):
+        raise ValueError("Invalid cursor")
+    return values
+
+
+def clamp_page_size(limit: Optional[int], default: int = DEFAULT_PAGE_SIZE,
+                    maximum: int = MAX_PAGE_SIZE) -> int:
+    """Page size from a request argument, bounded to 1..maximum"""
+    if not limit or limit < 1:
+        return default
+    return min(limit, maximum)
+
+
+def parse_timestamp(value: Optional[str]) -> Optional[datetime]:
+    """Parse an ISO-8601 or epoch-seconds argument into a naive UTC datetime"""
+    if not value:
+        return None
+    try:
+        parsed = datetime.fromtimestamp(float(value), tz=timezone.utc)
+    except (OverflowError, OSError) as e:
+        # Epoch seconds outside the datetime range (1e20, inf)
+        raise ValueError(f"Invalid timestamp: {value}") from e
+    except ValueError:
+        try:
+            parsed = datetime.fromisoformat(value.replace("Z", "+00:00"))
+        except ValueError as e:
+            raise ValueError(f"Invalid timestamp: {value}") from e
+    if parsed.tzinfo is not None:
+        parsed = parsed.astimezone(timezone.utc).replace(tzinfo=None)
+    return parsed
+
+
+def like_prefix(prefix: str) -> str:
+    """LIKE pattern matching strings that start with prefix (escape character is a backslash)"""
+    return prefix.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_") + "%"
@@ -0,0 +1,195 @@
+"""Time-based partitioning of the events table with a retention policy (PostgreSQL)"""
+import re
+import threading
+from datetime import datetime, timedelta
+from typing import List, Optional, Tuple
+
+from sqlalchemy import text
+
+from app import db
+from config import (
+    EVENT_PARTITION_PERIOD, EVENT_PARTITIONS_AHEAD, EVENT_RETENTION_DAYS, EVENT_RETENTION_MODE,
+)
+
+DEFAULT_PARTITION = "events_default"
+LEGACY_PARTITION = "events_legacy"
+MAINTENANCE_LOCK_TIMEOUT = "5s"
+BOUND_RE = re.compile(r"FROM \((MINVALUE|'[^']+')\) TO \((MAXVALUE|'[^']+')\)")
+
+_checked_periods = set()
+_maintenance_lock = threading.Lock()
+
+
+def period_start(ts: datetime, period: str = None) -> datetime:
+    """Start of the partition period containing ts"""
+    period = period or EVENT_PARTITION_PERIOD
+    start = ts.replace(hour=0, minute=0, second=0, microsecond=0)
+    return start if period == "day" else start.replace(day=1)
+
+
+def next_period(start: datetime, period: str = None) -> datetime:
+    period = period or EVENT_PARTITION_PERIOD
+    if period == "day":
+        return start + timedelta(days=1)
+    return (start.replace(day=28) + timedelta(days=4)).replace(day=1)
+
+
+def partition_name(start: datetime, period: str = None) -> str:
+    period = period or EVENT_PARTITION_PERIOD
+    return f"events_p{start:%Y%m%d}" if period == "day" else f"events_p{start:%Y%m}"
+
+
+def _literal(ts: datetime) -> str:
+    return f"'{ts:%Y-%m-%d %H:%M:%S}'"
+
+
+def _bound(value: str) -> Optional[datetime]:
+    return None if value in ("MINVALUE", "MAXVALUE") else datetime.fromisoformat(value.strip("'"))
+
+
+def is_partitioned(conn) -> bool:
+    relkind = conn.execute(text(
+        "SELECT c.relkind FROM pg_class c JOIN pg_namespace n ON n.oid = c.relnamespace "
+        "WHERE c.relname = 'events' AND n.nspname = current_schema()"
+    )).scalar()
+    return relkind == "p"
+
+
+def list_partitions(conn) -> List[Tuple[str, Optional[datetime], Optional[datetime]]]:
+    """(name, lower, upper) for every range partition; None is an open bound"""
+    rows = conn.execute(text(
+        "SELECT c.relname, pg_get_expr(c.relpartbound, c.oid) FROM pg_inherits i "
+        "JOIN pg_class c ON c.oid = i.inhrelid WHERE i.inhparent = 'events'::regclass"
+    )).all()
+    partitions = []
+    for name, bound in rows:
+        match = BOUND_RE.search(bound or "")
+        if match:
+            partitions.append((name, _bound(match.group(1)), _bound(match.group(2))))
+    return sorted(partitions, key=lambda p: p[1] or datetime.min)
+
+
+def convert_to_partitioned(conn, event_table) -> None:
+    """Replace an unpartitioned events table with a partitioned one.
+
+    The old table is attached unchanged as the events_legacy partition
+    covering everything up to the end of its newest event's period, so no
+    rows are copied; it is dropped by the retention policy like any other
+    partition.
+    """
+    print("[DB] Converting events to a partitioned table")
+    # Foreign keys into events cannot survive partitions being dropped
+    for table, name in conn.execute(text(
+        "SELECT conrelid::regclass::text, conname FROM pg_constraint "
+        "WHERE confrelid = 'events'::regclass AND contype = 'f'"
+    )).all():
+        conn.execute(text(f'ALTER TABLE {table} DROP CONSTRAINT "{name}"'))
+
+    conn.execute(text(f"ALTER TABLE events RENAME TO {LEGACY_PARTITION}"))
+    for (index_name,) in conn.execute(text(
+        "SELECT indexname FROM pg_indexes WHERE schemaname = current_schema() AND tablename = :table"
+    ), {"table": LEGACY_PARTITION}).all():
+        conn.execute(text(f'ALTER INDEX "{index_name}" RENAME TO "{index_name[:55]}_legacy"'))
+
+    event_table.create(conn)
+    max_id, max_ts = conn.execute(text(f"SELECT MAX(id), MAX(timestamp) FROM {LEGACY_PARTITION}")).one()
+    conn.execute(text(
+        "SELECT setval(pg_get_serial_sequence('events', 'id'), :next_id, false)"
+    ), {"next_id": (max_id or 0) + 1})
+
+    if max_ts is None:
+        conn.execute(text(f"DROP TABLE {LEGACY_PARTITION}"))
+        return
+    # The partitioned primary key (id, timestamp) replaces the old one on attach
+    for (name,) in conn.execute(text(
+        "SELECT conname FROM pg_constraint WHERE conrelid = CAST(:table AS regclass) AND contype = 'p'"
+    ), {"table": LEGACY_PARTITION}).all():
+        conn.execute(text(f'ALTER TABLE {LEGACY_PARTITION} DROP CONSTRAINT "{name}"'))
+    upper = next_period(period_start(max_ts))
+    conn.execute(text(
+        f"ALTER TABLE events ATTACH PARTITION {LEGACY_PARTITION} FOR VALUES FROM (MINVALUE) TO ({_literal(upper)})"
+    ))
+
+
+def create_partition(conn, start: datetime, end: datetime, name: str) -> None:
+    """Create and attach a partition, moving any rows for its range out of the default partition"""
+    conn.execute(text(f"CREATE TABLE {name} (LIKE events INCLUDING DEFAULTS INCLUDING CONSTRAINTS)"))
+    conn.execute(text(
+        f"WITH moved AS (DELETE FROM {DEFAULT_PARTITION} WHERE timestamp >= :start AND timestamp < :end "
+        f"RETURNING *) INSERT INTO {name} SELECT * FROM moved"
+    ), {"start": start, "end": end})
+    conn.execute(text(
+        f"ALTER TABLE events ATTACH PARTITION {name} FOR VALUES FROM ({_literal(start)}) TO ({_literal(end)})"
+    ))
+    print(f"[DB] Created event partition {name}")
+
+
+def ensure_partitions(conn, now: datetime) -> None:
+    """Make sure the current and the next EVENT_PARTITIONS_AHEAD periods have partitions"""
+    conn.execute(text(f"CREATE TABLE IF NOT EXISTS {DEFAULT_PARTITION} PARTITION OF events DEFAULT"))
+    existing = list_partitions(conn)
+    start = period_start(now)
+    for _ in range(EVENT_PARTITIONS_AHEAD + 1):
+        end = next_period(start)
+        overlaps = any(
+            (lower is None or lower < end) and (upper is None or upper > start)
+            for _, lower, upper in existing
+        )
+        if not overlaps:
+            create_partition(conn, start, end, partition_name(start))
+        start = end
+
+
+def apply_retention(conn, now: datetime) -> None:
+    """Drop (or detach) partitions entirely older than EVENT_RETENTION_DAYS"""
+    if EVENT_RETENTION_DAYS <= 0:
+        return
+    cutoff = now - timedelta(days=EVENT_RETENTION_DAYS)
+    for name, _, upper in list_partitions(conn):
+        if upper is None or upper > cutoff:
+            continue
+        if EVENT_RETENTION_MODE == "detach":
+            conn.execute(text(f"ALTER TABLE events DETACH PARTITION {name}"))
+            print(f"[DB] Detached event partition {name}")
+        else:
+            conn.execute(text(f"DROP TABLE {name}"))
+            print(f"[DB] Dropped event partition {name}")
+    # Stragglers in the default partition are few, a plain DELETE is fine
+    conn.execute(text(f"DELETE FROM {DEFAULT_PARTITION} WHERE timestamp < :cutoff"), {"cutoff": cutoff})
+
+
+def maintain_partitions(conn=None, now: datetime = None) -> bool:
+    """Create upcoming partitions and apply the retention policy.
+
+    Without a connection this runs in its own transaction with a lock
+    timeout, so long-running readers postpone maintenance instead of
+    blocking event inserts behind it. Returns whether it completed.
+    """
+    if db.engine.dialect.name != "postgresql":
+        return True
+    now = now or datetime.utcnow()
+    with _maintenance_lock:
+        if conn is not None:
+            ensure_partitions(conn, now)
+            apply_retention(conn, now)
+        else:
+            try:
+                with db.engine.begin() as own_conn:
+                    own_conn.execute(text(f"SET LOCAL lock_timeout = '{MAINTENANCE_LOCK_TIMEOUT}'"))
+                    ensure_partitions(own_conn, now)
+                    apply_retention(own_conn, now)
+            except Exception as e:
+                print(f"[DB] Partition maintenance postponed: {e}")
+                return False
+        _checked_periods.add(period_start(now))
+        return True
+
+
+def ensure_partition_for(ts: datetime) -> None:
+    """Run partition maintenance the first time an event falls in a new period.
+
+    Events are never lost if it cannot run: they land in the default partition.
+    """
+    period = period_start(ts)
+    if period not in _checked_periods and maintain_partitions():
+        _checked_periods.add(period)
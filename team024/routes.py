@@ -1,11 +1,198 @@
 """Flask routes for FIM dashboard"""
 import json
 from datetime import datetime
-from flask import render_template, request, jsonify
+from flask import render_template, request, jsonify, current_app, Response, stream_with_context
 
 from app import db
-from models import Event, FileClassification, HashBaseline, AlertConfig, AlertHistory
-from config import CLASSIFICATION_LEVELS
+from models import (
+    Event, FileClassification, FileState, HashBaseline, AlertConfig, AlertHistory,
+    set_file_state_classification, bulk_save_classifications,
+    EventRollupHourly, EventRollupDaily, FilePath, Endpoint, Host,
+    EVENT_EXPORT_COLUMNS, BASELINE_EXPORT_COLUMNS, event_view_select, digest_prefix_match,
+    lookup_content_hashes,
+)
+from config import (
+    CLASSIFICATION_LEVELS, API_EVENTS_MAX_PAGE_SIZE, EXPORT_BATCH_SIZE, HASH_LOOKUP_MAX_HASHES,
+    INGEST_TOKEN, INGEST_MAX_EVENTS, INGEST_MAX_BYTES,
+)
+from export import (
+    EXPORT_FORMATS, stream_partitions, export_chunks, json_array_chunks, gzip_chunks,
+)
+from hashing import io_budget
+from ingest import INGEST_FORMATS, decode_batch, ingest_batch
+from memory import memory_budget
+from pagination import encode_cursor, decode_cursor, clamp_page_size, parse_timestamp, like_prefix
+from search import SearchQuery, parse_search, split_glob, HEX_RE
+
+
+FILE_STATE_SORTS = {
+    "last_timestamp": FileState.last_timestamp,
+    "file_path": FileState.file_path,
+    "endpoint": FileState.endpoint,
+    "classification": db.func.coalesce(FileState.classification, ""),
+}
+
+
+def _file_state_page(args):
+    """One keyset page of file_state filtered by endpoints and path search.
+
+    Rows are ordered by the chosen sort key with (file_path, endpoint) as the
+    unique tie-breaker; the cursor carries those values of the last row returned.
+    """
+    endpoints_param = args.get("endpoints", "")
+    endpoints = [e.strip() for e in endpoints_param.split(",") if e.strip()] or None
+    search = args.get("search", "").strip()
+    sort = args.get("sort", "last_timestamp")
+    if sort not in FILE_STATE_SORTS:
+        sort = "last_timestamp"
+    order = "asc" if args.get("order") == "asc" else "desc"
+    limit = clamp_page_size(args.get("limit", type=int))
+    after = decode_cursor(args.get("cursor"))
+    
+    sort_column = FILE_STATE_SORTS[sort]
+    query = FileState.query
+    if endpoints:
+        query = query.filter(FileState.endpoint.in_(endpoints))
+    if search:
+        escaped = search.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_")
+        query = query.filter(FileState.file_path.ilike(f"%{escaped}%", escape="\\"))
+    if after:
+        if len(after) != 3 or not all(isinstance(v, str) for v in after):
+            raise ValueError("Invalid cursor")
+        value = datetime.fromisoformat(after[0]) if sort == "last_timestamp" else after[0]
+        key = db.tuple_(sort_column, FileState.file_path, FileState.endpoint)
+        last = db.tuple_(value, after[1], after[2])
+        query = query.filter(key < last if order == "desc" else key > last)
+    
+    if order == "desc":
+        query = query.order_by(sort_column.desc(), FileState.file_path.desc(), FileState.endpoint.desc())
+    else:
+        query = query.order_by(sort_column.asc(), FileState.file_path.asc(), FileState.endpoint.asc())
+    
+    states = query.limit(limit + 1).all()
+    next_cursor = None
+    if len(states) > limit:
+        states = states[:limit]
+        last = states[-1]
+        last_value = {
+            "last_timestamp": last.last_timestamp.isoformat(),
+            "file_path": last.file_path,
+            "endpoint": last.endpoint,
+            "classification": last.classification or "",
+        }[sort]
+        next_cursor = encode_cursor([last_value, last.file_path, last.endpoint])
+    
+    return {
+        "files": [state.to_dict() for state in states],
+        "next_cursor": next_cursor,
+        "endpoints": endpoints,
+        "search": search,
+        "sort": sort,
+        "order": order,
+    }
+
+
+def _dimension_ids(model, condition):
+    """Subquery of the ids of the dimension rows matching condition"""
+    return db.select(model.id).where(condition)
+
+
+def _filter_events(query, args):
+    """Apply the type/endpoint/path_prefix/since/until filters to an events query or select"""
+    since = parse_timestamp(args.get("since"))
+    until = parse_timestamp(args.get("until"))
+    event_type = args.get("type")
+    endpoint = args.get("endpoint")
+    path_prefix = args.get("path_prefix")
+    
+    if event_type and event_type != "all":
+        query = query.filter(Event.event_type == event_type)
+    if endpoint:
+        query = query.filter(Event.endpoint_id.in_(_dimension_ids(Endpoint, Endpoint.name == endpoint)))
+    if path_prefix:
+        query = query.filter(Event.path_id.in_(
+            _dimension_ids(FilePath, FilePath.path.like(like_prefix(path_prefix), escape="\\"))
+        ))
+    if since:
+        query = query.filter(Event.timestamp >= since)
+    if until:
+        query = query.filter(Event.timestamp < until)
+    return query
+
+
+# Free-text match per column. Dimension values are matched in their own
+# (trigram-indexed) tables and joined back to events by id.
+SEARCH_COLUMNS = {
+    "event_type": lambda pattern: Event.event_type.ilike(pattern, escape="\\"),
+    "file_path": lambda pattern: Event.path_id.in_(
+        _dimension_ids(FilePath, FilePath.path.ilike(pattern, escape="\\"))),
+    "endpoint": lambda pattern: Event.endpoint_id.in_(
+        _dimension_ids(Endpoint, Endpoint.name.ilike(pattern, escape="\\"))),
+    "hostname": lambda pattern: Event.host_id.in_(
+        _dimension_ids(Host, Host.hostname.ilike(pattern, escape="\\"))),
+    "username": lambda pattern: Event.username.ilike(pattern, escape="\\"),
+}
+FREE_TEXT_COLUMNS = ["file_path", "endpoint", "hostname", "username"]
+
+
+def _glob_to_like(pattern):
+    escaped = pattern.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_")
+    return escaped.replace("*", "%").replace("?", "_")
+
+
+def _search_events(query, search, columns=None):
+    """Turn a parsed SearchQuery into index-backed filters on an events query.
+
+    Field terms map to equality or prefix predicates on indexed columns; free
+    text goes to the trigram index, or to the chosen columns when the search
+    is restricted to some of them.
+    """
+    if search.types:
+        query = query.filter(Event.event_type.in_(search.types))
+    if search.hosts:
+        query = query.filter(Event.host_id.in_(_dimension_ids(Host, Host.hostname.in_(search.hosts))))
+    if search.endpoints:
+        query = query.filter(Event.endpoint_id.in_(_dimension_ids(Endpoint, Endpoint.name.in_(search.endpoints))))
+    if search.paths:
+        conditions = []
+        for pattern in search.paths:
+            prefix, glob = split_glob(pattern)
+            if glob is None:
+                conditions.append(FilePath.path == prefix)
+            else:
+                conditions.append(FilePath.path.like(_glob_to_like(glob), escape="\\"))
+        query = query.filter(Event.path_id.in_(_dimension_ids(FilePath, db.or_(*conditions))))
+    if search.hash_prefixes:
+        query = query.filter(db.or_(*[
+            digest_prefix_match(column, prefix)
+            for prefix in search.hash_prefixes for column in (Event.hash_after, Event.hash_before)
+        ]))
+    if search.since:
+        query = query.filter(Event.timestamp >= search.since)
+    if search.until:
+        query = query.filter(Event.timestamp < search.until)
+    
+    matchers = [SEARCH_COLUMNS[c] for c in columns or [] if c in SEARCH_COLUMNS]
+    matchers = matchers or [SEARCH_COLUMNS[c] for c in FREE_TEXT_COLUMNS]
+    for term in search.terms:
+        pattern = "%" + like_prefix(term)
+        query = query.filter(db.or_(*[match(pattern) for match in matchers]))
+    return query
+
+
+SHA256_HEX_LENGTH = 64
+
+
+def _content_hashes(values):
+    """Split submitted hashes into distinct lowercase SHA-256 hex digests and the rejected inputs"""
+    valid, invalid = {}, []
+    for value in values:
+        digest = value.strip().lower() if isinstance(value, str) else ""
+        if len(digest) == SHA256_HEX_LENGTH and HEX_RE.match(digest):
+            valid[digest] = None
+        else:
+            invalid.append(value)
+    return list(valid), invalid
 
 
 def register_routes(app):
@@ -32,40 +219,21 @@ def register_routes(app):
         else:
             search_columns = None
         
+        search_error = None
+        try:
+            search = parse_search(search_query)
+        except ValueError as e:
+            search_error = str(e)
+            search = SearchQuery()
+        
         query = Event.query
         
         if event_types:
             query = query.filter(Event.event_type.in_(event_types))
         
-        if search_query:
-            search_term = f"%{search_query}%"
-            if search_columns:
-                conditions = []
-                column_map = {
-                    'timestamp': Event.timestamp.cast(db.String).like(search_term),
-                    'event_type': Event.event_type.like(search_term),
-                    'file_path': Event.file_path.like(search_term),
-                    'endpoint': Event.endpoint.like(search_term),
-                    'hostname': Event.hostname.like(search_term),
-                    'username': Event.username.like(search_term),
-                }
-                for col in search_columns:
-                    if col in column_map:
-                        conditions.append(column_map[col])
-                if conditions:
-                    from sqlalchemy import or_
-                    query = query.filter(or_(*conditions))
-            else:
-                from sqlalchemy import or_
-                query = query.filter(or_(
-                    Event.file_path.like(search_term),
-                    Event.event_type.like(search_term),
-                    Event.endpoint.like(search_term),
-                    Event.hostname.like(search_term),
-                    Event.username.like(search_term)
-                ))
-        
-        events = query.order_by(Event.timestamp.desc()).limit(100).all()
+        query = _search_events(query, search, search_columns)
+        
+        events = query.order_by(Event.timestamp.desc(), Event.id.desc()).limit(100).all()
         events_data = [e.to_dict() for e in events]
         
         selected_types = event_types if event_types else ["all"]
@@ -80,128 +248,81 @@ def register_routes(app):
             selected_event_types=selected_types,
             selected_search_columns=search_columns if search_columns else ["all"],
             has_active_filters=has_active_filters,
+            search_error=search_error,
             db_connected=db_connected
         )
     
     @app.route("/classification", methods=["GET"])
     def classification():
         """Classification page for assigning security levels to files"""
-        endpoints_param = request.args.get("endpoints", "")
-        if endpoints_param:
-            selected_endpoints = [e.strip() for e in endpoints_param.split(",") if e.strip()]
-        else:
-            selected_endpoints = None
-        
-        search_query = request.args.get("search", "").strip()
-        
-        subquery = db.session.query(
-            Event.file_path,
-            db.func.max(Event.timestamp).label('max_timestamp')
-        ).group_by(Event.file_path).subquery()
-        
-        query = db.session.query(Event).join(
-            subquery,
-            db.and_(
-                Event.file_path == subquery.c.file_path,
-                Event.timestamp == subquery.c.max_timestamp
-            )
-        )
+        try:
+            page = _file_state_page(request.args)
+        except ValueError as e:
+            return jsonify({"success": False, "message": str(e)}), 400
         
-        if selected_endpoints:
-            query = query.filter(Event.endpoint.in_(selected_endpoints))
-        
-        files_events = query.order_by(Event.timestamp.desc()).all()
-        
-        files = []
-        for event in files_events:
-            if search_query and search_query.lower() not in event.file_path.lower():
-                continue
-            
-            classification_record = FileClassification.query.filter_by(
-                file_path=event.file_path
-            ).first()
-            
-            files.append({
-                'file_path': event.file_path,
-                'last_timestamp': event.timestamp.strftime('%Y-%m-%d %H:%M:%S') if event.timestamp else None,
-                'endpoint': event.endpoint,
-                'hostname': event.hostname,
-                'username': event.username,
-                'classification': classification_record.classification if classification_record else None,
-                'classification_id': classification_record.id if classification_record else None
-            })
-        
-        available_endpoints = db.session.query(Event.endpoint).distinct().all()
-        available_endpoints = [e[0] for e in available_endpoints if e[0]]
+        available_endpoints = [e.name for e in Endpoint.query.order_by(Endpoint.name).all()]
         
         return render_template(
             "classification.html",
-            files=files,
+            files=page["files"],
+            next_cursor=page["next_cursor"],
+            sort=page["sort"],
+            order=page["order"],
             available_endpoints=available_endpoints,
-            selected_endpoints=selected_endpoints if selected_endpoints else [],
-            search_query=search_query,
+            selected_endpoints=page["endpoints"] or [],
+            search_query=page["search"],
             db_connected=True
         )
     
+    @app.route("/classification/data", methods=["GET"])
+    def classification_data():
+        """JSON page of monitored files for the classification table"""
+        try:
+            page = _file_state_page(request.args)
+        except ValueError as e:
+            return jsonify({"success": False, "message": str(e)}), 400
+        return jsonify({"files": page["files"], "next_cursor": page["next_cursor"]})
+    
     @app.route("/classification/save-all", methods=["POST"])
     def classification_save_all():
-        """AJAX endpoint to save all classifications at once"""
-        files_json = request.form.get("files")
-        if not files_json:
-            return jsonify({"success": False, "message": "Missing files parameter"}), 400
-        
-        try:
-            files = json.loads(files_json)
-        except json.JSONDecodeError:
-            return jsonify({"success": False, "message": "Invalid JSON format"}), 400
+        """AJAX endpoint to save many classifications in one transaction.
+
+        Accepts a JSON body (a list, or {"files": [...]}) or the legacy
+        "files" form field, and returns an outcome for every entry.
+        """
+        if request.is_json:
+            files = request.get_json(silent=True)
+            if isinstance(files, dict):
+                files = files.get("files")
+        else:
+            files_json = request.form.get("files")
+            if not files_json:
+                return jsonify({"success": False, "message": "Missing files parameter"}), 400
+            try:
+                files = json.loads(files_json)
+            except json.JSONDecodeError:
+                return jsonify({"success": False, "message": "Invalid JSON format"}), 400
         
         if not isinstance(files, list):
             return jsonify({"success": False, "message": "Files must be a list"}), 400
         
-        saved_count = 0
-        for file_data in files:
-            file_path = file_data.get("file_path")
-            classification = file_data.get("classification", "").strip()
-            endpoint = file_data.get("endpoint")
-            hostname = file_data.get("hostname")
-            username = file_data.get("username")
-            
-            if not file_path:
-                continue
-            
-            existing = FileClassification.query.filter_by(file_path=file_path).first()
-            
-            if not classification:
-                if existing:
-                    db.session.delete(existing)
-            else:
-                if existing:
-                    existing.classification = classification
-                    existing.last_updated_timestamp = datetime.utcnow()
-                    existing.endpoint = endpoint
-                    existing.hostname = hostname
-                    existing.username = username
-                else:
-                    new_classification = FileClassification(
-                        file_path=file_path,
-                        classification=classification,
-                        endpoint=endpoint,
-                        hostname=hostname,
-                        username=username
-                    )
-                    db.session.add(new_classification)
-            
-            saved_count += 1
-        
         try:
+            results = bulk_save_classifications(files, CLASSIFICATION_LEVELS)
             db.session.commit()
-            return jsonify({
-                "success": True,
-                "message": f"Successfully saved {saved_count} classification(s)"
-            })
         except Exception as e:
             db.session.rollback()
             return jsonify({"success": False, "message": str(e)}), 500
+        
+        counts = {}
+        for result in results:
+            counts[result["status"]] = counts.get(result["status"], 0) + 1
+        saved_count = counts.get("saved", 0) + counts.get("cleared", 0)
+        return jsonify({
+            "success": True,
+            "message": f"Successfully saved {saved_count} classification(s)",
+            "counts": counts,
+            "results": results
+        })
     
     @app.route("/classification/update", methods=["POST"])
     def classification_update():
@@ -216,11 +337,12 @@ def register_routes(app):
             return jsonify({"success": False, "message": "Missing file_path parameter"}), 400
         
         existing = FileClassification.query.filter_by(file_path=file_path).first()
+        set_file_state_classification(file_path, classification or None)
         
         if not classification:
             if existing:
                 db.session.delete(existing)
-                db.session.commit()
+            db.session.commit()
             return jsonify({"success": True, "message": "Classification cleared successfully"})
         
         if existing:
@@ -309,30 +431,246 @@ def register_routes(app):
     @app.route("/api/status")
     def api_status():
         """API endpoint to check system status"""
+        watcher = current_app.config.get("FIM_WATCHER")
         return jsonify({
             "status": "running",
             "db_connected": True,
-            "watcher_active": True
+            "watcher_active": True,
+            "hash_queue": watcher.queue_stats() if watcher else None,
+            "memory": memory_budget.usage()
         })
     
+    @app.route("/api/io-budget", methods=["GET", "POST"])
+    def api_io_budget():
+        """Get or override the hashing I/O budget (bytes/second, null restores the schedule)"""
+        if request.method == "POST":
+            data = request.get_json() or {}
+            rate = data.get("rate")
+            if rate is not None and (not isinstance(rate, int) or rate < 0):
+                return jsonify({"success": False, "message": "rate must be a non-negative integer or null"}), 400
+            io_budget.set_rate(rate)
+        return jsonify(io_budget.to_dict())
+    
     @app.route("/api/events")
     def api_events():
-        """API endpoint to get recent events"""
-        limit = request.args.get("limit", 100, type=int)
-        event_type = request.args.get("type")
+        """Keyset-paginated events ordered by (timestamp, id).
+
+        Filters: type, endpoint, path_prefix, since/until (ISO-8601 or epoch
+        seconds). Pass the returned next_cursor as cursor for the next page.
+        With order=asc the cursor is returned even on the last page so a
+        consumer can resume polling from where it stopped.
+        """
+        try:
+            limit = clamp_page_size(request.args.get("limit", type=int), maximum=API_EVENTS_MAX_PAGE_SIZE)
+            query = _filter_events(Event.query, request.args)
+            after = decode_cursor(request.args.get("cursor"))
+            if after and len(after) != 2:
+                raise ValueError("Invalid cursor")
+            after_key = (datetime.fromisoformat(after[0]), int(after[1])) if after else None
+        except (ValueError, TypeError) as e:
+            return jsonify({"success": False, "message": str(e)}), 400
         
-        query = Event.query
-        if event_type and event_type != "all":
-            query = query.filter_by(event_type=event_type)
+        ascending = request.args.get("order") == "asc"
+        
+        key = db.tuple_(Event.timestamp, Event.id)
+        if after_key:
+            query = query.filter(key > db.tuple_(*after_key) if ascending else key < db.tuple_(*after_key))
+        if ascending:
+            query = query.order_by(Event.timestamp.asc(), Event.id.asc())
+        else:
+            query = query.order_by(Event.timestamp.desc(), Event.id.desc())
         
-        events = query.order_by(Event.timestamp.desc()).limit(limit).all()
-        return jsonify([e.to_dict() for e in events])
+        events = query.limit(limit + 1).all()
+        has_more = len(events) > limit
+        events = events[:limit]
+        
+        next_cursor = None
+        if events and (has_more or ascending):
+            next_cursor = encode_cursor([events[-1].timestamp.isoformat(), events[-1].id])
+        elif ascending:
+            next_cursor = request.args.get("cursor")
+        
+        return jsonify({
+            "events": [e.to_dict() for e in events],
+            "next_cursor": next_cursor,
+            "has_more": has_more
+        })
+    
+    @app.route("/api/rollups")
+    def api_rollups():
+        """Hourly or daily event counts per endpoint and type (kept after partitions are dropped)"""
+        model = EventRollupDaily if request.args.get("granularity") == "day" else EventRollupHourly
+        try:
+            since = parse_timestamp(request.args.get("since"))
+            until = parse_timestamp(request.args.get("until"))
+        except ValueError as e:
+            return jsonify({"success": False, "message": str(e)}), 400
+        
+        query = model.query
+        if since:
+            query = query.filter(model.bucket >= since)
+        if until:
+            query = query.filter(model.bucket < until)
+        if request.args.get("endpoint"):
+            query = query.filter(model.endpoint == request.args.get("endpoint"))
+        if request.args.get("type"):
+            query = query.filter(model.event_type == request.args.get("type"))
+        
+        limit = clamp_page_size(request.args.get("limit", type=int), default=1000, maximum=10000)
+        rollups = query.order_by(model.bucket.desc()).limit(limit).all()
+        return jsonify([r.to_dict() for r in rollups])
+    
+    @app.route("/hashes", methods=["GET", "POST"])
+    def hash_lookup():
+        """Reverse lookup page: where has this content appeared, and where is it now"""
+        raw = request.form.get("hashes") if request.method == "POST" else request.args.get("hash", "")
+        hashes, invalid = _content_hashes((raw or "").replace(",", " ").split())
+        error = None
+        results = {}
+        try:
+            since = parse_timestamp(request.values.get("since"))
+            until = parse_timestamp(request.values.get("until"))
+        except ValueError as e:
+            since = until = None
+            error = str(e)
+        if len(hashes) > HASH_LOOKUP_MAX_HASHES:
+            error = f"At most {HASH_LOOKUP_MAX_HASHES} hashes per lookup"
+        elif hashes and not error:
+            results = lookup_content_hashes(hashes, since, until)
+        
+        return render_template(
+            "hashes.html",
+            hashes_text=raw or "",
+            since=request.values.get("since", ""),
+            until=request.values.get("until", ""),
+            results=results,
+            invalid=invalid,
+            error=error,
+            db_connected=True
+        )
+    
+    @app.route("/api/hashes/<content_hash>")
+    def api_hash(content_hash):
+        """Every path and endpoint that had this content, plus its current holders"""
+        hashes, _ = _content_hashes([content_hash])
+        if not hashes:
+            return jsonify({"success": False, "message": "Expected a SHA-256 hex digest"}), 400
+        try:
+            since = parse_timestamp(request.args.get("since"))
+            until = parse_timestamp(request.args.get("until"))
+        except ValueError as e:
+            return jsonify({"success": False, "message": str(e)}), 400
+        
+        result = lookup_content_hashes(hashes, since, until)[hashes[0]]
+        return jsonify(dict(result, hash=hashes[0]))
+    
+    @app.route("/api/hashes/lookup", methods=["POST"])
+    def api_hash_lookup():
+        """Bulk reverse lookup of up to HASH_LOOKUP_MAX_HASHES content hashes.
+
+        Takes {"hashes": [...], "since": ..., "until": ...} and returns the
+        result per hash (empty when never seen) plus the inputs that are not
+        SHA-256 hex digests.
+        """
+        payload = request.get_json(silent=True) or {}
+        values = payload.get("hashes")
+        if not isinstance(values, list):
+            return jsonify({"success": False, "message": "hashes must be a list"}), 400
+        if len(values) > HASH_LOOKUP_MAX_HASHES:
+            return jsonify({"success": False, "message": f"At most {HASH_LOOKUP_MAX_HASHES} hashes per request"}), 400
+        try:
+            since = parse_timestamp(payload.get("since"))
+            until = parse_timestamp(payload.get("until"))
+        except ValueError as e:
+            return jsonify({"success": False, "message": str(e)}), 400
+        
+        hashes, invalid = _content_hashes(values)
+        return jsonify({"results": lookup_content_hashes(hashes, since, until), "invalid": invalid})
+    
+    @app.route("/api/files")
+    def api_files():
+        """API endpoint to page through the latest state of each monitored file (keyset cursors)"""
+        args = request.args.copy()
+        if args.get("endpoint"):
+            args.setdefault("endpoints", args["endpoint"])
+        try:
+            page = _file_state_page(args)
+        except ValueError as e:
+            return jsonify({"success": False, "message": str(e)}), 400
+        return jsonify({"files": page["files"], "next_cursor": page["next_cursor"]})
     
     @app.route("/api/baselines")
     def api_baselines():
-        """API endpoint to get hash baselines"""
-        baselines = HashBaseline.query.all()
-        return jsonify([b.to_dict() for b in baselines])
+        """API endpoint to get hash baselines (streamed, so memory does not grow with the table)"""
+        baselines = HashBaseline.query.order_by(HashBaseline.id).yield_per(EXPORT_BATCH_SIZE)
+        chunks = json_array_chunks(b.to_dict() for b in baselines)
+        return Response(stream_with_context(chunks), mimetype="application/json")
+    
+    @app.route("/api/export/<table>")
+    def api_export(table):
+        """Stream baselines or events as NDJSON, CSV or columnar blocks, optionally gzipped.
+
+        Events accept the same filters as /api/events and are exported oldest first.
+        """
+        export_format = request.args.get("format", "ndjson")
+        if export_format not in EXPORT_FORMATS:
+            return jsonify({"success": False, "message": f"format must be one of {', '.join(EXPORT_FORMATS)}"}), 400
+        
+        if table == "baselines":
+            columns = BASELINE_EXPORT_COLUMNS
+            statement = db.select(*[HashBaseline.__table__.c[name] for name in columns]).order_by(HashBaseline.id)
+        elif table == "events":
+            columns = EVENT_EXPORT_COLUMNS
+            try:
+                statement = _filter_events(event_view_select(), request.args)
+            except ValueError as e:
+                return jsonify({"success": False, "message": str(e)}), 400
+            statement = statement.order_by(Event.timestamp, Event.id)
+        else:
+            return jsonify({"success": False, "message": "Unknown export"}), 404
+        
+        mimetype, extension = EXPORT_FORMATS[export_format]
+        filename = f"{table}.{extension}"
+        chunks = export_chunks(export_format, columns, stream_partitions(statement))
+        if request.args.get("gzip") in ("1", "true"):
+            chunks = gzip_chunks(chunks)
+            mimetype = "application/gzip"
+            filename += ".gz"
+        
+        return Response(
+            stream_with_context(chunks),
+            mimetype=mimetype,
+            headers={"Content-Disposition": f"attachment; filename={filename}"}
+        )
+    
+    @app.route("/api/ingest", methods=["POST"])
+    def api_ingest():
+        """Store a batch of events from a remote agent and acknowledge it.
+
+        The body is NDJSON (application/x-ndjson) or msgpack, optionally
+        gzip-compressed (Content-Encoding). X-Agent-Id names the agent and
+        Idempotency-Key the batch: sending the same batch again returns the
+        original ack instead of storing it twice.
+        """
+        if INGEST_TOKEN and request.headers.get("Authorization") != f"Bearer {INGEST_TOKEN}":
+            return jsonify({"success": False, "message": "Invalid ingest token"}), 401
+        agent_id = request.headers.get("X-Agent-Id", "").strip()
+        batch_id = request.headers.get("Idempotency-Key", "").strip()
+        if not agent_id or len(agent_id) > 255 or not batch_id or len(batch_id) > 64:
+            return jsonify({"success": False, "message": "X-Agent-Id and Idempotency-Key headers are required"}), 400
+        if request.mimetype not in INGEST_FORMATS:
+            return jsonify({"success": False, "message": f"Content-Type must be one of {', '.join(INGEST_FORMATS)}"}), 415
+        if (request.content_length or 0) > INGEST_MAX_BYTES:
+            return jsonify({"success": False, "message": f"Batch larger than {INGEST_MAX_BYTES} bytes"}), 413
+        
+        try:
+            records = decode_batch(request.get_data(), request.mimetype, request.headers.get("Content-Encoding"))
+        except ValueError as e:
+            return jsonify({"success": False, "message": str(e)}), 400
+        if len(records) > INGEST_MAX_EVENTS:
+            return jsonify({"success": False, "message": f"At most {INGEST_MAX_EVENTS} events per batch"}), 413
+        
+        return jsonify(ingest_batch(agent_id, batch_id, records))
     
     @app.route("/api/webhook/test", methods=["POST"])
     def webhook_test():
@@ -0,0 +1,260 @@
+"""Priority scheduling of hashing work by classification, path policy and size"""
+import fnmatch
+import heapq
+import itertools
+import math
+import os
+import struct
+import threading
+import time
+from typing import Callable, Dict, List, Optional, Tuple
+
+from config import CLASSIFICATION_LEVELS, PRIORITY_AGING_SECONDS, PRIORITY_PATH_RULES, SPILL_DIRECTORY
+from memory import MemoryBudget, memory_budget
+
+SIZE_PENALTY_BASE = 1024 * 1024
+SIZE_PENALTY_PER_DOUBLING = 0.25
+
+# Approximate in-memory cost of a queued item beyond its path: heap tuple,
+# floats, counter and the per-path bookkeeping entries
+QUEUE_ITEM_OVERHEAD = 400
+# Share of the memory budget a level above every spilled level may overdraw
+PRIORITY_OVERDRAFT = 0.25
+EVENT_TYPES = ('created', 'modified', 'deleted')
+# key, enqueued_at, event type code, classification code, path length
+SPILL_RECORD = struct.Struct("<ddBBH")
+
+
+def inherited_classification(file_path: str, classifications: Dict[str, str]) -> Optional[str]:
+    """Resolve a file's classification, falling back to the nearest classified parent directory"""
+    path = os.path.abspath(file_path)
+    while True:
+        level = classifications.get(path)
+        if level:
+            return level
+        parent = os.path.dirname(path)
+        if parent == path:
+            return None
+        path = parent
+
+
+def path_policy_weight(file_path: str, rules: List[Tuple[str, float]] = None) -> float:
+    """Sum of the weights of all path policy rules matching the file"""
+    rules = PRIORITY_PATH_RULES if rules is None else rules
+    return sum(weight for pattern, weight in rules if fnmatch.fnmatch(file_path, pattern))
+
+
+def work_cost(classification: Optional[str], policy_weight: float, file_size: Optional[int]) -> float:
+    """Cost of a work item in classification levels (lower runs first)"""
+    rank = CLASSIFICATION_LEVELS.index(classification) if classification in CLASSIFICATION_LEVELS else 0
+    cost = -(rank + policy_weight)
+    if file_size and file_size > SIZE_PENALTY_BASE:
+        cost += math.log2(file_size / SIZE_PENALTY_BASE) * SIZE_PENALTY_PER_DOUBLING
+    return cost
+
+
+class SpillQueue:
+    """FIFO of queued items kept in a compact binary file while memory is exhausted"""
+
+    def __init__(self, directory: str = None, name: str = "hash-queue"):
+        directory = directory or SPILL_DIRECTORY
+        os.makedirs(directory, exist_ok=True)
+        self.path = os.path.join(directory, f"{name}-{os.getpid()}.spill")
+        self._fh = open(self.path, "w+b")
+        self._read_offset = 0
+        self._write_offset = 0
+        self._head = None
+        self.count = 0
+
+    def push(self, key: float, enqueued_at: float, file_path: str, event_type: str,
+             classification: str) -> None:
+        encoded = file_path.encode("utf-8", "surrogateescape")
+        self._fh.seek(self._write_offset)
+        self._fh.write(SPILL_RECORD.pack(key, enqueued_at, EVENT_TYPES.index(event_type),
+                                         CLASSIFICATION_LEVELS.index(classification), len(encoded)))
+        self._fh.write(encoded)
+        self._write_offset = self._fh.tell()
+        self.count += 1
+
+    def peek(self) -> Tuple[float, float, str, str, str, int]:
+        """Oldest item and the offset just past it (pass to advance once it is taken)"""
+        if self._head is not None:
+            return self._head
+        self._fh.flush()
+        self._fh.seek(self._read_offset)
+        key, enqueued_at, event_code, class_code, length = SPILL_RECORD.unpack(self._fh.read(SPILL_RECORD.size))
+        file_path = self._fh.read(length).decode("utf-8", "surrogateescape")
+        self._head = (key, enqueued_at, file_path, EVENT_TYPES[event_code], CLASSIFICATION_LEVELS[class_code],
+                      self._fh.tell())
+        return self._head
+
+    def advance(self, offset: int) -> None:
+        self._read_offset = offset
+        self._head = None
+        self.count -= 1
+        if not self.count:
+            # Empty again: reuse the file from the start
+            self._fh.truncate(0)
+            self._read_offset = self._write_offset = 0
+
+    def close(self) -> None:
+        self._fh.close()
+        os.remove(self.path)
+
+
+class HashWorkQueue:
+    """Priority queue of pending file events with linear aging.
+
+    An item's effective cost is ``cost - waited / aging_seconds``. Because
+    every item ages at the same rate, ordering by
+    ``cost * aging_seconds + enqueued_at`` is equivalent and never changes
+    while the item waits, so a plain heap is enough.
+
+    The heap is charged to the memory budget. Once the budget is exhausted new
+    items go to an on-disk SpillQueue, one per classification level, and are
+    moved back into the heap as it drains, the most urgent spill head first.
+    While a level has spilled items, its new items spill behind them, which
+    keeps each path's events in order (a path's events share a level unless
+    it is reclassified mid-burst). A level above every spilled level may
+    overdraw the budget by PRIORITY_OVERDRAFT of its limit, so a burst of
+    low-priority work does not hold back a Top Secret change.
+    """
+
+    def __init__(self, classification_lookup: Callable[[str], Optional[str]] = None,
+                 aging_seconds: float = None, budget: MemoryBudget = None,
+                 spill_directory: str = None):
+        self.classification_lookup = classification_lookup or (lambda path: None)
+        self.aging_seconds = aging_seconds or PRIORITY_AGING_SECONDS
+        self.budget = budget or memory_budget
+        self._spills = {
+            level: SpillQueue(spill_directory, f"hash-queue-{rank}")
+            for rank, level in enumerate(CLASSIFICATION_LEVELS)
+        }
+        self._heap = []
+        self._counter = itertools.count()
+        self._last_key: Dict[str, float] = {}
+        self._pending: Dict[str, int] = {}
+        self._cond = threading.Condition()
+        self._closed = False
+        self._max_wait: Dict[str, float] = {}
+
+    def put(self, file_path: str, event_type: str) -> None:
+        """Queue a file event, scoring it by classification, path policy and size"""
+        classification = self.classification_lookup(file_path)
+        try:
+            file_size = os.stat(file_path).st_size if event_type != 'deleted' else None
+        except OSError:
+            file_size = None
+        cost = work_cost(classification, path_policy_weight(file_path), file_size)
+        enqueued_at = time.monotonic()
+        key = cost * self.aging_seconds + enqueued_at
+
+        with self._cond:
+            # Events for one path must keep their arrival order
+            key = max(key, self._last_key.get(file_path, key))
+            if classification not in CLASSIFICATION_LEVELS:
+                classification = 'Unclassified'
+            spill = self._spills[classification]
+            # Once a level is spilled, its later items queue behind it on disk
+            if spill.count or not self._reserve(classification, QUEUE_ITEM_OVERHEAD + len(file_path)):
+                if not self._spilled_count():
+                    print("[QUEUE] Memory budget exhausted, spilling hashing queue to disk")
+                spill.push(key, enqueued_at, file_path, event_type, classification)
+            else:
+                self._push(key, file_path, event_type, classification, enqueued_at)
+            self._cond.notify()
+
+    def _spilled_count(self) -> int:
+        return sum(spill.count for spill in self._spills.values())
+
+    def _reserve(self, classification: str, nbytes: int) -> bool:
+        """Charge a heap item to the budget, overdrawing it for levels above every spilled level"""
+        if self.budget.reserve('hash_queue', nbytes):
+            return True
+        rank = CLASSIFICATION_LEVELS.index(classification)
+        spilled = [CLASSIFICATION_LEVELS.index(level) for level, spill in self._spills.items() if spill.count]
+        if not spilled or rank <= max(spilled):
+            return False
+        if self.budget.available() - nbytes < -self.budget.limit * PRIORITY_OVERDRAFT:
+            return False
+        return self.budget.reserve('hash_queue', nbytes, force=True)
+
+    def _push(self, key: float, file_path: str, event_type: str, classification: str,
+              enqueued_at: float) -> None:
+        self._last_key[file_path] = key
+        self._pending[file_path] = self._pending.get(file_path, 0) + 1
+        heapq.heappush(self._heap, (key, next(self._counter), file_path, event_type,
+                                    classification, enqueued_at))
+
+    def _refill(self) -> None:
+        """Move spilled items back into the heap, most urgent head first, while the budget allows"""
+        while True:
+            heads = [(spill.peek(), spill) for spill in self._spills.values() if spill.count]
+            if not heads:
+                return
+            (key, enqueued_at, file_path, event_type, classification, offset), spill = min(
+                heads, key=lambda head: head[0][0]
+            )
+            # Always admit one item into an empty heap so the queue makes progress
+            if not self.budget.reserve('hash_queue', QUEUE_ITEM_OVERHEAD + len(file_path),
+                                       force=not self._heap):
+                return
+            spill.advance(offset)
+            key = max(key, self._last_key.get(file_path, key))
+            self._push(key, file_path, event_type, classification, enqueued_at)
+
+    def get(self, timeout: float = None) -> Optional[Tuple[str, str]]:
+        """Pop the most urgent (file_path, event_type), or None on timeout/close"""
+        with self._cond:
+            while not self._heap:
+                if self._spilled_count():
+                    self._refill()
+                    continue
+                if self._closed or not self._cond.wait(timeout):
+                    return None
+            _, _, file_path, event_type, classification, enqueued_at = heapq.heappop(self._heap)
+            self.budget.release('hash_queue', QUEUE_ITEM_OVERHEAD + len(file_path))
+            if self._spilled_count() and self.budget.available() > self.budget.limit // 4:
+                self._refill()
+
+            remaining = self._pending[file_path] - 1
+            if remaining:
+                self._pending[file_path] = remaining
+            else:
+                del self._pending[file_path]
+                del self._last_key[file_path]
+
+            waited = time.monotonic() - enqueued_at
+            if waited > self._max_wait.get(classification, 0.0):
+                self._max_wait[classification] = waited
+            return file_path, event_type
+
+    def close(self) -> None:
+        """Wake up waiting consumers; queued items (including spilled ones) can still be drained"""
+        with self._cond:
+            self._closed = True
+            self._cond.notify_all()
+
+    @property
+    def closed(self) -> bool:
+        with self._cond:
+            return self._closed and not self._heap and not self._spilled_count()
+
+    def discard_spill(self) -> None:
+        """Remove the spill file once the queue is no longer used"""
+        with self._cond:
+            for spill in self._spills.values():
+                spill.close()
+
+    def __len__(self) -> int:
+        with self._cond:
+            return len(self._heap) + self._spilled_count()
+
+    def stats(self) -> Dict:
+        """Queue depth and worst observed wait (seconds) per classification"""
+        with self._cond:
+            return {
+                "depth": len(self._heap) + self._spilled_count(),
+                "spilled": self._spilled_count(),
+                "max_wait_seconds": {k: round(v, 3) for k, v in self._max_wait.items()},
+            }
@@ -0,0 +1,169 @@
+"""Ship spooled events from a remote agent to the central server's /api/ingest"""
+import gzip
+import json
+import random
+import threading
+import time
+from typing import Dict, List, Optional, Tuple
+
+import requests
+
+from config import (
+    INGEST_URL, INGEST_TOKEN, AGENT_ID, ENDPOINT_NAME, HOSTNAME, USERNAME,
+    SHIP_BATCH_EVENTS, SHIP_BATCH_BYTES, SHIP_BATCH_SECONDS, SHIP_REQUEST_TIMEOUT,
+    SPOOL_DRAIN_BATCH, SPOOL_SHUTDOWN_TIMEOUT,
+)
+from spool import EventSpool, DEAD_LETTER_FILE
+
+# Client errors that say nothing about the batch itself, retried like an outage
+RETRYABLE_CLIENT_ERRORS = (401, 403, 408, 429)
+
+
+class BatchRejected(Exception):
+    """The server refused the batch itself (a 4xx); resending it cannot succeed"""
+
+
+class ServerBusy(Exception):
+    """The server answered 429 or 503 and asked to be retried after retry_after seconds"""
+
+    def __init__(self, status: int, retry_after: float):
+        super().__init__(f"HTTP {status}, retry after {retry_after:g}s")
+        self.retry_after = retry_after
+
+
+class EventShipper:
+    """Send spooled events to the server in batches; the spool is acked only once the server acks.
+
+    A batch is sent once it holds SHIP_BATCH_EVENTS events or about
+    SHIP_BATCH_BYTES of JSON, or once its oldest event has waited
+    SHIP_BATCH_SECONDS. Its idempotency key is the spool's id and the range
+    it covers, so a batch resent after a lost response, or after a restart,
+    is not stored twice, while a reinstalled agent with a fresh spool cannot
+    collide with its old keys. A batch the server refuses with a 4xx (other
+    than RETRYABLE_CLIENT_ERRORS) is moved to the spool's dead-letter file
+    and acked so later events keep flowing. Drop-in replacement for
+    SpoolDrainer.
+    """
+
+    def __init__(self, spool: EventSpool, url: str = None):
+        self.spool = spool
+        self.url = url or INGEST_URL
+        # One keep-alive connection to the server
+        self.session = requests.Session()
+        self._stop = threading.Event()
+        self._deadline = None
+        self._thread = None
+
+    def start(self) -> None:
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def _record(self, record: Dict) -> str:
+        return json.dumps(
+            dict(record, endpoint=ENDPOINT_NAME, hostname=HOSTNAME, username=USERNAME),
+            separators=(",", ":")
+        )
+
+    def send(self, lines: List[str], key: str) -> Dict:
+        """POST one gzip NDJSON batch and return the server's ack; raises on any failure"""
+        headers = {
+            "Content-Type": "application/x-ndjson",
+            "Content-Encoding": "gzip",
+            "X-Agent-Id": AGENT_ID,
+            "Idempotency-Key": key,
+        }
+        if INGEST_TOKEN:
+            headers["Authorization"] = f"Bearer {INGEST_TOKEN}"
+        body = gzip.compress(("\n".join(lines) + "\n").encode(), compresslevel=6)
+        response = self.session.post(self.url, data=body, headers=headers, timeout=SHIP_REQUEST_TIMEOUT)
+        retry_after = response.headers.get("Retry-After", "")
+        if response.status_code in (429, 503) and retry_after.isdigit():
+            raise ServerBusy(response.status_code, float(retry_after))
+        if 400 <= response.status_code < 500 and response.status_code not in RETRYABLE_CLIENT_ERRORS:
+            raise BatchRejected(f"HTTP {response.status_code}: {response.text[:200]}")
+        if response.status_code != 200:
+            raise RuntimeError(f"HTTP {response.status_code}: {response.text[:200]}")
+        return response.json()
+
+    def _run(self) -> None:
+        backoff = 0.0
+        lines: List[str] = []
+        size = 0
+        start: Optional[Tuple[int, int]] = None
+        end: Optional[Tuple[int, int]] = None
+        first_read_at = 0.0
+        ready = False
+        while True:
+            if not ready:
+                if not lines:
+                    start = (self.spool.read_seq, self.spool.read_offset)
+                records, position = self.spool.read_batch(min(SHIP_BATCH_EVENTS - len(lines), SPOOL_DRAIN_BATCH))
+                if records:
+                    if not lines:
+                        first_read_at = time.monotonic()
+                    end = position
+                    for record in records:
+                        line = self._record(record)
+                        lines.append(line)
+                        size += len(line) + 1
+
+                waited = time.monotonic() - first_read_at
+                ready = bool(lines) and (
+                    len(lines) >= SHIP_BATCH_EVENTS or size >= SHIP_BATCH_BYTES
+                    or waited >= SHIP_BATCH_SECONDS or self._stop.is_set()
+                )
+                if not ready:
+                    if not lines and self._stop.is_set():
+                        return
+                    if not records:
+                        self._stop.wait(0.2)
+                    continue
+
+            if self._deadline and time.monotonic() > self._deadline:
+                print(f"[SHIPPER] Shutdown timeout, {len(lines)} event(s) left for next start")
+                return
+
+            key = f"{self.spool.spool_id}:{start[0]}.{start[1]}-{end[0]}.{end[1]}"
+            try:
+                ack = self.send(lines, key)
+            except ServerBusy as e:
+                # Wait as long as the server asks, spread so agents do not return together
+                if not backoff:
+                    print(f"[SHIPPER] Server busy, buffering events: {e}")
+                backoff = e.retry_after
+                self._wait(e.retry_after * random.uniform(1.0, 1.5))
+                continue
+            except BatchRejected as e:
+                print(f"[SHIPPER] Server refused batch {key} ({len(lines)} event(s)), moved to {DEAD_LETTER_FILE}: {e}")
+                self.spool.dead_letter([json.loads(line) for line in lines], str(e))
+                self.spool.ack(end)
+                lines, size, ready = [], 0, False
+                continue
+            except Exception as e:
+                if not backoff:
+                    print(f"[SHIPPER] Server unavailable, buffering events: {e}")
+                backoff = min(backoff * 2 or 0.5, 30.0)
+                self._wait(backoff)
+                continue
+
+            if backoff:
+                print("[SHIPPER] Server reachable again, shipping buffered events")
+                backoff = 0.0
+            for rejection in ack.get("rejected", []):
+                print(f"[SHIPPER] Server rejected event {rejection['index']} of batch {key}: {rejection['message']}")
+            self.spool.ack(end)
+            lines, size, ready = [], 0, False
+
+    def _wait(self, seconds: float) -> None:
+        if self._stop.is_set():
+            time.sleep(min(seconds, 1.0))
+        else:
+            self._stop.wait(seconds)
+
+    def stop(self, timeout: float = SPOOL_SHUTDOWN_TIMEOUT) -> None:
+        """Ship what is spooled within timeout, then stop"""
+        self._deadline = time.monotonic() + timeout
+        self._stop.set()
+        if self._thread:
+            self._thread.join(timeout + 1)
+        self.session.close()
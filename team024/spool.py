@@ -0,0 +1,301 @@
+"""Durable append-only event spool between the watcher and the database"""
+import json
+import os
+import secrets
+import struct
+import threading
+import time
+import zlib
+from datetime import datetime
+from typing import Callable, Dict, List, Optional, Tuple, Type
+
+from config import (
+    SPOOL_DIRECTORY, SPOOL_SEGMENT_BYTES, SPOOL_FSYNC_INTERVAL,
+    SPOOL_DRAIN_BATCH, SPOOL_SHUTDOWN_TIMEOUT, SPOOL_MAX_ATTEMPTS,
+)
+
+# Each record is <payload length><crc32 of payload><JSON payload>
+RECORD_HEADER = struct.Struct("<II")
+SEGMENT_SUFFIX = ".seg"
+ACK_FILE = "ack"
+ID_FILE = "id"
+# Events that can never be stored, one JSON object per line, kept for inspection
+DEAD_LETTER_FILE = "dead-letter.jsonl"
+
+
+class EventSpool:
+    """Append-only segment files holding events until they are in the database.
+
+    Writers append without waiting for the disk; a flusher thread fsyncs the
+    active segment every SPOOL_FSYNC_INTERVAL seconds so many events share one
+    fsync. The reader position is checkpointed in the ack file and fully
+    acknowledged segments are deleted.
+    """
+
+    def __init__(self, directory: str = None):
+        self.directory = directory or SPOOL_DIRECTORY
+        os.makedirs(self.directory, exist_ok=True)
+        self.spool_id = self._load_id()
+        self._lock = threading.Lock()
+        self._dirty = False
+        self._closed = False
+
+        self.read_seq, self.read_offset = self._load_ack()
+        segments = self._segments()
+        if segments and self.read_seq < segments[0]:
+            self.read_seq, self.read_offset = segments[0], 0
+        # Never append to a segment that may end in a torn record
+        self.write_seq = max(segments[-1] + 1 if segments else 0, self.read_seq)
+        self._write_fd = self._open_segment(self.write_seq)
+        self._write_size = 0
+        self._read_fh = None
+
+        self._flusher = threading.Thread(target=self._flush_loop, daemon=True)
+        self._flusher.start()
+
+    def _segment_path(self, seq: int) -> str:
+        return os.path.join(self.directory, f"{seq:016d}{SEGMENT_SUFFIX}")
+
+    def _segments(self) -> List[int]:
+        return sorted(
+            int(name[:-len(SEGMENT_SUFFIX)])
+            for name in os.listdir(self.directory)
+            if name.endswith(SEGMENT_SUFFIX)
+        )
+
+    def _open_segment(self, seq: int) -> int:
+        return os.open(self._segment_path(seq), os.O_WRONLY | os.O_CREAT | os.O_APPEND, 0o600)
+
+    def _load_id(self) -> str:
+        """Random id of this spool, created with it; a wiped spool gets a new one"""
+        path = os.path.join(self.directory, ID_FILE)
+        try:
+            with open(path) as f:
+                spool_id = f.read().strip()
+            if spool_id:
+                return spool_id
+        except FileNotFoundError:
+            pass
+        spool_id = secrets.token_hex(8)
+        with open(path + ".tmp", "w") as f:
+            f.write(spool_id)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(path + ".tmp", path)
+        return spool_id
+
+    def _load_ack(self) -> Tuple[int, int]:
+        try:
+            with open(os.path.join(self.directory, ACK_FILE)) as f:
+                seq, offset = f.read().split()
+                return int(seq), int(offset)
+        except (FileNotFoundError, ValueError):
+            return 0, 0
+
+    def append(self, event: Dict) -> None:
+        """Append one event; it becomes durable at the next batched fsync"""
+        payload = json.dumps(event, separators=(",", ":")).encode()
+        record = RECORD_HEADER.pack(len(payload), zlib.crc32(payload)) + payload
+        with self._lock:
+            if self._write_size >= SPOOL_SEGMENT_BYTES:
+                self._rotate()
+            os.write(self._write_fd, record)
+            self._write_size += len(record)
+            self._dirty = True
+
+    def _rotate(self) -> None:
+        os.fsync(self._write_fd)
+        os.close(self._write_fd)
+        self.write_seq += 1
+        self._write_fd = self._open_segment(self.write_seq)
+        self._write_size = 0
+        self._dirty = False
+
+    def flush(self) -> None:
+        """fsync everything appended so far"""
+        with self._lock:
+            if self._dirty and not self._closed:
+                os.fsync(self._write_fd)
+                self._dirty = False
+
+    def _flush_loop(self) -> None:
+        while not self._closed:
+            time.sleep(SPOOL_FSYNC_INTERVAL)
+            self.flush()
+
+    def read_batch(self, max_records: int = SPOOL_DRAIN_BATCH) -> Tuple[List[Dict], Tuple[int, int]]:
+        """Read up to max_records unacknowledged events and the position after them"""
+        events = []
+        while len(events) < max_records:
+            if self._read_fh is None:
+                try:
+                    self._read_fh = open(self._segment_path(self.read_seq), "rb")
+                except FileNotFoundError:
+                    if self.read_seq >= self.write_seq:
+                        break
+                    self.read_seq, self.read_offset = self.read_seq + 1, 0
+                    continue
+                self._read_fh.seek(self.read_offset)
+
+            record = self._read_record()
+            if record is not None:
+                events.append(record)
+                continue
+
+            with self._lock:
+                sealed = self.read_seq < self.write_seq
+            if not sealed:
+                break
+            # The segment was rotated; pick up anything written before rotation
+            record = self._read_record()
+            if record is not None:
+                events.append(record)
+                continue
+            self._read_fh.close()
+            self._read_fh = None
+            self.read_seq, self.read_offset = self.read_seq + 1, 0
+        return events, (self.read_seq, self.read_offset)
+
+    def _read_record(self) -> Optional[Dict]:
+        header = self._read_fh.read(RECORD_HEADER.size)
+        if len(header) == RECORD_HEADER.size:
+            length, crc = RECORD_HEADER.unpack(header)
+            payload = self._read_fh.read(length)
+            if len(payload) == length:
+                if zlib.crc32(payload) != crc:
+                    print(f"[SPOOL] Corrupt record in segment {self.read_seq} at {self.read_offset}, skipping rest of segment")
+                    self._read_fh.seek(0, os.SEEK_END)
+                    self.read_offset = self._read_fh.tell()
+                    return None
+                self.read_offset += RECORD_HEADER.size + length
+                return json.loads(payload)
+        # Incomplete record: the writer has not finished it yet
+        self._read_fh.seek(self.read_offset)
+        return None
+
+    def ack(self, position: Tuple[int, int]) -> None:
+        """Checkpoint the reader position and delete fully consumed segments"""
+        seq, offset = position
+        path = os.path.join(self.directory, ACK_FILE)
+        with open(path + ".tmp", "w") as f:
+            f.write(f"{seq} {offset}")
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(path + ".tmp", path)
+        for old in self._segments():
+            if old >= seq:
+                break
+            os.remove(self._segment_path(old))
+
+    def dead_letter(self, events: List[Dict], reason: str) -> None:
+        """Set events aside in the dead-letter file so the ones behind them can proceed"""
+        failed_at = datetime.utcnow().isoformat()
+        with open(os.path.join(self.directory, DEAD_LETTER_FILE), "a") as f:
+            for event in events:
+                f.write(json.dumps({"failed_at": failed_at, "reason": reason, "event": event},
+                                   separators=(",", ":")) + "\n")
+            f.flush()
+            os.fsync(f.fileno())
+
+    def close(self) -> None:
+        """Flush and close the active segment"""
+        self.flush()
+        with self._lock:
+            self._closed = True
+            os.close(self._write_fd)
+        if self._read_fh:
+            self._read_fh.close()
+            self._read_fh = None
+
+    def stats(self) -> Dict:
+        """Bytes still waiting to be drained"""
+        pending = 0
+        for seq in self._segments():
+            if seq >= self.read_seq:
+                try:
+                    pending += os.path.getsize(self._segment_path(seq))
+                except FileNotFoundError:
+                    pass
+        return {"pending_bytes": max(pending - self.read_offset, 0), "segment": self.write_seq}
+
+
+class SpoolDrainer:
+    """Replay spooled events into the database, retrying with backoff while it is unreachable.
+
+    Exceptions of the transient types mean the database is unavailable and
+    are retried indefinitely. Any other failure counts against the event,
+    which is moved to the dead-letter file after SPOOL_MAX_ATTEMPTS tries so
+    it cannot hold up the events behind it.
+    """
+
+    def __init__(self, spool: EventSpool, apply_event: Callable[[Dict], None],
+                 transient: Tuple[Type[BaseException], ...] = ()):
+        self.spool = spool
+        self.apply_event = apply_event
+        self.transient = transient
+        self._stop = threading.Event()
+        self._deadline = None
+        self._thread = None
+
+    def start(self) -> None:
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def _run(self) -> None:
+        backoff = 0.0
+        attempts = 0
+        pending: List[Dict] = []
+        position = None
+        while True:
+            if not pending:
+                pending, position = self.spool.read_batch()
+                if not pending:
+                    if self._stop.is_set():
+                        return
+                    self._stop.wait(0.2)
+                    continue
+
+            if self._deadline and time.monotonic() > self._deadline:
+                print(f"[SPOOL] Shutdown timeout, {len(pending)} event(s) left for next start")
+                return
+
+            try:
+                while pending:
+                    self.apply_event(pending[0])
+                    pending.pop(0)
+                    attempts = 0
+            except self.transient as e:
+                if not backoff:
+                    print(f"[SPOOL] Database unavailable, buffering events: {e}")
+                backoff = min(backoff * 2 or 0.5, 30.0)
+                self._wait(backoff)
+                continue
+            except Exception as e:
+                attempts += 1
+                event_uid = pending[0].get("event_uid") if isinstance(pending[0], dict) else None
+                if attempts >= SPOOL_MAX_ATTEMPTS:
+                    print(f"[SPOOL] Event {event_uid} failed {attempts} times, moved to {DEAD_LETTER_FILE}: {e}")
+                    self.spool.dead_letter([pending.pop(0)], str(e))
+                    attempts = 0
+                    continue
+                print(f"[SPOOL] Event {event_uid} failed (attempt {attempts} of {SPOOL_MAX_ATTEMPTS}): {e}")
+                self._wait(0.5 * 2 ** (attempts - 1))
+                continue
+
+            if backoff:
+                print("[SPOOL] Database reachable again, replaying buffered events")
+                backoff = 0.0
+            self.spool.ack(position)
+
+    def _wait(self, seconds: float) -> None:
+        if self._stop.is_set():
+            time.sleep(min(seconds, 1.0))
+        else:
+            self._stop.wait(seconds)
+
+    def stop(self, timeout: float = SPOOL_SHUTDOWN_TIMEOUT) -> None:
+        """Drain what is spooled within timeout, then stop"""
+        self._deadline = time.monotonic() + timeout
+        self._stop.set()
+        if self._thread:
+            self._thread.join(timeout + 1)
@@ -0,0 +1,189 @@
+"""Synthetic agent swarm - load-tests /api/ingest with many concurrent agents
+
+Each simulated agent keeps one connection open and sends gzip NDJSON batches
+of random file events, one at a time, the way shipper.EventShipper does. It
+honours Retry-After on 429/503 and resends the same idempotency key after an
+error. A summary of throughput, latency and backpressure is printed at the
+end.
+
+    python gateway.py &
+    python swarm.py --agents 2000 --batches 20 --events 200
+
+Raise the open file limit (ulimit -n) above the number of agents first.
+"""
+import argparse
+import asyncio
+import gzip
+import hashlib
+import json
+import os
+import random
+import time
+import uuid
+from collections import Counter
+from datetime import datetime
+from typing import Dict, List, Optional, Tuple
+from urllib.parse import urlsplit
+
+from config import GATEWAY_PORT, INGEST_TOKEN
+
+
+def _records(agent_id: str, count: int, paths: int) -> List[Dict]:
+    """Random events on the agent's own set of paths"""
+    records = []
+    for _ in range(count):
+        event_type = random.choices(("created", "modified", "deleted"), (1, 8, 1))[0]
+        digest = None if event_type == "deleted" else hashlib.sha256(os.urandom(16)).hexdigest()
+        records.append({
+            "event_uid": uuid.uuid4().hex,
+            "event_type": event_type,
+            "file_path": f"/swarm/{agent_id}/file{random.randrange(paths)}.dat",
+            "timestamp": datetime.utcnow().isoformat(),
+            "hash_after": digest,
+            "state_hash": digest,
+            "file_size": None if event_type == "deleted" else random.randrange(1 << 20),
+            "endpoint": agent_id,
+            "hostname": agent_id,
+            "username": "swarm",
+        })
+    return records
+
+
+class SwarmAgent:
+    """One simulated agent with a keep-alive connection to the server"""
+
+    def __init__(self, agent_id: str, host: str, port: int, path: str, stats: Counter, latencies: List[float]):
+        self.agent_id = agent_id
+        self.host = host
+        self.port = port
+        self.path = path
+        self.stats = stats
+        self.latencies = latencies
+        self.reader: Optional[asyncio.StreamReader] = None
+        self.writer: Optional[asyncio.StreamWriter] = None
+
+    async def _post(self, body: bytes, key: str) -> Tuple[int, Dict[str, str], bytes]:
+        if self.writer is None:
+            self.reader, self.writer = await asyncio.open_connection(self.host, self.port)
+            self.stats["connections"] += 1
+        head = [
+            f"POST {self.path} HTTP/1.1",
+            f"Host: {self.host}:{self.port}",
+            "Content-Type: application/x-ndjson",
+            "Content-Encoding: gzip",
+            f"Content-Length: {len(body)}",
+            f"X-Agent-Id: {self.agent_id}",
+            f"Idempotency-Key: {key}",
+        ]
+        if INGEST_TOKEN:
+            head.append(f"Authorization: Bearer {INGEST_TOKEN}")
+        self.writer.write(("\r\n".join(head) + "\r\n\r\n").encode("latin-1") + body)
+        await self.writer.drain()
+
+        status_line, *lines = (await self.reader.readuntil(b"\r\n\r\n")).decode("latin-1").split("\r\n")
+        headers = {}
+        for line in lines:
+            name, _, value = line.partition(":")
+            if name:
+                headers[name.strip().lower()] = value.strip()
+        payload = await self.reader.readexactly(int(headers.get("content-length", "0")))
+        if headers.get("connection", "").lower() == "close":
+            self._close()
+        return int(status_line.split(" ")[1]), headers, payload
+
+    def _close(self) -> None:
+        if self.writer is not None:
+            self.writer.close()
+        self.reader = self.writer = None
+
+    async def run(self, batches: int, events: int, paths: int, interval: float) -> None:
+        for number in range(batches):
+            body = gzip.compress(
+                "".join(json.dumps(r, separators=(",", ":")) + "\n" for r in _records(self.agent_id, events, paths)).encode()
+            )
+            key = f"swarm-{number}"
+            started = time.monotonic()
+            backoff = 0.5
+            while True:
+                try:
+                    status, headers, payload = await self._post(body, key)
+                except (OSError, asyncio.IncompleteReadError):
+                    self.stats["connection_errors"] += 1
+                    self._close()
+                    await asyncio.sleep(backoff * random.uniform(1.0, 1.5))
+                    backoff = min(backoff * 2, 30.0)
+                    continue
+
+                if status == 200:
+                    ack = json.loads(payload)
+                    self.stats["batches"] += 1
+                    self.stats[f"ack_{ack['status']}"] += 1
+                    self.stats["events_inserted"] += ack["inserted"]
+                    self.stats["events_skipped"] += ack["skipped"]
+                    self.stats["events_rejected"] += len(ack["rejected"])
+                    self.latencies.append(time.monotonic() - started)
+                    break
+                self.stats[f"http_{status}"] += 1
+                retry_after = headers.get("retry-after", "")
+                if status in (429, 503) and retry_after.isdigit():
+                    await asyncio.sleep(int(retry_after) * random.uniform(1.0, 1.5))
+                else:
+                    print(f"[SWARM] {self.agent_id}: HTTP {status}: {payload[:200].decode(errors='replace')}")
+                    await asyncio.sleep(backoff * random.uniform(1.0, 1.5))
+                    backoff = min(backoff * 2, 30.0)
+
+            if interval:
+                await asyncio.sleep(interval * random.uniform(0.5, 1.5))
+        self._close()
+
+
+def _percentile(values: List[float], fraction: float) -> float:
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * fraction))] if values else 0.0
+
+
+async def run_swarm(args) -> None:
+    url = urlsplit(args.url)
+    run = uuid.uuid4().hex[:8]
+    stats = Counter()
+    latencies: List[float] = []
+    agents = [
+        SwarmAgent(f"swarm-{run}-{n:05d}", url.hostname, url.port or 80, url.path or "/api/ingest", stats, latencies)
+        for n in range(args.agents)
+    ]
+    print(f"[SWARM] Run {run}: {args.agents} agent(s) x {args.batches} batch(es) x {args.events} event(s) -> {args.url}")
+
+    async def start(index: int, agent: SwarmAgent) -> None:
+        # Spread connection setup over the ramp-up period
+        await asyncio.sleep(args.ramp * index / max(1, len(agents)))
+        await agent.run(args.batches, args.events, args.paths, args.interval)
+
+    started = time.monotonic()
+    await asyncio.gather(*(start(i, agent) for i, agent in enumerate(agents)))
+    elapsed = time.monotonic() - started
+
+    sent = stats["batches"] * args.events
+    print(f"[SWARM] {stats['batches']} batch(es), {sent} event(s) acknowledged in {elapsed:.1f}s "
+          f"({sent / elapsed:.0f} events/s)")
+    print(f"[SWARM] Stored {stats['events_inserted']}, skipped {stats['events_skipped']}, "
+          f"rejected {stats['events_rejected']}")
+    print(f"[SWARM] Batch latency p50 {_percentile(latencies, 0.5):.2f}s, p95 {_percentile(latencies, 0.95):.2f}s, "
+          f"p99 {_percentile(latencies, 0.99):.2f}s, max {max(latencies, default=0):.2f}s")
+    print("[SWARM] Responses: " + ", ".join(f"{name} {count}" for name, count in sorted(stats.items())
+                                             if name.startswith(("ack_", "http_", "connection"))))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Simulate many agents posting to /api/ingest")
+    parser.add_argument("--url", default=f"http://127.0.0.1:{GATEWAY_PORT}/api/ingest")
+    parser.add_argument("--agents", type=int, default=500)
+    parser.add_argument("--batches", type=int, default=10, help="batches per agent")
+    parser.add_argument("--events", type=int, default=100, help="events per batch")
+    parser.add_argument("--paths", type=int, default=50, help="distinct files per agent")
+    parser.add_argument("--interval", type=float, default=0.0, help="mean pause between an agent's batches (s)")
+    parser.add_argument("--ramp", type=float, default=5.0, help="seconds over which agents connect")
+    asyncio.run(run_swarm(parser.parse_args()))
+
+
+if __name__ == "__main__":
+    main()
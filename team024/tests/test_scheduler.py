@@ -0,0 +1,75 @@
+"""HashWorkQueue memory bound, spilling and priority under a synthetic burst"""
+import gc
+
+from memory import MemoryBudget, current_rss
+from scheduler import HashWorkQueue
+
+BURST_ITEMS = 2_000_000
+BUDGET_BYTES = 8 * 1024 * 1024
+# RSS growth allowed for the whole burst; unbounded, 2M queued items take ~700 MiB
+RSS_CEILING_BYTES = 48 * 1024 * 1024
+
+
+def _queue(tmp_path, budget_bytes=BUDGET_BYTES, secret_prefix=None):
+    def lookup(path):
+        return 'Top Secret' if secret_prefix and path.startswith(secret_prefix) else None
+    return HashWorkQueue(lookup, budget=MemoryBudget(budget_bytes), spill_directory=str(tmp_path))
+
+
+def test_burst_stays_under_rss_ceiling_and_spills(tmp_path):
+    queue = _queue(tmp_path)
+    gc.collect()
+    rss_before = current_rss()
+    peak = rss_before
+
+    for i in range(BURST_ITEMS):
+        queue.put(f"/burst/dir{i % 1000}/file{i}.dat", 'modified')
+        if i % 100_000 == 0:
+            peak = max(peak, current_rss())
+    peak = max(peak, current_rss())
+
+    assert peak - rss_before < RSS_CEILING_BYTES
+    stats = queue.stats()
+    assert stats["depth"] == BURST_ITEMS
+    assert stats["spilled"] > BURST_ITEMS // 2
+
+    drained = 0
+    while queue.get(timeout=0) is not None:
+        drained += 1
+        if drained % 100_000 == 0:
+            peak = max(peak, current_rss())
+    assert drained == BURST_ITEMS
+    assert queue.stats()["spilled"] == 0
+    assert peak - rss_before < RSS_CEILING_BYTES
+    queue.discard_spill()
+
+
+def test_high_priority_item_is_not_queued_behind_spill(tmp_path):
+    queue = _queue(tmp_path, budget_bytes=64 * 1024, secret_prefix="/secret/")
+    for i in range(10_000):
+        queue.put(f"/bulk/file{i}", 'modified')
+    assert queue.stats()["spilled"] > 0
+
+    queue.put("/secret/plans.txt", 'modified')
+    assert queue.get(timeout=0) == ("/secret/plans.txt", 'modified')
+    queue.discard_spill()
+
+
+def test_per_path_order_survives_spilling(tmp_path):
+    queue = _queue(tmp_path, budget_bytes=16 * 1024)
+    events = ['created', 'modified', 'modified', 'deleted']
+    for i in range(2_000):
+        queue.put(f"/bulk/file{i}", 'modified')
+        if i % 500 == 0:
+            queue.put("/tracked.txt", events[i // 500])
+    assert queue.stats()["spilled"] > 0
+
+    seen = []
+    while True:
+        item = queue.get(timeout=0)
+        if item is None:
+            break
+        if item[0] == "/tracked.txt":
+            seen.append(item[1])
+    assert seen == events
+    queue.discard_spill()
@@ -1,26 +1,99 @@
 """File system watcher for real-time integrity monitoring"""
 import os
 import time
+import itertools
 import json
 import threading
+import uuid
 from datetime import datetime
 from watchdog.observers import Observer
 from watchdog.events import FileSystemEventHandler
 
-from config import WATCH_DIRECTORY, ENDPOINT_NAME, HOSTNAME, USERNAME
+from config import (
+    WATCH_DIRECTORY, ENDPOINT_NAME, HOSTNAME, USERNAME, CLASSIFICATION_REFRESH_SECONDS, SPOOL_SHUTDOWN_TIMEOUT,
+)
 from hashing import calculate_state_hash, is_temp_file
+from scheduler import HashWorkQueue, inherited_classification
+from spool import EventSpool, SpoolDrainer
+from shipper import EventShipper
+from memory import memory_budget
+
+# Queued events not hashed before shutdown, requeued on the next start
+UNHASHED_FILE = "unhashed.jsonl"
 
 
 class FIMEventHandler(FileSystemEventHandler):
     """Handle file system events and record them to the database"""
     
-    def __init__(self, app_context):
+    def __init__(self, app_context, spool: EventSpool):
         super().__init__()
         self.app_context = app_context
+        self.spool = spool
         self._lock = threading.Lock()
+        self._classifications = {}
+        self._classifications_bytes = 0
+        self._classifications_loaded_at = 0.0
+        self.queue = HashWorkQueue(self._classification_of)
+        self._abort = threading.Event()
+        # Item being hashed, so an aborted worker's work is not lost
+        self.current = None
+    
+    def _classification_of(self, file_path: str):
+        """Cached classification lookup with directory-level inheritance"""
+        return inherited_classification(file_path, self._classifications)
+    
+    def _refresh_classifications(self):
+        """Reload the classification map used for scheduling priority"""
+        with self._lock, self.app_context:
+            from models import FileClassification
+            rows = FileClassification.query.with_entities(
+                FileClassification.file_path, FileClassification.classification
+            ).all()
+        self._classifications_loaded_at = time.monotonic()
+        
+        # Approximate dict entry + key + value cost; the cache gives way to queued work
+        needed = sum(len(path) + 150 for path, _ in rows)
+        memory_budget.release('classification_cache', self._classifications_bytes)
+        self._classifications, self._classifications_bytes = {}, 0
+        if not memory_budget.reserve('classification_cache', needed):
+            print("[FIM] Memory budget exhausted, scheduling without classifications")
+            return
+        self._classifications = {os.path.abspath(path): level for path, level in rows}
+        self._classifications_bytes = needed
+    
+    def _enqueue(self, file_path: str, event_type: str):
+        """Queue a file event for hashing by priority"""
+        if is_temp_file(file_path):
+            return
+        self.queue.put(os.path.abspath(file_path), event_type)
+    
+    def run_worker(self):
+        """Process queued events, most urgent first, until the queue is closed and drained (or aborted)"""
+        while not self._abort.is_set():
+            # Remote agents have no database; they schedule without classifications
+            if self.app_context is not None and \
+                    time.monotonic() - self._classifications_loaded_at > CLASSIFICATION_REFRESH_SECONDS:
+                try:
+                    self._refresh_classifications()
+                except Exception as e:
+                    self._classifications_loaded_at = time.monotonic()
+                    print(f"[FIM] Error loading classifications: {e}")
+            
+            item = self.queue.get(timeout=1)
+            if item is None:
+                if self.queue.closed:
+                    return
+                continue
+            self.current = item
+            self._record_event(*item)
+            self.current = None
+    
+    def abort(self):
+        """Make run_worker return after the item it is hashing"""
+        self._abort.set()
     
     def _record_event(self, file_path: str, event_type: str):
-        """Record a file event to the PostgreSQL database"""
+        """Hash a file event and append it to the durable spool"""
         if is_temp_file(file_path):
             return
         
@@ -29,76 +102,103 @@ class FIMEventHandler(FileSystemEventHandler):
         
         abs_path = os.path.abspath(file_path)
         
+        record = {
+            'event_uid': uuid.uuid4().hex,
+            'event_type': event_type,
+            'file_path': abs_path,
+            'timestamp': datetime.utcnow().isoformat(),
+            'hash_after': None,
+            'state_hash': None,
+            'file_size': None,
+            'metadata_json': None,
+        }
+        
+        if event_type != 'deleted' and os.path.exists(abs_path):
+            state_info = calculate_state_hash(abs_path)
+            if state_info:
+                record['hash_after'] = state_info['content_hash']
+                record['state_hash'] = state_info['state_hash']
+                record['file_size'] = state_info['file_size']
+                record['metadata_json'] = json.dumps(state_info['metadata'])
+        
+        self.spool.append(record)
+    
+    def apply_event(self, record: dict):
+        """Write a spooled event to the PostgreSQL database; safe to replay"""
         with self._lock:
             with self.app_context:
                 from app import db
-                from models import Event, HashBaseline, FileClassification
+                from models import Event, HashBaseline, record_file_state, record_rollups, file_metadata_columns
                 from alerts import process_event_alerts
+                from partitions import ensure_partition_for
+                from dimensions import event_dimensions
+                
+                timestamp = datetime.fromisoformat(record['timestamp'])
+                ensure_partition_for(timestamp)
+                
+                if Event.query.filter_by(event_uid=record['event_uid'], timestamp=timestamp).first():
+                    return
+                
+                abs_path = record['file_path']
+                event_type = record['event_type']
+                hash_after = record['hash_after']
+                metadata = file_metadata_columns(record['metadata_json'])
                 
                 hash_before = None
-                baseline = HashBaseline.query.filter_by(file_path=abs_path).first()
+                baseline = HashBaseline.query.filter_by(endpoint=ENDPOINT_NAME, file_path=abs_path).first()
                 if baseline:
                     hash_before = baseline.content_hash
                 
-                state_info = None
-                hash_after = None
-                file_size = None
-                state_hash = None
-                metadata_json = None
-                
-                if event_type != 'deleted' and os.path.exists(abs_path):
-                    state_info = calculate_state_hash(abs_path)
-                    if state_info:
-                        hash_after = state_info['content_hash']
-                        state_hash = state_info['state_hash']
-                        file_size = state_info['file_size']
-                        metadata_json = json.dumps(state_info['metadata'])
-                        
+                try:
+                    if hash_after:
                         if baseline:
                             if baseline.content_hash == hash_after:
                                 return
                             baseline.content_hash = hash_after
-                            baseline.state_hash = state_hash
-                            baseline.file_size = file_size
-                            baseline.metadata_json = metadata_json
+                            baseline.state_hash = record['state_hash']
+                            baseline.file_size = record['file_size']
+                            for column, value in metadata.items():
+                                setattr(baseline, column, value)
                             baseline.last_updated = datetime.utcnow()
                         else:
                             new_baseline = HashBaseline(
+                                endpoint=ENDPOINT_NAME,
                                 file_path=abs_path,
                                 content_hash=hash_after,
-                                state_hash=state_hash,
-                                file_size=file_size,
-                                metadata_json=metadata_json
+                                state_hash=record['state_hash'],
+                                file_size=record['file_size'],
+                                **metadata
                             )
                             db.session.add(new_baseline)
+                    
+                    if event_type == 'deleted' and baseline:
+                        db.session.delete(baseline)
+                    
+                    event = Event(
+                        event_uid=record['event_uid'],
+                        event_type=event_type,
+                        timestamp=timestamp,
+                        username=USERNAME,
+                        hash_before=hash_before,
+                        hash_after=hash_after,
+                        state_hash=record['state_hash'],
+                        file_size=record['file_size'],
+                        **metadata,
+                        **event_dimensions(abs_path, ENDPOINT_NAME, HOSTNAME)
+                    )
+                    db.session.add(event)
+                    db.session.flush()
+                    state = record_file_state(event)
+                    record_rollups([event])
+                    db.session.commit()
+                except Exception:
+                    db.session.rollback()
+                    raise
                 
-                if event_type == 'deleted' and baseline:
-                    db.session.delete(baseline)
-                
-                event = Event(
-                    event_type=event_type,
-                    file_path=abs_path,
-                    timestamp=datetime.utcnow(),
-                    endpoint=ENDPOINT_NAME,
-                    hostname=HOSTNAME,
-                    username=USERNAME,
-                    hash_before=hash_before,
-                    hash_after=hash_after,
-                    state_hash=state_hash,
-                    content_hash=hash_after,
-                    file_size=file_size,
-                    metadata_json=metadata_json
-                )
-                db.session.add(event)
+                print(f"[FIM] {event_type.upper()}: {abs_path}")
                 
                 try:
-                    db.session.commit()
-                    print(f"[FIM] {event_type.upper()}: {abs_path}")
-                    
-                    classification = None
-                    file_class = FileClassification.query.filter_by(file_path=abs_path).first()
-                    if file_class:
-                        classification = file_class.classification
+                    classification = state.classification
                     
                     from models import AlertConfig
                     configs = [c.to_dict() for c in AlertConfig.query.filter_by(is_active=True).all()]
@@ -107,38 +207,94 @@ class FIMEventHandler(FileSystemEventHandler):
                         event_data = event.to_dict()
                         event_data['classification'] = classification or 'Unclassified'
                         process_event_alerts(event_data, configs)
-                        
+                
                 except Exception as e:
                     db.session.rollback()
-                    print(f"[FIM] Error recording event: {e}")
+                    print(f"[FIM] Error sending alerts: {e}")
     
     def on_created(self, event):
         if not event.is_directory:
-            self._record_event(event.src_path, 'created')
+            self._enqueue(event.src_path, 'created')
     
     def on_modified(self, event):
         if not event.is_directory:
-            self._record_event(event.src_path, 'modified')
+            self._enqueue(event.src_path, 'modified')
     
     def on_deleted(self, event):
         if not event.is_directory:
-            self._record_event(event.src_path, 'deleted')
+            self._enqueue(event.src_path, 'deleted')
     
     def on_moved(self, event):
         if not event.is_directory:
-            self._record_event(event.src_path, 'deleted')
-            self._record_event(event.dest_path, 'created')
+            self._enqueue(event.src_path, 'deleted')
+            self._enqueue(event.dest_path, 'created')
 
 
 class DirectoryWatcher:
     """Manage the file system observer"""
     
-    def __init__(self, app_context, watch_path: str = None):
+    def __init__(self, app_context, watch_path: str = None, spool_path: str = None, ingest_url: str = None):
+        """Events are written to the database, or with ingest_url (and no app_context) shipped to a server"""
         self.watch_path = watch_path or WATCH_DIRECTORY
+        self.spool_path = spool_path
         self.app_context = app_context
+        self.ingest_url = ingest_url
         self.observer = None
+        self.handler = None
+        self.spool = None
+        self.drainer = None
+        self._worker = None
         self._running = False
     
+    def _start_pipeline(self):
+        """Start the hashing worker and the spool drainer (or shipper), returning the event handler"""
+        self.spool = EventSpool(self.spool_path)
+        self.handler = FIMEventHandler(self.app_context, self.spool)
+        self._requeue_unhashed()
+        if self.ingest_url:
+            self.drainer = EventShipper(self.spool, self.ingest_url)
+        else:
+            from sqlalchemy import exc
+            # Connection failures wait for the database; other errors count against the event
+            self.drainer = SpoolDrainer(self.spool, self.handler.apply_event, transient=(
+                exc.OperationalError, exc.InterfaceError, exc.DisconnectionError, exc.TimeoutError,
+            ))
+        self.drainer.start()
+        self._worker = threading.Thread(target=self.handler.run_worker, daemon=True)
+        self._worker.start()
+        return self.handler
+    
+    def _requeue_unhashed(self):
+        """Queue the events a previous shutdown left unhashed"""
+        path = os.path.join(self.spool.directory, UNHASHED_FILE)
+        if not os.path.exists(path):
+            return
+        count = 0
+        with open(path) as f:
+            for line in f:
+                file_path, event_type = json.loads(line)
+                self.handler.queue.put(file_path, event_type)
+                count += 1
+        os.remove(path)
+        print(f"[WATCHER] Requeued {count} event(s) left unhashed at last shutdown")
+    
+    def _save_unhashed(self):
+        """Write the events still queued (and the one being hashed) for the next start"""
+        path = os.path.join(self.spool.directory, UNHASHED_FILE)
+        items = [self.handler.current] if self._worker.is_alive() and self.handler.current else []
+        count = 0
+        with open(path + ".tmp", "w") as f:
+            for item in itertools.chain(items, iter(lambda: self.handler.queue.get(timeout=0), None)):
+                f.write(json.dumps(item) + "\n")
+                count += 1
+            f.flush()
+            os.fsync(f.fileno())
+        if count:
+            os.replace(path + ".tmp", path)
+            print(f"[WATCHER] Shutdown timeout, {count} unhashed event(s) saved for next start")
+        else:
+            os.remove(path + ".tmp")
+    
     def start(self):
         """Start watching the directory"""
         if not os.path.exists(self.watch_path):
@@ -146,7 +302,7 @@ class DirectoryWatcher:
             print(f"[WATCHER] Created watch directory: {self.watch_path}")
         
         self.observer = Observer()
-        handler = FIMEventHandler(self.app_context)
+        handler = self._start_pipeline()
         self.observer.schedule(handler, self.watch_path, recursive=True)
         self.observer.start()
         self._running = True
@@ -159,12 +315,33 @@ class DirectoryWatcher:
             self.stop()
     
     def stop(self):
-        """Stop watching the directory"""
+        """Stop watching, then flush queued and spooled events before returning"""
         self._running = False
         if self.observer:
             self.observer.stop()
             self.observer.join()
             print("[WATCHER] Stopped monitoring")
+        if self.handler:
+            self.handler.queue.close()
+            # Hashing the whole backlog under the I/O budget can take hours
+            self._worker.join(SPOOL_SHUTDOWN_TIMEOUT)
+            if self._worker.is_alive():
+                self.handler.abort()
+                self._worker.join(SPOOL_SHUTDOWN_TIMEOUT)
+                self._save_unhashed()
+            self.handler.queue.discard_spill()
+            memory_budget.release('classification_cache', self.handler._classifications_bytes)
+            self.spool.flush()
+            self.drainer.stop()
+            self.spool.close()
+            self.handler = None
+            print("[WATCHER] Event spool flushed")
+    
+    def queue_stats(self):
+        """Hashing queue depth, per-classification wait times and spool backlog"""
+        if not self.handler:
+            return None
+        return dict(self.handler.queue.stats(), spool=self.spool.stats())
     
     def start_background(self):
         """Start watcher in background thread"""
@@ -173,7 +350,7 @@ class DirectoryWatcher:
             print(f"[WATCHER] Created watch directory: {self.watch_path}")
         
         self.observer = Observer()
-        handler = FIMEventHandler(self.app_context)
+        handler = self._start_pipeline()
         self.observer.schedule(handler, self.watch_path, recursive=True)
         self.observer.start()
         self._running = True